@@ -1,10 +1,22 @@
 import re
 import json
-from io import BytesIO
-from PIL import Image
+from typing import Any, Optional, Tuple
 import pytesseract
-from ..config import get_client, LLM_MODEL, TESSERACT_CMD
+from ..config import (
+    get_client,
+    LLM_MODEL,
+    TESSERACT_CMD,
+    OCR_CACHE_ENABLED,
+    OCR_PREPROCESS_ENABLED,
+    OCR_TARGET_DPI,
+    OCR_PAPER_MM,
+)
+from ..decode_cache import get_decode_cache
+from ..image_executor import IngestedImage, get_image_executor
+from ..imaging import ImageSource, as_gray
 from ..models import ReceiptData, Item
+from ..ocr_pool import OcrJobFailed, get_ocr_pool
+from ..ocr_preprocess import preprocess_for_ocr
 
 if TESSERACT_CMD:
     pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD
@@ -22,12 +34,40 @@ MERCHANT_HINTS = {
     "Pharmacy": ["walgreens", "cvs", "boots", "rite aid"],
 }
 
+# Preprocessed and raw OCR text differ, so they are cached apart.
+OCR_CACHE_KIND = "ocr+pre" if OCR_PREPROCESS_ENABLED else "ocr"
+
+
+def ocr_input(image: ImageSource, preprocess: Optional[bool] = None) -> Tuple[Any, Optional[int]]:
+    """The gray array to OCR (preprocessed if enabled) and its DPI, if known."""
+    gray = as_gray(image)
+    if not (OCR_PREPROCESS_ENABLED if preprocess is None else preprocess):
+        return gray, None
+    prepared = preprocess_for_ocr(gray, target_dpi=OCR_TARGET_DPI, paper_mm=OCR_PAPER_MM)
+    return prepared.image, prepared.dpi
+
+
+def ocr_image(image: ImageSource, preprocess: Optional[bool] = None) -> str:
+    """OCR an encoded upload or a decoded gray array.
+
+    Module-level so the image executor can pickle it.
+    """
+    try:
+        gray, dpi = ocr_input(image, preprocess)
+        return pytesseract.image_to_string(gray, config=f"--dpi {dpi}" if dpi else "")
+    except Exception:
+        # Tesseract binary not available; return empty string to trigger heuristic fallback
+        return ""
+
+
 class ReceiptAnalyzer:
     def __init__(self):
         self.client = get_client()
 
-    async def analyze(self, image_bytes: bytes, filename: str = "upload.jpg") -> ReceiptData:
-        text = self._ocr(image_bytes)
+    async def analyze(
+        self, image_bytes: bytes, filename: str = "upload.jpg", image: Optional[IngestedImage] = None
+    ) -> ReceiptData:
+        text = await self._ocr_text(image_bytes, image)
         # If an LLM is available, use it to structure the text; otherwise regex-heuristics
         if self.client:
             try:
@@ -59,13 +99,28 @@ class ReceiptAnalyzer:
         # Fallback: regex/heuristic parse
         return self._heuristic_parse(text, filename)
 
+    async def _ocr_text(self, image_bytes: bytes, image: Optional[IngestedImage] = None) -> str:
+        cache = get_decode_cache()
+        digest = cache.key_for(image_bytes) if (OCR_CACHE_ENABLED and cache.enabled) else ""
+        if digest:
+            cached = cache.get(digest, OCR_CACHE_KIND)
+            if cached is not None:
+                return cached
+        pool = get_ocr_pool()
+        if pool.started:
+            # Long-lived workers with the model loaded; a full queue raises OcrPoolBusy.
+            try:
+                text = await pool.ocr(image if image is not None and image.gray is not None else image_bytes)
+            except OcrJobFailed:
+                text = ""  # as ocr_image: fall back to the heuristic parse
+        else:
+            text = await get_image_executor().run(ocr_image, image if image is not None else image_bytes)
+        if digest and text:
+            cache.put(digest, OCR_CACHE_KIND, text, size=len(text))
+        return text
+
     def _ocr(self, image_bytes: bytes) -> str:
-        try:
-            img = Image.open(BytesIO(image_bytes)).convert("L")
-            return pytesseract.image_to_string(img)
-        except Exception:
-            # Tesseract binary not available; return empty string to trigger heuristic fallback
-            return ""
+        return ocr_image(image_bytes)
 
     def _infer_category(self, text: str) -> str:
         low = text.lower()
@@ -0,0 +1,235 @@
+"""TSQR2: compact binary POS QR tokens.
+
+``TSQR2.<base32 blob>``. Base32 (upper-case, unpadded) stays inside the QR
+alphanumeric character set, which packs 5.5 bits per character instead of
+byte mode's 8, and the blob is packed fields rather than JSON. Together that
+yields far lower QR versions (bigger modules) than TSQR1 for the same payload.
+
+Blob layout (big-endian)::
+
+    u8    rev << 6 | mac_len        layout revision (0 or 1) and MAC length in bytes
+    u8    flags                     optional fields present (F_*)
+    str8  tenant_id
+    [str8 kid]                      revision 1 only: signing key id
+    u32   timestamp
+    str8  nonce                     raw bytes when F_NONCE_HEX (hex on parse)
+    [varint amount_cents] [3s currency] [u8 actor_role]
+    [str8 profile_id] [str8 transaction_id] [str8 merchant_id] [str8 plan_id]
+    mac_len bytes                   HMAC-SHA256(all preceding bytes), truncated
+
+``str8`` is a u8 length followed by UTF-8 bytes. The MAC length is part of
+the signed bytes, so it cannot be shortened by a forger. Tenant and key id
+sit at fixed offsets so the verifier can pick the key before unpacking.
+"""
+from __future__ import annotations
+
+import base64
+import hashlib
+import hmac
+import re
+import struct
+from typing import Any, Dict, Tuple
+
+PREFIX = "TSQR2"
+LAYOUT_REV = 0
+LAYOUT_REV_KID = 1  # adds the key id after the tenant
+DEFAULT_MAC_BYTES = 16
+MIN_MAC_BYTES = 8
+MAX_MAC_BYTES = 32
+
+F_AMOUNT = 0x01
+F_CURRENCY = 0x02
+F_ROLE = 0x04
+F_PROFILE = 0x08
+F_TRANSACTION = 0x10
+F_MERCHANT = 0x20
+F_PLAN = 0x40
+F_NONCE_HEX = 0x80
+
+ROLES = ("merchant", "customer", "insurer")  # encoded as index + 1
+
+# Optional short-string fields, in blob order.
+_STR_FIELDS = ((F_PROFILE, "profile_id"), (F_TRANSACTION, "transaction_id"), (F_MERCHANT, "merchant_id"), (F_PLAN, "plan_id"))
+
+_HEX_NONCE = re.compile(r"(?:[0-9a-f]{2}){1,32}")
+
+
+def _str8(value: str) -> bytes:
+    raw = value.encode("utf-8")
+    if len(raw) > 255:
+        raise ValueError("tsqr2_field_too_long")
+    return bytes((len(raw),)) + raw
+
+
+def _varint(n: int) -> bytes:
+    if n < 0:
+        raise ValueError("tsqr2_negative_amount")
+    out = bytearray()
+    while True:
+        byte, n = n & 0x7F, n >> 7
+        out.append(byte | (0x80 if n else 0))
+        if not n:
+            return bytes(out)
+
+
+def pack(payload: Dict[str, Any], mac_bytes: int = DEFAULT_MAC_BYTES) -> bytes:
+    """Serialize ``payload`` to the unsigned blob (header included)."""
+    if not MIN_MAC_BYTES <= mac_bytes <= MAX_MAC_BYTES:
+        raise ValueError("tsqr2_bad_mac_length")
+    tenant_id, nonce, ts = payload.get("tenant_id"), payload.get("nonce"), payload.get("timestamp")
+    if not isinstance(tenant_id, str) or not tenant_id or not isinstance(nonce, str) or not nonce or not isinstance(ts, int):
+        raise ValueError("missing_required_fields")
+    if not 0 <= ts <= 0xFFFFFFFF:
+        raise ValueError("tsqr2_bad_timestamp")
+
+    kid = payload.get("kid")
+    flags = 0
+    body = bytearray(_str8(tenant_id))
+    if kid:
+        body += _str8(str(kid))
+    body += struct.pack(">I", ts)
+    if _HEX_NONCE.fullmatch(nonce):
+        flags |= F_NONCE_HEX
+        body += bytes((len(nonce) // 2,)) + bytes.fromhex(nonce)
+    else:
+        body += _str8(nonce)
+
+    amount = payload.get("amount_cents")
+    if amount is not None:
+        if not isinstance(amount, int) or isinstance(amount, bool):
+            raise ValueError("tsqr2_bad_amount")
+        flags |= F_AMOUNT
+        body += _varint(amount)
+    currency = payload.get("currency")
+    if currency:
+        raw = str(currency).encode("ascii")
+        if len(raw) != 3:
+            raise ValueError("tsqr2_bad_currency")
+        flags |= F_CURRENCY
+        body += raw
+    role = payload.get("actor_role")
+    if role:
+        if role not in ROLES:
+            raise ValueError("tsqr2_bad_role")
+        flags |= F_ROLE
+        body.append(ROLES.index(role) + 1)
+    for flag, key in _STR_FIELDS:
+        value = payload.get(key)
+        if value:
+            flags |= flag
+            body += _str8(str(value))
+
+    rev = LAYOUT_REV_KID if kid else LAYOUT_REV
+    return bytes((rev << 6 | mac_bytes, flags)) + bytes(body)
+
+
+def build(payload: Dict[str, Any], secret: str, mac_bytes: int = DEFAULT_MAC_BYTES) -> str:
+    blob = pack(payload, mac_bytes)
+    sig = hmac.new(secret.encode("utf-8"), blob, hashlib.sha256).digest()[:mac_bytes]
+    return f"{PREFIX}." + base64.b32encode(blob + sig).decode("ascii").rstrip("=")
+
+
+def split(token: str) -> Tuple[bytes, bytes]:
+    """Return ``(signed bytes, truncated MAC)`` without unpacking any field."""
+    head, _, text = token.partition(".")
+    if head != PREFIX or not text:
+        raise ValueError("invalid_token_format")
+    try:
+        blob = base64.b32decode(text + "=" * (-len(text) % 8))
+    except (ValueError, TypeError):
+        raise ValueError("invalid_token_format") from None
+    if len(blob) < 2:
+        raise ValueError("invalid_token_format")
+    rev, mac_len = blob[0] >> 6, blob[0] & 0x3F
+    if rev not in (LAYOUT_REV, LAYOUT_REV_KID) or not MIN_MAC_BYTES <= mac_len <= MAX_MAC_BYTES or len(blob) <= 2 + mac_len:
+        raise ValueError("invalid_token_format")
+    return blob[:-mac_len], blob[-mac_len:]
+
+
+def _peek_str8(signed: bytes, pos: int) -> Tuple[str, int]:
+    if len(signed) <= pos:
+        return "", pos
+    n = signed[pos]
+    raw = signed[pos + 1 : pos + 1 + n]
+    if len(raw) != n:
+        return "", pos
+    try:
+        return raw.decode("utf-8"), pos + 1 + n
+    except UnicodeDecodeError:
+        return "", pos
+
+
+def peek_ids(signed: bytes) -> Tuple[str, str]:
+    """``(tenant_id, kid)`` from their fixed offsets, without unpacking the rest."""
+    tenant_id, pos = _peek_str8(signed, 2)
+    if not tenant_id or signed[0] >> 6 != LAYOUT_REV_KID:
+        return tenant_id, ""
+    return tenant_id, _peek_str8(signed, pos)[0]
+
+
+def unpack(signed: bytes) -> Dict[str, Any]:
+    """Decode the signed bytes (as returned by ``split``) into a payload dict."""
+    try:
+        return _unpack(signed)
+    except (IndexError, struct.error, UnicodeDecodeError):
+        raise ValueError("invalid_payload") from None
+
+
+def _unpack(signed: bytes) -> Dict[str, Any]:
+    flags = signed[1]
+    pos = 2
+
+    def str8() -> str:
+        nonlocal pos
+        n = signed[pos]
+        raw = signed[pos + 1 : pos + 1 + n]
+        if len(raw) != n:
+            raise IndexError
+        pos += 1 + n
+        return raw.decode("utf-8")
+
+    payload: Dict[str, Any] = {"tenant_id": str8()}
+    if signed[0] >> 6 == LAYOUT_REV_KID:
+        payload["kid"] = str8()
+    (payload["timestamp"],) = struct.unpack_from(">I", signed, pos)
+    pos += 4
+    if flags & F_NONCE_HEX:
+        n = signed[pos]
+        raw = signed[pos + 1 : pos + 1 + n]
+        if len(raw) != n:
+            raise IndexError
+        payload["nonce"] = raw.hex()
+        pos += 1 + n
+    else:
+        payload["nonce"] = str8()
+
+    if flags & F_AMOUNT:
+        amount, shift = 0, 0
+        while True:
+            byte = signed[pos]
+            pos += 1
+            amount |= (byte & 0x7F) << shift
+            shift += 7
+            if not byte & 0x80:
+                break
+            if shift > 63:
+                raise IndexError
+        payload["amount_cents"] = amount
+    if flags & F_CURRENCY:
+        raw = signed[pos : pos + 3]
+        if len(raw) != 3:
+            raise IndexError
+        payload["currency"] = raw.decode("ascii")
+        pos += 3
+    if flags & F_ROLE:
+        code = signed[pos]
+        pos += 1
+        if not 1 <= code <= len(ROLES):
+            raise IndexError
+        payload["actor_role"] = ROLES[code - 1]
+    for flag, key in _STR_FIELDS:
+        if flags & flag:
+            payload[key] = str8()
+    if pos != len(signed):
+        raise IndexError
+    return payload
@@ -1,6 +1,7 @@
 import os
 import json
-from typing import Optional
+import functools
+from typing import Any, Optional
 
 try:
     from openai import OpenAI
@@ -11,6 +12,19 @@ LLM_BASE_URL = os.getenv("LLM_BASE_URL")
 LLM_API_KEY = os.getenv("LLM_API_KEY") or os.getenv("OPENAI_API_KEY")
 LLM_MODEL = os.getenv("LLM_MODEL", "llama3.1:8b")
 TESSERACT_CMD = os.getenv("TESSERACT_CMD")  # for Windows if not on PATH
+# Also cache OCR text in the decode cache (keyed by upload hash), not just QR texts.
+OCR_CACHE_ENABLED = (os.getenv("TAPSURE_DECODE_CACHE_OCR", "0") or "").strip().lower() in {"1", "true", "yes", "on"}
+# Crop to the paper, deskew, resample to OCR_TARGET_DPI and binarise before tesseract.
+OCR_PREPROCESS_ENABLED = (os.getenv("TAPSURE_OCR_PREPROCESS", "0") or "").strip().lower() in {"1", "true", "yes", "on"}
+OCR_TARGET_DPI = int(os.getenv("TAPSURE_OCR_TARGET_DPI", "300"))
+OCR_PAPER_MM = float(os.getenv("TAPSURE_OCR_PAPER_MM", "80"))
+# Skip OCR on uploads whose verified POS QR carries amount, currency, merchant
+# and plan: "demand" (OCR when asked for), "background" or "off".
+LAZY_OCR_MODE = (os.getenv("POS_QR_LAZY_OCR", "demand") or "demand").strip().lower()
+LAZY_OCR_MAX_ENTRIES = int(os.getenv("POS_QR_LAZY_OCR_ENTRIES", "256"))
+LAZY_OCR_MAX_BYTES = int(os.getenv("POS_QR_LAZY_OCR_MAX_BYTES", "64000000"))
+# Larger uploads are not parked; their OCR runs inline as without a POS QR.
+LAZY_OCR_MAX_UPLOAD_BYTES = int(os.getenv("POS_QR_MAX_BYTES", "3000000"))
 
 
 def get_client() -> Optional["OpenAI"]:
@@ -32,15 +46,23 @@ def get_client() -> Optional["OpenAI"]:
         return None
 
 
-def get_pos_tenant_secrets() -> dict[str, str]:
+def get_pos_tenant_secrets() -> dict[str, Any]:
     """Parse POS tenant secrets from env.
 
     Expected format:
       POS_TENANT_SECRETS='{"demo":"dev-secret"}'
 
+    A tenant may instead map to a keyring object for key rotation (see
+    ``tenant_keys.parse_keyring``).
+
     Returns an empty dict when not configured.
     """
-    raw = os.getenv("POS_TENANT_SECRETS", "").strip()
+    return parse_tenant_secrets(os.getenv("POS_TENANT_SECRETS", ""))
+
+
+def parse_tenant_secrets(raw: str) -> dict[str, Any]:
+    """Parse a ``{"tenant": "secret" | keyring}`` JSON document; {} when empty or invalid."""
+    raw = (raw or "").strip()
     if not raw:
         return {}
     try:
@@ -49,8 +71,75 @@ def get_pos_tenant_secrets() -> dict[str, str]:
         return {}
     if not isinstance(data, dict):
         return {}
-    out: dict[str, str] = {}
+    out: dict[str, Any] = {}
     for k, v in data.items():
-        if isinstance(k, str) and isinstance(v, str) and k and v:
+        if isinstance(k, str) and isinstance(v, (str, dict)) and k and v:
             out[k] = v
     return out
+
+
+TENANT_POLICY_FIELDS = ("max_age_seconds", "nonce_quota")
+
+
+def get_pos_qr_tenant_policies() -> dict[str, dict[str, int]]:
+    """Parse per-tenant QR policies from env.
+
+    Expected format:
+      POS_QR_TENANT_POLICIES='{"demo":{"max_age_seconds":300,"nonce_quota":50000},"*":{"nonce_quota":200000}}'
+
+    ``max_age_seconds`` is the tenant's token window (and so how long its
+    nonces are kept); ``nonce_quota`` caps its live nonces in the in-memory
+    store (``0`` = no per-tenant cap). The ``"*"`` entry applies to tenants
+    without their own value. Unknown fields and non-integer values are
+    ignored. Returns an empty dict when not configured.
+    """
+    raw = os.getenv("POS_QR_TENANT_POLICIES", "").strip()
+    if not raw:
+        return {}
+    try:
+        data = json.loads(raw)
+    except Exception:
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    out: dict[str, dict[str, int]] = {}
+    for tenant, policy in data.items():
+        if not (isinstance(tenant, str) and tenant and isinstance(policy, dict)):
+            continue
+        fields = {
+            k: v
+            for k, v in policy.items()
+            if k in TENANT_POLICY_FIELDS and isinstance(v, int) and not isinstance(v, bool) and v >= (0 if k == "nonce_quota" else 1)
+        }
+        if fields:
+            out[tenant] = fields
+    return out
+
+
+def get_pos_qr_region_hints() -> dict[str, str]:
+    """Parse per-tenant QR placement hints from env.
+
+    Expected format (see ``pos_qr.parse_region_hint`` for hint syntax):
+      POS_QR_REGION_HINTS='{"demo":"bottom:0.25","*":"right:0.5"}'
+
+    The ``"*"`` entry applies to tenants without their own hint. Returns an
+    empty dict when not configured. Every image upload asks for the hints,
+    so the JSON is parsed once per env value; the returned dict is shared
+    and must not be changed.
+    """
+    return parse_region_hints(os.getenv("POS_QR_REGION_HINTS", ""))
+
+
+@functools.lru_cache(maxsize=8)
+def parse_region_hints(raw: str) -> dict[str, str]:
+    """Parse a ``{"tenant": "hint"}`` JSON document; {} when empty or invalid."""
+    raw = (raw or "").strip()
+    if not raw:
+        return {}
+    try:
+        data = json.loads(raw)
+    except Exception:
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    return {k: v for k, v in data.items() if isinstance(k, str) and isinstance(v, str) and k and v.strip()}
@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+
+# Rough per-entry bookkeeping cost (key, tuple, OrderedDict node) added to the
+# caller-reported value size when charging the byte budget.
+ENTRY_OVERHEAD_BYTES = 200
+
+
+class DecodeCache:
+    """In-process LRU for image decode results, keyed by a hash of the upload.
+
+    Terminals typically post the same image to ``/api/pos/qr/verify`` and then
+    ``/api/receipt/analyze``, and clients retry; both hit this cache instead of
+    re-running the decode cascade. Only decode output is cached; token
+    verification and nonce marking still run on every request.
+
+    Entries expire after ``ttl_seconds`` and the cache is bounded both by
+    ``max_entries`` and by an approximate ``max_bytes`` budget. A zero
+    ``max_entries`` disables caching.
+    """
+
+    def __init__(self, max_entries: int = 512, max_bytes: int = 4_000_000, ttl_seconds: float = 300.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, int, Any]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @classmethod
+    def from_env(cls) -> "DecodeCache":
+        return cls(
+            max_entries=int(os.getenv("TAPSURE_DECODE_CACHE_ENTRIES", "512")),
+            max_bytes=int(os.getenv("TAPSURE_DECODE_CACHE_MAX_BYTES", "4000000")),
+            ttl_seconds=float(os.getenv("TAPSURE_DECODE_CACHE_TTL_SECONDS", "300")),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    @staticmethod
+    def key_for(data: bytes) -> str:
+        # BLAKE2b runs at memory-bandwidth speed and needs no extra dependency.
+        return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+    def _drop(self, key: Tuple[str, str]) -> None:
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def get(self, digest: str, kind: str, now: Optional[float] = None) -> Optional[Any]:
+        if not self.enabled:
+            return None
+        now = time.monotonic() if now is None else now
+        key = (digest, kind)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] <= now:
+                self._drop(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, digest: str, kind: str, value: Any, size: int, now: Optional[float] = None) -> None:
+        """Store ``value``; ``size`` is the caller's estimate of its payload bytes."""
+        if not self.enabled:
+            return
+        size = int(size) + ENTRY_OVERHEAD_BYTES
+        if size > self.max_bytes:
+            return
+        now = time.monotonic() if now is None else now
+        key = (digest, kind)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (now + self.ttl_seconds, size, value)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+_global_decode_cache = DecodeCache.from_env()
+
+
+def get_decode_cache() -> DecodeCache:
+    return _global_decode_cache
@@ -0,0 +1,191 @@
+"""OCR deferred for receipts whose verified POS QR already carries the facts.
+
+A signed payload with ``amount_cents``, ``currency``, ``merchant_id`` and
+``plan_id`` is authoritative for everything coverage needs, so the upload is
+answered from it (``receipt_from_pos_payload``) and OCR, the slowest stage by
+far, leaves the request path. The upload is parked here under the receipt's
+``receipt_id`` until something needs its ``raw_text`` or items:
+
+- ``demand``: OCR runs on the first ``complete`` (``GET /api/receipt/{id}/ocr``).
+- ``background``: OCR starts as soon as the receipt is parked and runs after
+  the response is sent; ``complete`` waits for it.
+
+Either way OCR runs once per receipt (again only if it failed), concurrent
+callers share it (a full OCR pool, ``OcrPoolBusy``, reaches them so the
+endpoint can answer 503; the next call retries), and the signed fields (merchant, total, trust) are never
+overwritten by OCR. At most ``max_entries`` receipts and ``max_bytes`` of
+image data are parked; beyond either the least recently used is dropped (its
+OCR never runs). The newest upload is always kept, so the byte budget can be
+overshot by one upload; uploads over ``max_upload_bytes`` are never parked
+(their OCR runs inline).
+
+Parked uploads live in this process only: with several workers, the
+``receipt_id`` is known only to the worker that answered the upload, and
+``complete`` anywhere else returns None (a 404), as after an eviction.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from .models import PosQrPayload, ReceiptData
+from .ocr_pool import OcrPoolBusy
+
+log = logging.getLogger("tapsure.deferred_ocr")
+
+LAZY_OCR_MODES = ("off", "demand", "background")
+# Payload fields that make OCR unnecessary for the upload response.
+POS_FACT_FIELDS = ("amount_cents", "currency", "merchant_id", "plan_id")
+
+# (image_bytes, filename) -> full OCR analysis
+Analyze = Callable[[bytes, str], Awaitable[ReceiptData]]
+
+
+def has_pos_facts(payload: Optional[PosQrPayload]) -> bool:
+    if payload is None:
+        return False
+    if not all(getattr(payload, field) is not None for field in POS_FACT_FIELDS):
+        return False
+    texts = (payload.currency, payload.merchant_id, payload.plan_id)
+    return payload.amount_cents >= 0 and all(t.strip() for t in texts)
+
+
+def receipt_from_pos_payload(payload: PosQrPayload, category: str) -> ReceiptData:
+    """Receipt built from a verified payload alone; items and raw text wait for OCR."""
+    return ReceiptData(
+        merchant=payload.merchant_id,
+        category=category,
+        items=[],
+        total=round(payload.amount_cents / 100.0, 2),
+        date=datetime.fromtimestamp(payload.timestamp, tz=timezone.utc).strftime("%Y-%m-%d"),
+        confidence=0.95,
+        eligibility="APPROVED",
+        raw_text=None,
+        ocr_deferred=True,
+    )
+
+
+def merge_ocr(receipt: ReceiptData, ocr: ReceiptData) -> ReceiptData:
+    # OCR fills in what the payload lacks; signed fields stay as they are.
+    return receipt.model_copy(
+        update={
+            "items": ocr.items,
+            "raw_text": ocr.raw_text,
+            "category": ocr.category,
+            "ocr_deferred": False,
+        }
+    )
+
+
+class _Parked:
+    __slots__ = ("receipt", "data", "filename", "task", "result")
+
+    def __init__(self, receipt: ReceiptData, data: bytes, filename: str):
+        self.receipt = receipt
+        self.data = data
+        self.filename = filename
+        self.task: Optional["asyncio.Future[ReceiptData]"] = None
+        self.result: Optional[ReceiptData] = None
+
+
+class DeferredOcr:
+    """Parked uploads by receipt id. Event-loop only: no locking."""
+
+    def __init__(
+        self,
+        analyze: Analyze,
+        mode: str = "demand",
+        max_entries: int = 256,
+        max_bytes: int = 64_000_000,
+        max_upload_bytes: int = 3_000_000,
+    ):
+        if mode not in LAZY_OCR_MODES:
+            raise ValueError(f"unknown lazy OCR mode: {mode!r} (expected one of {', '.join(LAZY_OCR_MODES)})")
+        self.analyze = analyze
+        self.mode = mode
+        self.max_entries = max(1, int(max_entries))
+        self.max_bytes = max(0, int(max_bytes))
+        self.max_upload_bytes = max(0, int(max_upload_bytes))
+        self._parked: "OrderedDict[str, _Parked]" = OrderedDict()
+        self._bytes = 0
+        self.deferred = 0
+        self.ocr_runs = 0
+        self.ocr_errors = 0
+        self.evicted = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    def accepts(self, size: int) -> bool:
+        """Whether an upload of ``size`` bytes may be parked."""
+        return self.enabled and size <= self.max_upload_bytes
+
+    def park(self, receipt: ReceiptData, data: bytes, filename: str) -> None:
+        """Keep the upload for ``receipt`` (which must have a ``receipt_id``)."""
+        entry = _Parked(receipt, data, filename)
+        self._parked[receipt.receipt_id] = entry
+        self._bytes += len(data)
+        self.deferred += 1
+        while len(self._parked) > self.max_entries or (self._bytes > self.max_bytes and len(self._parked) > 1):
+            # An OCR already running finishes for whoever awaits it.
+            _, dropped = self._parked.popitem(last=False)
+            self._bytes -= len(dropped.data)
+            self.evicted += 1
+        if self.mode == "background":
+            self._start(entry)
+
+    def _start(self, entry: _Parked) -> "asyncio.Future[ReceiptData]":
+        if entry.task is None:
+            entry.task = asyncio.ensure_future(self._run(entry))
+            # Nobody awaits a background run that hit a busy pool.
+            entry.task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return entry.task
+
+    async def _run(self, entry: _Parked) -> ReceiptData:
+        self.ocr_runs += 1
+        try:
+            ocr = await self.analyze(entry.data, entry.filename)
+        except OcrPoolBusy:
+            entry.task = None
+            raise
+        except Exception:
+            self.ocr_errors += 1
+            log.exception("deferred OCR failed for receipt %s", entry.receipt.receipt_id)
+            entry.task = None  # the next request retries
+            return entry.receipt
+        entry.result = merge_ocr(entry.receipt, ocr)
+        if self._parked.get(entry.receipt.receipt_id) is entry:
+            self._bytes -= len(entry.data)
+        entry.data = b""  # the image is no longer needed
+        return entry.result
+
+    async def complete(self, receipt_id: str) -> Optional[ReceiptData]:
+        """The receipt with OCR filled in (running OCR now if it has not run), or None if not parked."""
+        entry = self._parked.get(receipt_id)
+        if entry is None:
+            return None
+        self._parked.move_to_end(receipt_id)
+        if entry.result is not None:
+            return entry.result
+        return await asyncio.shield(self._start(entry))
+
+    def __len__(self) -> int:
+        return len(self._parked)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "parked": len(self._parked),
+            "max_entries": self.max_entries,
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "max_upload_bytes": self.max_upload_bytes,
+            "deferred": self.deferred,
+            "ocr_runs": self.ocr_runs,
+            "ocr_errors": self.ocr_errors,
+            "evicted": self.evicted,
+        }
@@ -0,0 +1,212 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import logging
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context, shared_memory
+from typing import Any, Callable, Optional, Tuple, TypeVar, Union
+
+from .imaging import decode_gray
+
+try:
+    import numpy as np  # type: ignore
+except Exception:  # pragma: no cover
+    np = None
+
+log = logging.getLogger("tapsure.image_executor")
+
+T = TypeVar("T")
+
+EXECUTOR_MODES = ("process", "thread", "inline")
+
+
+def _warm_worker() -> None:
+    # Pay the import cost (cv2, numpy, PIL, pytesseract) once per worker
+    # instead of on the first request that lands on it.
+    from . import pos_qr  # noqa: F401
+    from .agents import receipt  # noqa: F401
+
+
+def _run_with_shared_bytes(fn: Callable[..., T], shm_name: str, size: int, args: tuple, kwargs: dict) -> T:
+    """Worker-side trampoline: attach to the parent's segment and call ``fn``.
+
+    ``fn`` receives a memoryview over the shared segment, so the upload is
+    never pickled through the pool's pipe.
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    view = shm.buf[:size]
+    try:
+        return fn(view, *args, **kwargs)
+    finally:
+        view.release()
+        shm.close()
+
+
+def _run_with_shared_gray(fn: Callable[..., T], shm_name: str, shape: tuple, args: tuple, kwargs: dict) -> T:
+    """Like ``_run_with_shared_bytes`` but ``fn`` gets the decoded gray array."""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        gray = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+        try:
+            return fn(gray, *args, **kwargs)
+        finally:
+            del gray
+    finally:
+        shm.close()
+
+
+def _ingest_to_shared(data: memoryview) -> Tuple[str, tuple]:
+    """Worker-side ingestion: decode the upload into a new gray segment.
+
+    Returns the new segment's name and array shape; the parent takes ownership
+    of the segment (and unlinks it).
+    """
+    gray = decode_gray(data)
+    out = shared_memory.SharedMemory(create=True, size=max(1, gray.nbytes))
+    try:
+        np.ndarray(gray.shape, dtype=np.uint8, buffer=out.buf)[...] = gray
+        return out.name, gray.shape
+    finally:
+        out.close()
+
+
+class IngestedImage:
+    """An upload decoded once to grayscale and shared by the QR and OCR stages.
+
+    In process mode the pixels live in a shared-memory segment that workers
+    map directly; otherwise ``gray`` is a plain array. Call ``close()`` when
+    the request is done.
+    """
+
+    def __init__(self, gray: Any = None, shm: Optional[shared_memory.SharedMemory] = None, shape: tuple = ()):
+        self._shm = shm
+        self.shape = tuple(gray.shape) if gray is not None else tuple(shape)
+        if gray is None and shm is not None:
+            gray = np.ndarray(self.shape, dtype=np.uint8, buffer=shm.buf)
+        self.gray = gray
+
+    @property
+    def shm_name(self) -> Optional[str]:
+        return self._shm.name if self._shm is not None else None
+
+    def close(self) -> None:
+        shm, self._shm = self._shm, None
+        if shm is None:
+            return
+        self.gray = None
+        try:
+            shm.close()
+        except BufferError:
+            # A caller still holds a view of the pixels; the mapping goes away
+            # with it, but the name must not outlive the request.
+            pass
+        shm.unlink()
+
+
+class ImageExecutor:
+    """Runs CPU-bound image stages (QR decode, OCR) off the asyncio event loop.
+
+    Modes:
+      - ``process``: a spawn-context process pool; image bytes travel through
+        ``multiprocessing.shared_memory`` rather than being pickled.
+      - ``thread``: a thread pool (cv2 and the tesseract subprocess release the GIL).
+      - ``inline``: run on the caller (debugging / single-threaded tools).
+
+    Until ``start()`` is called (e.g. a TestClient used without its lifespan),
+    jobs fall back to the event loop's default thread pool.
+    """
+
+    def __init__(self, mode: str = "thread", max_workers: Optional[int] = None):
+        mode = (mode or "thread").strip().lower()
+        if mode not in EXECUTOR_MODES:
+            raise ValueError(f"unknown_executor_mode:{mode}")
+        self.mode = mode
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._pool: Optional[Executor] = None
+
+    @classmethod
+    def from_env(cls) -> "ImageExecutor":
+        workers = int(os.getenv("TAPSURE_IMAGE_WORKERS", "0") or "0")
+        return cls(mode=os.getenv("TAPSURE_IMAGE_EXECUTOR", "thread"), max_workers=workers or None)
+
+    @property
+    def started(self) -> bool:
+        return self._pool is not None
+
+    def start(self) -> None:
+        if self._pool is not None or self.mode == "inline":
+            return
+        if self.mode == "process":
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=get_context("spawn"),
+                initializer=_warm_worker,
+            )
+        else:
+            self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="tapsure-image")
+        log.info("image executor started mode=%s workers=%d", self.mode, self.max_workers)
+
+    def shutdown(self, wait: bool = True) -> None:
+        pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=wait, cancel_futures=True)
+            log.info("image executor stopped mode=%s", self.mode)
+
+    async def ingest(self, data: bytes) -> IngestedImage:
+        """Decode ``data`` to grayscale once, on the pool, for several stages."""
+        if self.mode == "inline":
+            return IngestedImage(gray=decode_gray(data))
+
+        loop = asyncio.get_running_loop()
+        pool = self._pool
+        if not isinstance(pool, ProcessPoolExecutor):
+            return IngestedImage(gray=await loop.run_in_executor(pool, decode_gray, data))
+
+        name, shape = await self._run_shared_bytes(pool, _ingest_to_shared, data, (), {})
+        return IngestedImage(shm=shared_memory.SharedMemory(name=name), shape=shape)
+
+    async def run(self, fn: Callable[..., T], data: Union[bytes, IngestedImage], *args: Any, **kwargs: Any) -> T:
+        """Run ``fn(data, *args, **kwargs)`` on the pool and await its result.
+
+        ``fn`` must be a module-level function (picklable) that accepts any
+        bytes-like object, or a gray array when ``data`` is an ``IngestedImage``,
+        as its first argument.
+        """
+        if self.mode == "inline":
+            return fn(data.gray if isinstance(data, IngestedImage) else data, *args, **kwargs)
+
+        loop = asyncio.get_running_loop()
+        pool = self._pool
+        if not isinstance(pool, ProcessPoolExecutor):
+            arg = data.gray if isinstance(data, IngestedImage) else data
+            return await loop.run_in_executor(pool, functools.partial(fn, arg, *args, **kwargs))
+
+        if isinstance(data, IngestedImage):
+            if data.shm_name is None:
+                # Ingested before the pool started: the pixels are a local array.
+                return await loop.run_in_executor(None, functools.partial(fn, data.gray, *args, **kwargs))
+            return await loop.run_in_executor(
+                pool, functools.partial(_run_with_shared_gray, fn, data.shm_name, data.shape, args, kwargs)
+            )
+        return await self._run_shared_bytes(pool, fn, data, args, kwargs)
+
+    async def _run_shared_bytes(self, pool: Executor, fn: Callable[..., T], data: bytes, args: tuple, kwargs: dict) -> T:
+        size = len(data)
+        shm = shared_memory.SharedMemory(create=True, size=max(1, size))
+        try:
+            shm.buf[:size] = data
+            return await asyncio.get_running_loop().run_in_executor(
+                pool, functools.partial(_run_with_shared_bytes, fn, shm.name, size, args, kwargs)
+            )
+        finally:
+            shm.close()
+            shm.unlink()
+
+
+_global_image_executor = ImageExecutor.from_env()
+
+
+def get_image_executor() -> ImageExecutor:
+    return _global_image_executor
@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import struct
+from io import BytesIO
+from typing import Any, Optional, Tuple, Union
+
+from PIL import Image, ImageOps
+
+try:
+    import cv2  # type: ignore
+    import numpy as np  # type: ignore
+except Exception:  # pragma: no cover
+    cv2 = None
+    np = None
+
+
+# Anything the image stages accept: encoded upload bytes (or a memoryview over
+# them, e.g. a shared-memory segment) or an already decoded image array.
+ImageSource = Union[bytes, bytearray, memoryview, Any]
+
+
+def decode_gray(data: Union[bytes, bytearray, memoryview]):
+    """Decode an encoded upload straight to an 8-bit grayscale array.
+
+    ``cv2.imdecode`` reads from a zero-copy ``np.frombuffer`` view of the
+    request bytes, skips the RGB intermediate, and applies EXIF orientation.
+    Formats OpenCV cannot read (e.g. GIF) fall back to PIL.
+    """
+    if cv2 is None or np is None:
+        raise RuntimeError("image_decoder_unavailable")
+
+    buf = np.frombuffer(data, dtype=np.uint8)
+    gray = cv2.imdecode(buf, cv2.IMREAD_GRAYSCALE)
+    if gray is not None:
+        return gray
+
+    img = Image.open(BytesIO(data))
+    img = ImageOps.exif_transpose(img).convert("L")
+    return np.asarray(img)
+
+
+def as_gray(image: ImageSource):
+    """Return ``image`` as a 2-D uint8 array, decoding bytes only if needed."""
+    if np is not None and isinstance(image, np.ndarray):
+        if image.ndim == 2:
+            return image
+        if image.ndim == 3 and image.shape[2] == 4:
+            return cv2.cvtColor(image, cv2.COLOR_RGBA2GRAY)
+        return cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    return decode_gray(image)
+
+
+# Start-of-frame markers carry the image size; C4/C8/CC share the range but are
+# DHT/JPG/DAC segments.
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def jpeg_size(data: Union[bytes, bytearray, memoryview]) -> Optional[Tuple[int, int]]:
+    """Return ``(width, height)`` from a JPEG's SOF header, or None if not a JPEG.
+
+    Walks the marker segments without decoding (or copying) any image data.
+    """
+    view = memoryview(data)
+    n = len(view)
+    if n < 4 or view[0] != 0xFF or view[1] != 0xD8:
+        return None
+    i = 2
+    while i + 4 <= n:
+        if view[i] != 0xFF:
+            return None
+        marker = view[i + 1]
+        if marker == 0xFF:  # fill byte
+            i += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            i += 2
+            continue
+        (length,) = struct.unpack(">H", view[i + 2 : i + 4])
+        if marker in _SOF_MARKERS:
+            if i + 9 > n:
+                return None
+            height, width = struct.unpack(">HH", view[i + 5 : i + 9])
+            return width, height
+        if marker == 0xDA:  # start of scan: no SOF seen
+            return None
+        i += 2 + length
+    return None
+
+
+def _reduced_flags() -> tuple:
+    return (
+        (8, cv2.IMREAD_REDUCED_GRAYSCALE_8),
+        (4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+        (2, cv2.IMREAD_REDUCED_GRAYSCALE_2),
+    )
+
+
+def decode_gray_reduced(data: Union[bytes, bytearray, memoryview], min_side: int):
+    """Decode a large JPEG at 1/2, 1/4 or 1/8 scale, straight to grayscale.
+
+    libjpeg's DCT scaling still entropy-decodes every block but skips most of
+    the IDCT, upsampling and output work for the dropped resolution. The
+    largest factor that keeps the long side at or above ``min_side`` is used.
+    Returns ``(gray, factor)``, or None when the upload is not a JPEG or is
+    too small to reduce.
+    """
+    if cv2 is None or np is None:
+        return None
+    size = jpeg_size(data)
+    if size is None:
+        return None
+    long_side = max(size)
+    for factor, flag in _reduced_flags():
+        if long_side // factor >= min_side:
+            gray = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flag)
+            return (gray, factor) if gray is not None else None
+    return None
@@ -1,21 +1,71 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Request
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.datastructures import UploadFile as StarletteUploadFile
+from starlette.formparsers import MultiPartException
 from pydantic import BaseModel
 from typing import List, Optional
-from .models import ReceiptData, CoverageOption, RecommendationResponse, PolicyConfirmation, ChatMessage, PosQrPayload, PosQrVerifyResponse
+from .models import (
+    ReceiptData,
+    CoverageOption,
+    RecommendationResponse,
+    PolicyConfirmation,
+    ChatMessage,
+    PosQrPayload,
+    PosQrTokensVerifyRequest,
+    PosQrTokensVerifyResponse,
+    PosQrTokenVerifyRequest,
+    PosQrVerifyResponse,
+)
 from .orchestrator import Orchestrator
 from .agents.conversation import CHAT_INTENTS
-from .config import get_pos_tenant_secrets
+from .config import get_pos_qr_region_hints
 from .debug_logging import APIDebugLoggingMiddleware, configure_debug_logging
-from .pos_qr import decode_qr_texts, get_nonce_store, verify_token
+from .decode_cache import get_decode_cache
+from .image_executor import IngestedImage, get_image_executor
+from .nonce_store import get_nonce_store, store_seconds, tenant_policy_values
+from .ocr_pool import OcrPoolBusy, get_ocr_pool
+from .pos_qr import (
+    MaxAge,
+    QrDecodeResult,
+    TenantSecrets,
+    decode_qr,
+    parse_region_hint,
+    token_passes_checks,
+    verify_token_candidates,
+    verify_tokens,
+)
+from .qr_batch import iter_batch_items, parse_batch_form
+from .tenant_keys import get_tenant_keys
+import asyncio
+import functools
+import json
 import os
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
 load_dotenv()
 
-app = FastAPI(title="TapSure Agentic MVP", version="0.1.0")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Built here so a misconfigured nonce backend fails startup, not a request.
+    nonce_store = get_nonce_store()
+    executor = get_image_executor()
+    executor.start()
+    ocr_pool = get_ocr_pool()
+    ocr_pool.start()
+    try:
+        yield
+    finally:
+        ocr_pool.shutdown()
+        executor.shutdown()
+        nonce_store.close()
+
+
+app = FastAPI(title="TapSure Agentic MVP", version="0.1.0", lifespan=lifespan)
 
 DEBUG_HTTP = (os.getenv("TAPSURE_DEBUG_HTTP", "0") or "").strip().lower() in {"1", "true", "yes", "on"}
 if DEBUG_HTTP:
@@ -57,14 +107,83 @@ def _pos_qr_required(request: Request) -> bool:
         return True
 
     # auto: require QR when tenant secrets are configured.
-    return bool(get_pos_tenant_secrets())
+    return bool(get_tenant_keys())
+
+def _qr_time_window() -> tuple[MaxAge, int]:
+    max_age = int(os.getenv("POS_QR_MAX_AGE_SECONDS", "900"))
+    max_future_skew = int(os.getenv("POS_QR_MAX_FUTURE_SKEW_SECONDS", "60"))
+    # Tenants with their own max_age in POS_QR_TENANT_POLICIES (the nonce
+    # store keeps their nonces for the same time).
+    tenant_ages = tenant_policy_values("max_age_seconds")
+    if tenant_ages:
+        return {"*": max_age, **tenant_ages}, max_future_skew
+    return max_age, max_future_skew
+
+
+def _qr_accept(tenant_secrets: TenantSecrets):
+    # Let the decoder run past tokens that cannot verify (e.g. a second,
+    # foreign TSQR1 code) instead of stopping at the first well-formed one.
+    # The registry pickles by reference, so process workers check against
+    # their own copy of the keys.
+    if not tenant_secrets:
+        return None
+    max_age, max_future_skew = _qr_time_window()
+    return functools.partial(
+        token_passes_checks,
+        tenant_secrets=tenant_secrets,
+        max_age_seconds=max_age,
+        max_future_skew_seconds=max_future_skew,
+    )
+
+
+def _qr_region_hint(request: Request) -> str:
+    # An explicit per-request hint wins; otherwise use the tenant's configured
+    # placement (or the "*" default).
+    hint = (request.headers.get("x-pos-qr-region") or "").strip()
+    if hint:
+        return hint
+    hints = get_pos_qr_region_hints()
+    if not hints:
+        return ""
+    tenant = (request.headers.get("x-pos-tenant") or "").strip()
+    return hints.get(tenant) or hints.get("*", "")
+
+
+async def _decode_qr_cached(data: bytes, tenant_secrets: TenantSecrets, region_hint: str = "") -> QrDecodeResult:
+    region = parse_region_hint(region_hint)
+    # The hint changes which stages run (and so the stage/timing report).
+    kind = f"qr@{','.join(f'{v:.4g}' for v in region)}" if region else "qr"
+    cache = get_decode_cache()
+    digest = cache.key_for(data) if cache.enabled else ""
+    if digest:
+        cached = cache.get(digest, kind)
+        if cached is not None:
+            return cached
+    # The encoded upload, not pixels: decode_qr tries a reduced-scale JPEG
+    # decode first and only decodes at full resolution if that finds nothing.
+    result = await get_image_executor().run(decode_qr, data, accept=_qr_accept(tenant_secrets), region=region)
+    if digest:
+        cache.put(digest, kind, result, size=sum(len(t) for t in result.texts))
+    return result
+
+async def _ingest(data: bytes) -> IngestedImage | None:
+    try:
+        return await get_image_executor().ingest(data)
+    except Exception:
+        return None
 
 @app.get("/health")
 def health():
     return {"status": "ok"}
 
 @app.post("/api/receipt/analyze", response_model=ReceiptData)
-async def analyze_receipt(request: Request, receipt: UploadFile = File(...)):
+async def analyze_receipt(
+    request: Request,
+    receipt: UploadFile = File(...),
+    pos_qr_token: Optional[str] = Form(None),
+):
+    # ``pos_qr_token``: the QR text as read by the terminal's scanner. When
+    # given it is verified as-is and the image is not searched for a QR.
     if not receipt:
         raise HTTPException(400, "No file uploaded")
 
@@ -73,38 +192,49 @@ async def analyze_receipt(request: Request, receipt: UploadFile = File(...)):
         raise HTTPException(415, "Unsupported content type")
 
     data = await receipt.read()
+
+    # POS mode: require a signed QR token to be present & valid.
+    scanned = (pos_qr_token or "").strip()
+    decode_qr_from_image = not scanned and _pos_qr_required(request)
+    # The QR stage works from the encoded bytes (see ``_decode_qr_cached``);
+    # the upload is decoded to pixels for OCR only, and only when OCR runs
+    # inline rather than being deferred.
+    image: IngestedImage | None = None
     try:
         pos_qr_verified = False
         pos_qr_reason: str | None = None
         pos_qr_payload: dict | None = None
 
-        # POS mode: require a signed QR token to be present & valid.
-        if _pos_qr_required(request):
-            try:
-                decoded = decode_qr_texts(data)
-            except RuntimeError as e:
-                raise HTTPException(503, str(e))
-            except Exception:
-                raise HTTPException(400, "Invalid image")
-
-            if not decoded:
-                raise HTTPException(400, "QR required")
+        if scanned or decode_qr_from_image:
+            tenant_secrets = get_tenant_keys()
+            if scanned:
+                candidates = [scanned]
+            else:
+                try:
+                    decoded = await _decode_qr_cached(data, tenant_secrets, _qr_region_hint(request))
+                except RuntimeError as e:
+                    raise HTTPException(503, str(e))
+                except Exception:
+                    raise HTTPException(400, "Invalid image")
+
+                if not decoded.texts:
+                    raise HTTPException(400, "QR required")
+                candidates = decoded.tokens or decoded.texts[:1]
 
-            tenant_secrets = get_pos_tenant_secrets()
             if not tenant_secrets:
                 raise HTTPException(500, "POS tenant secrets not configured")
 
-            max_age = int(os.getenv("POS_QR_MAX_AGE_SECONDS", "900"))
-            max_future_skew = int(os.getenv("POS_QR_MAX_FUTURE_SKEW_SECONDS", "60"))
-
-            valid, reason, _payload = verify_token(
-                token=decoded[0],
+            max_age, max_future_skew = _qr_time_window()
+            outcome = verify_token_candidates(
+                candidates,
                 tenant_secrets=tenant_secrets,
                 nonce_store=get_nonce_store(),
                 max_age_seconds=max_age,
                 max_future_skew_seconds=max_future_skew,
             )
-            if not valid:
+            reason = outcome.reason
+            _payload = outcome.payload
+            if not outcome.valid:
                 status = 409 if reason == "replay" else 400
                 raise HTTPException(status, f"QR invalid: {reason}")
 
@@ -113,18 +243,37 @@ async def analyze_receipt(request: Request, receipt: UploadFile = File(...)):
             if isinstance(_payload, dict):
                 pos_qr_payload = _payload
 
+        if image is None and not orch.defers_ocr(pos_qr_verified, pos_qr_payload, len(data)):
+            image = await _ingest(data)
         result = await orch.handle_image_upload(
             data,
             filename=receipt.filename,
             pos_qr_verified=pos_qr_verified,
             pos_qr_reason=pos_qr_reason,
             pos_qr_payload=pos_qr_payload,
+            image=image,
         )
         return result
     except HTTPException:
         raise
+    except OcrPoolBusy as e:
+        raise HTTPException(503, str(e))
     except Exception as e:
         raise HTTPException(500, f"Analyze error: {e}")
+    finally:
+        if image is not None:
+            image.close()
+
+@app.get("/api/receipt/{receipt_id}/ocr", response_model=ReceiptData)
+async def receipt_ocr(receipt_id: str):
+    # OCR for a receipt answered from its signed POS QR (``ocr_deferred``).
+    try:
+        result = await orch.receipt_ocr(receipt_id)
+    except OcrPoolBusy as e:
+        raise HTTPException(503, str(e))
+    if result is None:
+        raise HTTPException(404, "Unknown or expired receipt_id")
+    return result
 
 @app.post("/api/coverage/recommend", response_model=RecommendationResponse)
 async def recommend_coverage(payload: ReceiptData):
@@ -160,8 +309,18 @@ def chat_intents():
     return CHAT_INTENTS
 
 
+@app.get("/api/metrics")
+def metrics():
+    return {
+        "decode_cache": get_decode_cache().stats(),
+        "nonce_store": get_nonce_store().stats(),
+        "deferred_ocr": orch.deferred_ocr.stats(),
+        "ocr_pool": get_ocr_pool().stats(),
+    }
+
+
 @app.post("/api/pos/qr/verify", response_model=PosQrVerifyResponse)
-async def pos_qr_verify(receipt: UploadFile = File(...)):
+async def pos_qr_verify(request: Request, receipt: UploadFile = File(...)):
     if not receipt:
         raise HTTPException(400, "No file uploaded")
 
@@ -174,41 +333,201 @@ async def pos_qr_verify(receipt: UploadFile = File(...)):
     if len(data) > max_bytes:
         raise HTTPException(413, "File too large")
 
+    tenant_secrets = get_tenant_keys()
     try:
-        decoded = decode_qr_texts(data)
+        result = await _decode_qr_cached(data, tenant_secrets, region_hint=_qr_region_hint(request))
     except RuntimeError as e:
         raise HTTPException(503, str(e))
     except Exception:
         raise HTTPException(400, "Invalid image")
 
-    if not decoded:
+    if not result.texts:
         raise HTTPException(400, "No QR code found")
 
-    token = decoded[0]
-
-    tenant_secrets = get_pos_tenant_secrets()
     if not tenant_secrets:
         raise HTTPException(500, "POS tenant secrets not configured")
 
-    max_age = int(os.getenv("POS_QR_MAX_AGE_SECONDS", "900"))
-    max_future_skew = int(os.getenv("POS_QR_MAX_FUTURE_SKEW_SECONDS", "60"))
+    resp = _verify_decoded(result, tenant_secrets)
+    if resp.reason == "replay":
+        return JSONResponse(status_code=409, content=resp.model_dump())
+    return resp
+
+
+def _verify_decoded(result: QrDecodeResult, tenant_secrets: TenantSecrets) -> PosQrVerifyResponse:
+    candidates = result.tokens or result.texts[:1]
+    resp = _verify_candidates(candidates, tenant_secrets)
+    return resp.model_copy(update={"decode_stage": result.stage, "candidates": len(candidates)})
 
-    valid, reason, payload_dict = verify_token(
-        token=token,
+
+def _payload_model(payload: dict | None) -> PosQrPayload | None:
+    if not payload:
+        return None
+    try:
+        return PosQrPayload(**payload)
+    except Exception:
+        return None
+
+
+def _verify_candidates(candidates: list[str], tenant_secrets: TenantSecrets) -> PosQrVerifyResponse:
+    # Runs on the event loop: nonce marking stays in the main process.
+    max_age, max_future_skew = _qr_time_window()
+    store_started = store_seconds()
+    outcome = verify_token_candidates(
+        candidates,
         tenant_secrets=tenant_secrets,
         nonce_store=get_nonce_store(),
         max_age_seconds=max_age,
         max_future_skew_seconds=max_future_skew,
     )
+    return PosQrVerifyResponse(
+        valid=outcome.valid,
+        reason=outcome.reason,
+        payload=_payload_model(outcome.payload),
+        decoded_text=outcome.token,
+        candidate_index=outcome.candidate_index,
+        candidates=len(candidates),
+        nonce_store_ms=round((store_seconds() - store_started) * 1000.0, 3),
+    )
 
-    payload_model = None
-    if payload_dict:
-        try:
-            payload_model = PosQrPayload(**payload_dict)
-        except Exception:
-            payload_model = None
 
-    resp = PosQrVerifyResponse(valid=valid, reason=reason, payload=payload_model, decoded_text=token)
-    if reason == "replay":
+@app.post("/api/pos/qr/verify/token", response_model=PosQrVerifyResponse)
+async def pos_qr_verify_token(body: PosQrTokenVerifyRequest):
+    """Verify a scanner-read token; same checks and nonce store as the image endpoint."""
+    tenant_secrets = get_tenant_keys()
+    if not tenant_secrets:
+        raise HTTPException(500, "POS tenant secrets not configured")
+
+    resp = _verify_candidates([body.token.strip()], tenant_secrets)
+    if resp.reason == "replay":
         return JSONResponse(status_code=409, content=resp.model_dump())
     return resp
+
+
+@app.post("/api/pos/qr/verify/tokens", response_model=PosQrTokensVerifyResponse)
+async def pos_qr_verify_tokens(body: PosQrTokensVerifyRequest):
+    """Verify many scanner-read tokens, each as its own receipt, in request order."""
+    tenant_secrets = get_tenant_keys()
+    if not tenant_secrets:
+        raise HTTPException(500, "POS tenant secrets not configured")
+    if len(body.tokens) > int(os.getenv("POS_QR_BATCH_MAX_ITEMS", "1000")):
+        raise HTTPException(413, "Too many tokens")
+
+    tokens = [t.strip() for t in body.tokens]
+    max_age, max_future_skew = _qr_time_window()
+    store_started = store_seconds()
+    outcomes = verify_tokens(tokens, tenant_secrets, get_nonce_store(), max_age, max_future_skew)
+    results = [
+        PosQrVerifyResponse(
+            valid=valid,
+            reason=reason,
+            payload=_payload_model(payload),
+            decoded_text=token,
+            candidate_index=0,
+            candidates=1,
+        )
+        for token, (valid, reason, payload) in zip(tokens, outcomes)
+    ]
+    return PosQrTokensVerifyResponse(
+        results=results,
+        valid=sum(r.valid for r in results),
+        nonce_store_ms=round((store_seconds() - store_started) * 1000.0, 3),
+    )
+
+
+def _batch_concurrency() -> int:
+    raw = int(os.getenv("POS_QR_BATCH_CONCURRENCY", "0") or "0")
+    return max(1, raw or get_image_executor().max_workers * 2)
+
+
+@app.post("/api/pos/qr/verify/batch")
+async def pos_qr_verify_batch(request: Request):
+    """Verify many receipt images (or ``.zip`` archives of them) in one call.
+
+    Streams one NDJSON line per image as soon as it is verified (completion
+    order; ``index`` is the upload order), then a ``summary`` line. At most
+    ``POS_QR_BATCH_CONCURRENCY`` images are decoded (and held in memory) at
+    once. Decoding runs on the image executor; token and nonce checks run
+    here, one item at a time, exactly as for ``/api/pos/qr/verify``.
+
+    Upload the images as repeated ``receipts`` form fields.
+    """
+    tenant_secrets = get_tenant_keys()
+    if not tenant_secrets:
+        raise HTTPException(500, "POS tenant secrets not configured")
+
+    max_bytes = int(os.getenv("POS_QR_MAX_BYTES", "3000000"))
+    max_items = int(os.getenv("POS_QR_BATCH_MAX_ITEMS", "1000"))
+    # Parsed here rather than declared as File(...) parameters: FastAPI closes
+    # declared uploads as soon as the endpoint returns, before the stream runs.
+    # Every part goes to a temp file as it arrives, so the body is never held
+    # in memory; the decode window below then reads them back one at a time.
+    try:
+        form = await parse_batch_form(request, max_files=max_items + 1)
+    except MultiPartException as e:
+        raise HTTPException(400, e.message)
+    receipts = [f for f in form.getlist("receipts") if isinstance(f, StarletteUploadFile)]
+    if not receipts:
+        await form.close()
+        raise HTTPException(400, "No file uploaded")
+    limit = _batch_concurrency()
+    region_hint = _qr_region_hint(request)
+
+    async def _decode(index: int, filename: str, data: bytes):
+        try:
+            return index, filename, await _decode_qr_cached(data, tenant_secrets, region_hint=region_hint), None
+        except RuntimeError as e:
+            return index, filename, None, str(e)
+        except Exception:
+            return index, filename, None, "invalid_image"
+
+    def _line(index: int, filename: str, body: dict) -> bytes:
+        return (json.dumps({"index": index, "filename": filename, **body}) + "\n").encode("utf-8")
+
+    def _finish(index: int, filename: str, result: QrDecodeResult | None, error: str | None) -> tuple[str, bytes]:
+        if error is None and result is not None and not result.texts:
+            error = "no_qr"
+        if error is not None:
+            return error, _line(index, filename, {"valid": False, "reason": error})
+        resp = _verify_decoded(result, tenant_secrets)
+        return resp.reason, _line(index, filename, resp.model_dump())
+
+    async def _stream():
+        reasons: dict[str, int] = {}
+        pending: set[asyncio.Task] = set()
+        index = 0
+
+        async def _drain(block_until: int):
+            nonlocal pending
+            while len(pending) > block_until:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in sorted(done, key=lambda t: t.result()[0]):
+                    reason, line = _finish(*task.result())
+                    reasons[reason] = reasons.get(reason, 0) + 1
+                    yield line
+
+        try:
+            async for item in iter_batch_items(receipts, max_bytes):
+                if index >= max_items:
+                    reasons["too_many_items"] = reasons.get("too_many_items", 0) + 1
+                    yield _line(index, item.filename, {"valid": False, "reason": "too_many_items"})
+                    break
+                if item.error is not None:
+                    reasons[item.error] = reasons.get(item.error, 0) + 1
+                    yield _line(index, item.filename, {"valid": False, "reason": item.error})
+                else:
+                    pending.add(asyncio.create_task(_decode(index, item.filename, item.data)))
+                    async for line in _drain(limit - 1):
+                        yield line
+                index += 1
+            async for line in _drain(0):
+                yield line
+        finally:
+            # Client went away mid-stream: stop decoding for it.
+            for task in pending:
+                task.cancel()
+            await form.close()
+
+        summary = {"items": index, "valid": reasons.get("ok", 0), "reasons": reasons}
+        yield (json.dumps({"summary": summary}) + "\n").encode("utf-8")
+
+    return StreamingResponse(_stream(), media_type="application/x-ndjson")
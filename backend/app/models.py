@@ -15,6 +15,10 @@ class ReceiptData(BaseModel):
     confidence: float = 0.5
     eligibility: str = "PENDING"  # APPROVED / DENIED / PENDING
     raw_text: Optional[str] = None
+    # Set when OCR was skipped because the verified POS QR carried the facts;
+    # GET /api/receipt/{receipt_id}/ocr fills in raw_text and items.
+    receipt_id: Optional[str] = None
+    ocr_deferred: bool = False
 
     # POS QR verification context (present when POS mode requires QR)
     pos_qr_verified: bool = False
@@ -57,6 +61,7 @@ class PosQrPayload(BaseModel):
     plan_id: str | None = None
     amount_cents: int | None = None
     currency: str | None = None
+    kid: str | None = None
 
 
 class PosQrVerifyResponse(BaseModel):
@@ -64,3 +69,27 @@ class PosQrVerifyResponse(BaseModel):
     reason: str
     payload: PosQrPayload | None = None
     decoded_text: str | None = None
+    decode_stage: str | None = None
+    # Index of the winning (or, when none verified, the reported) token text among
+    # the decoded token candidates, and how many candidates were decoded.
+    candidate_index: int | None = None
+    candidates: int = 0
+    # Time this request spent in the nonce store (a network round trip for
+    # shared backends).
+    nonce_store_ms: float | None = None
+
+
+class PosQrTokenVerifyRequest(BaseModel):
+    # Text from a hardware scanner; no image is involved.
+    token: str
+
+
+class PosQrTokensVerifyRequest(BaseModel):
+    tokens: List[str]
+
+
+class PosQrTokensVerifyResponse(BaseModel):
+    results: List[PosQrVerifyResponse]
+    valid: int = 0
+    # One pipelined nonce store call covers every token.
+    nonce_store_ms: float | None = None
@@ -0,0 +1,101 @@
+"""Time-rotating Bloom filter for nonce pre-filtering.
+
+``generations`` filters of equal size; marks go into the newest one, lookups
+check all of them. Every ``ttl / (generations - 1)`` seconds the oldest
+generation is dropped and a fresh one started, so a mark is remembered for
+at least ``ttl`` (and at most ``ttl * generations / (generations - 1)``)
+seconds without tracking per-entry expiry.
+
+Sizing follows the usual formulas: for ``n`` marks per generation and a
+per-generation false-positive rate ``p`` (the target split evenly across
+generations), ``m = -n ln p / ln(2)^2`` bits and ``k = m / n ln 2`` hashes.
+Positions use double hashing over one BLAKE2b digest.
+"""
+from __future__ import annotations
+
+import hashlib
+import math
+from collections import deque
+from typing import Any, Deque, Dict, Tuple
+
+
+class RotatingBloomFilter:
+    def __init__(self, capacity: int, fp_rate: float, ttl_seconds: float, generations: int = 3):
+        if generations < 2:
+            raise ValueError("a rotating filter needs at least 2 generations")
+        if not 0.0 < fp_rate < 1.0 or capacity <= 0 or ttl_seconds <= 0:
+            raise ValueError("capacity, fp_rate and ttl_seconds must be positive (fp_rate < 1)")
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.ttl_seconds = ttl_seconds
+        self.generations = generations
+        self.rotate_seconds = ttl_seconds / (generations - 1)
+        per_gen = max(1, math.ceil(capacity / (generations - 1)))
+        p = fp_rate / generations
+        self.bits = max(64, math.ceil(-per_gen * math.log(p) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.bits / per_gen * math.log(2)))
+        self._gens: Deque[Tuple[int, bytearray, list]] = deque()  # (generation id, bits, [inserts])
+        self.rotations = 0
+
+    @property
+    def nbytes(self) -> int:
+        return self.generations * ((self.bits + 7) // 8)
+
+    def _positions(self, key: bytes) -> list[int]:
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        m = self.bits
+        return [(h1 + i * h2) % m for i in range(self.hashes)]
+
+    def _rotate(self, now: float) -> None:
+        current = int(now // self.rotate_seconds)
+        gens = self._gens
+        if gens and gens[-1][0] >= current:
+            return
+        oldest_kept = current - self.generations + 1
+        while gens and gens[0][0] < oldest_kept:
+            gens.popleft()
+            self.rotations += 1
+        gens.append((current, bytearray((self.bits + 7) // 8), [0]))
+
+    def _present(self, positions: list[int]) -> bool:
+        return any(all(bits[p >> 3] & (1 << (p & 7)) for p in positions) for _, bits, _ in self._gens)
+
+    def might_contain(self, key: bytes, now: float) -> bool:
+        """True if ``key`` was possibly marked within the retention window (no mark is added)."""
+        self._rotate(now)
+        return self._present(self._positions(key))
+
+    def add_if_absent(self, key: bytes, now: float) -> bool:
+        """Mark ``key``; True if it was definitely absent before, False if possibly present."""
+        self._rotate(now)
+        positions = self._positions(key)
+        present = self._present(positions)
+        newest, count = self._gens[-1][1], self._gens[-1][2]
+        for p in positions:
+            newest[p >> 3] |= 1 << (p & 7)
+        count[0] += 1
+        return not present
+
+    def estimated_fp_rate(self) -> float:
+        """Current chance that an unseen key reads as possibly present."""
+        miss_all = 1.0
+        for _, _, count in self._gens:
+            fill = 1.0 - math.exp(-self.hashes * count[0] / self.bits)
+            miss_all *= 1.0 - fill ** self.hashes
+        return 1.0 - miss_all
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "bytes": self.nbytes,
+            "bits_per_generation": self.bits,
+            "hashes": self.hashes,
+            "generations": self.generations,
+            "rotate_seconds": self.rotate_seconds,
+            "capacity": self.capacity,
+            "target_fp_rate": self.fp_rate,
+            "estimated_fp_rate": round(self.estimated_fp_rate(), 8),
+            "inserts_per_generation": [count[0] for _, _, count in self._gens],
+            "rotations": self.rotations,
+        }
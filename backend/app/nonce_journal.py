@@ -0,0 +1,298 @@
+"""Append-only journal that lets the in-memory nonce store survive restarts.
+
+Appends only queue the record; a writer thread writes everything queued in
+one ``write`` + ``fsync`` every ``commit_interval`` seconds (group commit),
+so requests never wait on disk. A crash loses at most the last interval of
+marks.
+
+The file is a header line followed by blocks, one per tenant and expiry
+second in each commit::
+
+    =<expires_at>\\t<tenant_id>\\t<count>\\t<escaped>\\n
+    <nonce>\\n            (count lines)
+
+``tenant_id`` is always backslash-escaped (``\\\\``, ``\\t``, ``\\n``); the
+nonces only when ``escaped`` is ``1``, which is the case for a block as soon
+as one of its nonces needs it.
+
+A block's expiry is the end of its second (so an expiry is rounded up by
+less than a second, which only lengthens protection). This keeps reloading
+fast: each block becomes one ``dict.update`` in the store,
+about a second per million entries. A torn block at the end of the file
+(crash mid-write) is dropped. A malformed block header anywhere else means
+the file is damaged: it is moved aside to ``<path>.corrupt-<time>`` for
+inspection, never compacted over, and a new journal is started from what
+could be read before the damage.
+
+Expired and superseded records pile up, so once the file holds
+``compact_min_records`` records and at least twice as many as the store had
+live at the last compaction, the writer rewrites it from a snapshot of the
+store (temp file, fsync, atomic rename).
+
+One process owns a journal file at a time (an advisory lock where the
+platform has ``fcntl``): the in-memory store is per process, and so is its
+journal.
+"""
+from __future__ import annotations
+
+import logging
+import math
+import os
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory lock
+    fcntl = None  # type: ignore[assignment]
+
+log = logging.getLogger("tapsure.nonce_journal")
+
+HEADER = "# tapsure nonce journal v2\n"
+
+# (tenant_id, nonce, expires_at)
+Entry = Tuple[str, str, float]
+# (tenant_id, expires_at, nonces)
+Block = Tuple[str, float, List[str]]
+
+_ESCAPES = {"\\": "\\\\", "\t": "\\t", "\n": "\\n"}
+_UNESCAPES = {"\\\\": "\\", "\\t": "\t", "\\n": "\n"}
+_ESCAPE_RE = re.compile(r"[\\\t\n]")
+_UNESCAPE_RE = re.compile(r"\\[\\tn]")
+
+
+class JournalLocked(RuntimeError):
+    """Another process already writes this journal file."""
+
+
+def _escape(text: str) -> str:
+    return _ESCAPE_RE.sub(lambda m: _ESCAPES[m.group()], text)
+
+
+def _unescape(text: str) -> str:
+    return _UNESCAPE_RE.sub(lambda m: _UNESCAPES[m.group()], text)
+
+
+def encode_block(tenant_id: str, expires_at: float, nonces: List[str]) -> str:
+    escaped = any(_ESCAPE_RE.search(n) for n in nonces)
+    if escaped:
+        nonces = [_escape(n) for n in nonces]
+    head = f"={expires_at:.3f}\t{_escape(tenant_id)}\t{len(nonces)}\t{int(escaped)}\n"
+    return head + "\n".join(nonces) + "\n"
+
+
+def read_blocks(path: str, now: float) -> Tuple[List[Block], int, str]:
+    """Unexpired blocks in ``path`` (file order), the number of records read, and how the file ended.
+
+    The last value is ``"clean"``, ``"torn"`` (the last block was cut short)
+    or ``"corrupt"`` (a malformed block header; nothing after it is read).
+    """
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return [], 0, "clean"
+    lines = data.decode("utf-8", "replace").split("\n")
+    clean = lines.pop() == ""  # else a torn last line
+    out: List[Block] = []
+    records = 0
+    i, end = 0, len(lines)
+    while i < end:
+        line = lines[i]
+        i += 1
+        if not line.startswith("="):
+            continue  # the file header
+        try:
+            expires_raw, tenant_id, count_raw, escaped = line[1:].split("\t")
+            expires, count = float(expires_raw), int(count_raw)
+        except ValueError:
+            log.warning("nonce journal %s: bad block header at line %d; ignoring the rest", path, i)
+            return out, records, "corrupt"
+        if i + count > end:
+            return out, records, "torn"
+        records += count
+        if expires > now:
+            nonces = lines[i : i + count]
+            if escaped == "1":
+                nonces = [_unescape(n) for n in nonces]
+            out.append((_unescape(tenant_id), expires, nonces))
+        i += count
+    return out, records, "clean" if clean else "torn"
+
+
+def _blocks_by_second(entries: Iterable[Entry]) -> List[Block]:
+    # One block per tenant and second, at the end of that second.
+    groups: Dict[Tuple[str, int], List[str]] = {}
+    for tenant_id, nonce, expires in entries:
+        groups.setdefault((tenant_id, math.ceil(expires)), []).append(nonce)
+    return [(tenant_id, float(expires), nonces) for (tenant_id, expires), nonces in groups.items()]
+
+
+class NonceJournal:
+    def __init__(
+        self,
+        path: str,
+        commit_interval: float = 0.05,
+        compact_min_records: int = 100_000,
+        fsync: bool = True,
+    ):
+        self.path = path
+        self.commit_interval = commit_interval
+        self.compact_min_records = compact_min_records
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._pending: List[Entry] = []
+        self._wake = threading.Event()
+        self._stopping = False
+        self._snapshot: Optional[Callable[[], Iterable[Entry]]] = None
+        self._thread: Optional[threading.Thread] = None
+        self._file: Any = None
+        self.records = 0
+        self.live_at_compaction = 0
+        self.commits = 0
+        self.appended = 0
+        self.compactions = 0
+        self.write_errors = 0
+        self.loaded = 0
+        self.load_seconds = 0.0
+        self.quarantined: Optional[str] = None
+        self._tail = "clean"
+
+    def load(self, now: Optional[float] = None) -> List[Block]:
+        """Read unexpired blocks; call before ``start``."""
+        started = time.perf_counter()
+        blocks, self.records, self._tail = read_blocks(self.path, time.time() if now is None else now)
+        self.load_seconds = time.perf_counter() - started
+        self.loaded = sum(len(nonces) for _, _, nonces in blocks)
+        self.live_at_compaction = self.loaded
+        return blocks
+
+    def start(self, snapshot: Callable[[], Iterable[Entry]]) -> None:
+        """Open the file and start the writer; ``snapshot`` lists the store's live entries for compaction."""
+        self._snapshot = snapshot
+        if self._tail == "corrupt":
+            # Compacting would silently drop every record after the damage;
+            # keep the file as it is and start a new one beside it.
+            self.quarantined = f"{self.path}.corrupt-{int(time.time())}"
+            os.replace(self.path, self.quarantined)
+            log.error("nonce journal %s is corrupt; moved to %s, records after the damage are not loaded", self.path, self.quarantined)
+        self._open()
+        if self._tail != "clean":
+            # Appending after a torn block would misalign everything after it.
+            if self._tail == "torn":
+                log.warning("nonce journal %s ended mid-record; rewriting it", self.path)
+            self._compact()
+        self._thread = threading.Thread(target=self._run, name="tapsure-nonce-journal", daemon=True)
+        self._thread.start()
+
+    def _open(self) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        f = open(self.path, "ab")
+        if fcntl is not None:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                f.close()
+                raise JournalLocked(f"nonce journal in use by another process: {self.path}")
+        if f.tell() == 0:
+            f.write(HEADER.encode("utf-8"))
+            f.flush()
+        self._file = f
+
+    def append(self, tenant_id: str, nonce: str, expires_at: float) -> None:
+        with self._lock:
+            self._pending.append((tenant_id, nonce, expires_at))
+
+    def _write(self, f: Any, blocks: List[Block]) -> None:
+        f.write("".join(encode_block(t, e, n) for t, e, n in blocks).encode("utf-8"))
+        f.flush()
+        if self.fsync:
+            os.fsync(f.fileno())
+
+    def _commit(self) -> int:
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return 0
+        try:
+            self._write(self._file, _blocks_by_second(pending))
+        except Exception as e:
+            self.write_errors += 1
+            log.warning("nonce journal write failed (%d records lost): %s", len(pending), e)
+            return 0
+        self.records += len(pending)
+        self.appended += len(pending)
+        self.commits += 1
+        return len(pending)
+
+    def _due_for_compaction(self) -> bool:
+        return self.records >= self.compact_min_records and self.records >= 2 * self.live_at_compaction
+
+    def _compact(self) -> None:
+        # Writer thread (or start, before it runs): rewrite the file from the
+        # store's live entries.
+        if self._snapshot is None:
+            return
+        # Everything queued so far is in the snapshot too; marks made after
+        # it are queued and land in the new file.
+        self._commit()
+        blocks = _blocks_by_second(self._snapshot())
+        tmp = f"{self.path}.compact"
+        with open(tmp, "wb") as out:
+            out.write(HEADER.encode("utf-8"))
+            self._write(out, blocks)
+        os.replace(tmp, self.path)
+        old, self._file = self._file, None
+        self._open()
+        old.close()
+        live = sum(len(nonces) for _, _, nonces in blocks)
+        self.records = live
+        self.live_at_compaction = live
+        self.compactions += 1
+        log.info("nonce journal compacted to %d live entries", live)
+
+    def _run(self) -> None:
+        # Nothing may end this thread early: the store keeps appending, and
+        # with no writer every later mark would be lost without a trace.
+        while not self._stopping:
+            self._wake.wait(self.commit_interval)
+            try:
+                self._commit()
+                if self._due_for_compaction():
+                    try:
+                        self._compact()
+                    except Exception:
+                        self.live_at_compaction = self.records  # back off until the file doubles again
+                        raise
+            except Exception:
+                self.write_errors += 1
+                log.exception("nonce journal writer failed")
+
+    def close(self) -> None:
+        self._stopping = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._file is not None:
+            self._commit()
+            self._file.close()
+            self._file = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "path": self.path,
+            "records": self.records,
+            "pending": pending,
+            "commits": self.commits,
+            "appended": self.appended,
+            "compactions": self.compactions,
+            "write_errors": self.write_errors,
+            "loaded": self.loaded,
+            "load_ms": round(self.load_seconds * 1000.0, 1),
+            "quarantined": self.quarantined,
+        }
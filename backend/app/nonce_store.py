@@ -0,0 +1,894 @@
+from __future__ import annotations
+
+import contextvars
+import heapq
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+from .config import get_pos_qr_tenant_policies
+from .nonce_filter import RotatingBloomFilter
+from .nonce_journal import Block, Entry, NonceJournal
+from .resp import RespError, RespPool
+
+OVERFLOW_POLICIES = ("evict", "reject")
+
+log = logging.getLogger("tapsure.nonce_store")
+
+
+class NonceStoreFull(RuntimeError):
+    """Raised by ``check_and_mark`` when the store is at capacity and the policy is ``reject``."""
+
+
+class NonceStoreUnavailable(RuntimeError):
+    """Raised by a shared backend that cannot reach its store when its fallback policy is ``reject``."""
+
+
+# Seconds spent inside nonce backends by the current request (each request
+# runs in its own context); read it with ``store_seconds()``.
+_request_store_seconds: contextvars.ContextVar[float] = contextvars.ContextVar("tapsure_nonce_store_seconds", default=0.0)
+
+
+def store_seconds() -> float:
+    """Time this request (context) has spent in nonce backends so far."""
+    return _request_store_seconds.get()
+
+
+# Parsed ``POS_QR_TENANT_POLICIES`` fields keyed by ``(field, raw env value)``:
+# every token verification asks for the max ages, so the JSON is only parsed
+# again when the variable changes.
+_policy_values: Dict[Tuple[str, str], Dict[str, int]] = {}
+
+
+def tenant_policy_values(field: str) -> Dict[str, int]:
+    """``{tenant: value}`` for one ``POS_QR_TENANT_POLICIES`` field, ``"*"`` included.
+
+    The mapping is shared between callers; copy it before changing it.
+    """
+    key = (field, os.getenv("POS_QR_TENANT_POLICIES", ""))
+    values = _policy_values.get(key)
+    if values is None:
+        if len(_policy_values) >= 16:
+            _policy_values.clear()
+        values = {tenant: policy[field] for tenant, policy in get_pos_qr_tenant_policies().items() if field in policy}
+        _policy_values[key] = values
+    return values
+
+
+class NonceBackend:
+    """Replay protection: remembers ``(tenant_id, nonce)`` pairs for ``ttl_seconds``.
+
+    ``check_and_mark`` must be atomic for every caller sharing the backend
+    (threads, and for shared backends other processes): of two concurrent
+    calls with the same pair exactly one returns True.
+
+    Backends implement ``_check_and_mark`` (and may override ``_mark_many``
+    to batch round trips); the public methods time every call, per request
+    and in total. A tenant listed in ``tenant_ttls`` (or covered by its
+    ``"*"`` entry) keeps its nonces for its own TTL instead.
+    """
+
+    name = "base"
+    ttl_seconds: int
+    tenant_ttls: Dict[str, int]
+    store_calls = 0
+    store_seconds_total = 0.0
+
+    def ttl_for(self, tenant_id: str) -> int:
+        return self.tenant_ttls.get(tenant_id) or self.tenant_ttls.get("*") or self.ttl_seconds
+
+    def max_ttl(self) -> int:
+        """Longest TTL any tenant can get."""
+        return max([self.ttl_seconds, *self.tenant_ttls.values()])
+
+    def _check_and_mark(self, tenant_id: str, nonce: str, now: Optional[float]) -> bool:
+        raise NotImplementedError
+
+    def _mark_many(self, pairs: Sequence[Tuple[str, str]], now: Optional[float]) -> List[str]:
+        return [self._mark_reason(tenant_id, nonce, now) for tenant_id, nonce in pairs]
+
+    def _may_refuse(self, tenant_id: str, pending: int) -> bool:
+        """Whether a new mark for ``tenant_id`` could fail with ``nonce_store_full``.
+
+        ``pending`` marks are accepted but not yet written. Backends without
+        an admission limit never refuse.
+        """
+        return False
+
+    def _mark_reason(self, tenant_id: str, nonce: str, now: Optional[float]) -> str:
+        try:
+            return "ok" if self._check_and_mark(tenant_id, nonce, now) else "replay"
+        except NonceStoreFull:
+            return "nonce_store_full"
+        except NonceStoreUnavailable:
+            return "nonce_store_unavailable"
+
+    def _timed(self, started: float) -> None:
+        elapsed = time.perf_counter() - started
+        _request_store_seconds.set(_request_store_seconds.get() + elapsed)
+        self.store_calls += 1
+        self.store_seconds_total += elapsed
+
+    def check_and_mark(self, tenant_id: str, nonce: str, now: Optional[float] = None) -> bool:
+        """Returns True if nonce is new (and marks it), False if replay."""
+        started = time.perf_counter()
+        try:
+            return self._check_and_mark(tenant_id, nonce, now)
+        finally:
+            self._timed(started)
+
+    def mark_many(self, pairs: Sequence[Tuple[str, str]], now: Optional[float] = None) -> List[str]:
+        """Check and mark each pair, in order; one reason per pair.
+
+        ``"ok"``, ``"replay"`` (also for a pair repeated within the batch),
+        ``"nonce_store_full"`` or ``"nonce_store_unavailable"``.
+        """
+        started = time.perf_counter()
+        try:
+            return self._mark_many(pairs, now)
+        finally:
+            self._timed(started)
+
+    def _timing_stats(self) -> Dict[str, Any]:
+        calls = self.store_calls
+        return {
+            "store_calls": calls,
+            "store_ms_total": round(self.store_seconds_total * 1000.0, 3),
+            "store_ms_avg": round(self.store_seconds_total * 1000.0 / calls, 4) if calls else 0.0,
+        }
+
+    def live_entries(self) -> Iterable[Entry]:
+        """Unexpired ``(tenant_id, nonce, expires_at)`` marks, where the backend can list them."""
+        return ()
+
+    def stats(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class _Partition:
+    """One tenant's nonces: its own TTL, quota, expiry slots and counters."""
+
+    __slots__ = ("ttl_seconds", "quota", "seen", "buckets", "heap", "marked", "replays", "expirations", "evictions", "rejections")
+
+    def __init__(self, ttl_seconds: int, quota: int):
+        self.ttl_seconds = ttl_seconds
+        self.quota = quota
+        self.seen: Dict[str, float] = {}
+        self.buckets: Dict[int, List[str]] = {}
+        self.heap: List[int] = []
+        self.marked = 0
+        self.replays = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.rejections = 0
+
+    def purge(self, now: float, bucket_seconds: float) -> int:
+        # Pop only slots whose whole time range lies in the past.
+        heap, purged = self.heap, 0
+        while heap and (heap[0] + 1) * bucket_seconds <= now:
+            for nonce in self.buckets.pop(heapq.heappop(heap)):
+                expires = self.seen.get(nonce)
+                # Nonces re-marked since they were filed here live in a later slot.
+                if expires is not None and expires <= now:
+                    del self.seen[nonce]
+                    purged += 1
+        self.expirations += purged
+        return purged
+
+    def evict_one(self, bucket_seconds: float) -> bool:
+        heap = self.heap
+        while heap:
+            bucket_id = heap[0]
+            nonces = self.buckets[bucket_id]
+            while nonces:
+                nonce = nonces.pop()
+                expires = self.seen.get(nonce)
+                if expires is not None and int(expires // bucket_seconds) == bucket_id:
+                    del self.seen[nonce]
+                    self.evictions += 1
+                    return True
+            heapq.heappop(heap)
+            del self.buckets[bucket_id]
+        return False
+
+    def file(self, nonce: str, expires: float, bucket_seconds: float) -> None:
+        bucket_id = int(expires // bucket_seconds)
+        nonces = self.buckets.get(bucket_id)
+        if nonces is None:
+            nonces = self.buckets[bucket_id] = []
+            heapq.heappush(self.heap, bucket_id)
+        nonces.append(nonce)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self.seen),
+            "quota": self.quota,
+            "ttl_seconds": self.ttl_seconds,
+            "buckets": len(self.buckets),
+            "marked": self.marked,
+            "replays": self.replays,
+            "expirations": self.expirations,
+            "evictions": self.evictions,
+            "rejections": self.rejections,
+        }
+
+
+class NonceStore(NonceBackend):
+    """In-process backend: seen nonces in per-tenant partitions, private to one process.
+
+    Each tenant's partition has its own TTL (``tenant_ttls``, normally the
+    tenant's ``max_age``), entry quota (``tenant_quotas``) and expiry
+    schedule; both mappings may carry a ``"*"`` default.
+
+    Expiry is driven by time buckets: every entry is also filed under the
+    ``bucket_seconds``-wide slot its expiry falls into, and a heap of slot
+    ids yields the oldest one. A check drops the fully expired slots of its
+    own partition, and every other partition is swept at most once per
+    ``bucket_seconds``, so each entry is expired once and the cost per
+    check is O(1) amortized however many nonces are live. Entries in the
+    current, partially expired slot are treated as absent on lookup.
+
+    A tenant at its quota, or any tenant while the whole store is at
+    ``max_entries``, overflows: ``overflow="evict"`` drops the entries
+    closest to expiry (from the tenant's own partition for a quota, from
+    the largest partition for the global cap, so a noisy tenant pays for
+    its own traffic), ``overflow="reject"`` refuses new nonces by raising
+    ``NonceStoreFull``. ``0`` disables a cap.
+
+    With a ``journal``, the unexpired nonces it holds are loaded before the
+    store is used and every accepted nonce is appended to it, so a restart
+    does not reopen the replay window.
+    """
+
+    name = "memory"
+
+    def __init__(
+        self,
+        ttl_seconds: int,
+        max_entries: int = 0,
+        overflow: str = "evict",
+        bucket_seconds: float = 1.0,
+        tenant_ttls: Optional[Mapping[str, int]] = None,
+        tenant_quotas: Optional[Mapping[str, int]] = None,
+        journal: Optional[NonceJournal] = None,
+    ):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"unknown nonce store overflow policy: {overflow}")
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.overflow = overflow
+        self.bucket_seconds = bucket_seconds
+        self.tenant_ttls = dict(tenant_ttls or {})
+        self.tenant_quotas = dict(tenant_quotas or {})
+        self._partitions: Dict[str, _Partition] = {}
+        self._size = 0
+        self._next_sweep = float("-inf")
+        self._lock = threading.Lock()
+        self.journal = journal
+        if journal is not None:
+            self.restore(journal.load())
+            journal.start(self.live_entries)
+            log.info("restored %d nonces from %s in %.0f ms", len(self), journal.path, journal.load_seconds * 1000.0)
+
+    @classmethod
+    def from_env(cls) -> "NonceStore":
+        journal_path = os.getenv("POS_QR_NONCE_JOURNAL_PATH", "").strip()
+        journal = None
+        if journal_path:
+            journal = NonceJournal(journal_path, commit_interval=float(os.getenv("POS_QR_NONCE_JOURNAL_COMMIT_MS", "50")) / 1000.0)
+        return cls(
+            ttl_seconds=int(os.getenv("POS_QR_NONCE_TTL_SECONDS", "900")),
+            max_entries=int(os.getenv("POS_QR_NONCE_MAX_ENTRIES", "1000000")),
+            overflow=os.getenv("POS_QR_NONCE_OVERFLOW", "evict").strip().lower() or "evict",
+            tenant_ttls=tenant_policy_values("max_age_seconds"),
+            tenant_quotas=tenant_policy_values("nonce_quota"),
+            journal=journal,
+        )
+
+    def restore(self, blocks: Iterable[Block], now: Optional[float] = None) -> int:
+        """Load marks made earlier, as ``(tenant_id, expires_at, nonces)`` blocks read back from a journal.
+
+        Expired blocks are skipped and a later block wins for a repeated
+        nonce. Quotas are not applied: these nonces were accepted already.
+        """
+        now = time.time() if now is None else now
+        bucket_seconds = self.bucket_seconds
+        before = self._size
+        with self._lock:
+            for tenant_id, expires, nonces in blocks:
+                if expires <= now or not nonces:
+                    continue
+                part = self._partition(tenant_id)
+                size = len(part.seen)
+                part.seen.update(dict.fromkeys(nonces, expires))
+                self._size += len(part.seen) - size
+                bucket_id = int(expires // bucket_seconds)
+                filed = part.buckets.get(bucket_id)
+                if filed is None:
+                    part.buckets[bucket_id] = list(nonces)
+                    heapq.heappush(part.heap, bucket_id)
+                else:
+                    filed.extend(nonces)
+        return self._size - before
+
+    def live_entries(self) -> Iterable[Entry]:
+        # Copy under the lock, format outside it: a compaction of a large
+        # store only holds up checks for the dict copies.
+        now = time.time()
+        with self._lock:
+            parts = [(tenant_id, part.seen.copy()) for tenant_id, part in self._partitions.items()]
+        return [(tenant_id, nonce, expires) for tenant_id, seen in parts for nonce, expires in seen.items() if expires > now]
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _partition(self, tenant_id: str) -> _Partition:
+        part = self._partitions.get(tenant_id)
+        if part is None:
+            quota = self.tenant_quotas.get(tenant_id, self.tenant_quotas.get("*", 0))
+            part = self._partitions[tenant_id] = _Partition(self.ttl_for(tenant_id), quota)
+        return part
+
+    def _sweep(self, now: float) -> None:
+        # Idle tenants never check, so their slots are dropped here.
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + self.bucket_seconds
+        for part in self._partitions.values():
+            self._size -= part.purge(now, self.bucket_seconds)
+
+    def _overflow(self, part: _Partition) -> None:
+        if self.overflow == "reject":
+            part.rejections += 1
+            raise NonceStoreFull("nonce_store_full")
+        if part.quota and len(part.seen) >= part.quota:
+            victim = part
+        else:
+            victim = max(self._partitions.values(), key=lambda p: len(p.seen))
+        if victim.evict_one(self.bucket_seconds):
+            self._size -= 1
+
+    def _may_refuse(self, tenant_id: str, pending: int) -> bool:
+        if self.overflow != "reject":
+            return False  # room is always made by evicting
+        with self._lock:
+            part = self._partitions.get(tenant_id)
+            used = len(part.seen) if part is not None else 0
+            quota = part.quota if part is not None else self.tenant_quotas.get(tenant_id, self.tenant_quotas.get("*", 0))
+            # ``pending`` may belong to other tenants too: erring towards a
+            # refusal only costs the caller a round trip.
+            return bool((quota and used + pending >= quota) or (self.max_entries and self._size + pending >= self.max_entries))
+
+    def _check_and_mark(self, tenant_id: str, nonce: str, now: Optional[float]) -> bool:
+        now = time.time() if now is None else now
+        with self._lock:
+            part = self._partition(tenant_id)
+            self._size -= part.purge(now, self.bucket_seconds)
+            self._sweep(now)
+            expires = part.seen.get(nonce)
+            if expires is not None:
+                if expires > now:
+                    part.replays += 1
+                    return False
+                # Expired, its slot not purged yet: same as absent.
+                del part.seen[nonce]
+                part.expirations += 1
+                self._size -= 1
+            if (part.quota and len(part.seen) >= part.quota) or (self.max_entries and self._size >= self.max_entries):
+                self._overflow(part)
+            expires = now + float(part.ttl_seconds)
+            part.seen[nonce] = expires
+            part.file(nonce, expires, self.bucket_seconds)
+            part.marked += 1
+            self._size += 1
+            if self.journal is not None:
+                self.journal.append(tenant_id, nonce, expires)
+            return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            tenants = {tenant: part.stats() for tenant, part in self._partitions.items()}
+        totals = {k: sum(t[k] for t in tenants.values()) for k in ("buckets", "marked", "replays", "expirations", "evictions", "rejections")}
+        return {
+            "backend": self.name,
+            "entries": self._size,
+            "max_entries": self.max_entries,
+            "overflow": self.overflow,
+            "ttl_seconds": self.ttl_seconds,
+            **totals,
+            "tenants": tenants,
+            **({"journal": self.journal.stats()} if self.journal is not None else {}),
+            **self._timing_stats(),
+        }
+
+    def close(self) -> None:
+        if self.journal is not None:
+            self.journal.close()
+
+
+_MARK_SQL = (
+    "INSERT INTO nonces (tenant_id, nonce, expires_at) VALUES (?, ?, ?) "
+    "ON CONFLICT (tenant_id, nonce) DO UPDATE SET expires_at = excluded.expires_at "
+    "WHERE nonces.expires_at <= ?"
+)
+_PURGE_SQL = (
+    "DELETE FROM nonces WHERE (tenant_id, nonce) IN "
+    "(SELECT tenant_id, nonce FROM nonces WHERE expires_at <= ? LIMIT ?)"
+)
+
+
+class SqliteNonceStore(NonceBackend):
+    """Host-wide backend: a SQLite database in WAL mode shared by every worker process.
+
+    Check-and-mark is one upsert that inserts the pair or reclaims it only
+    if its previous mark has expired; SQLite's write lock makes it atomic
+    across processes, and the changed-row count tells new from replay.
+    Expired rows are deleted in batches of at most ``purge_batch`` every
+    ``purge_interval`` seconds (per process), so no single check pays for a
+    large cleanup. There is no entry cap: the table is bounded by traffic
+    within one TTL and lives on disk.
+
+    Connections are opened lazily per thread and per process (a fork gets
+    fresh ones).
+    """
+
+    name = "sqlite"
+
+    def __init__(
+        self,
+        path: str,
+        ttl_seconds: int,
+        purge_interval: float = 5.0,
+        purge_batch: int = 5000,
+        busy_timeout: float = 5.0,
+        tenant_ttls: Optional[Mapping[str, int]] = None,
+    ):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.tenant_ttls = dict(tenant_ttls or {})
+        self.purge_interval = purge_interval
+        self.purge_batch = purge_batch
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections: List[sqlite3.Connection] = []
+        self._next_purge = float("-inf")
+        self.marked = 0
+        self.replays = 0
+        self.expirations = 0
+
+    @classmethod
+    def from_env(cls) -> "SqliteNonceStore":
+        default_path = os.path.join(tempfile.gettempdir(), "tapsure-nonces.sqlite3")
+        return cls(
+            path=os.getenv("POS_QR_NONCE_SQLITE_PATH", "").strip() or default_path,
+            ttl_seconds=int(os.getenv("POS_QR_NONCE_TTL_SECONDS", "900")),
+            purge_interval=float(os.getenv("POS_QR_NONCE_PURGE_SECONDS", "5")),
+            tenant_ttls=tenant_policy_values("max_age_seconds"),
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None, check_same_thread=False)
+        deadline = time.monotonic() + self.busy_timeout
+        while True:
+            try:
+                self._init_schema(conn)
+                return conn
+            except sqlite3.OperationalError:
+                # Workers opening a fresh file at once race on the switch to
+                # WAL, which can fail as "locked" without waiting.
+                if time.monotonic() >= deadline:
+                    conn.close()
+                    raise
+                time.sleep(0.01)
+
+    @staticmethod
+    def _init_schema(conn: sqlite3.Connection) -> None:
+        # WAL lets readers and the single writer proceed concurrently; NORMAL
+        # sync still never corrupts the database (a power cut may drop the
+        # last few marks, not the file).
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS nonces ("
+            "tenant_id TEXT NOT NULL, nonce TEXT NOT NULL, expires_at REAL NOT NULL, "
+            "PRIMARY KEY (tenant_id, nonce)) WITHOUT ROWID"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS nonces_expires_at ON nonces (expires_at)")
+
+    def _conn(self) -> sqlite3.Connection:
+        local = self._local
+        pid = os.getpid()
+        if getattr(local, "pid", None) != pid:
+            local.conn = self._connect()
+            local.pid = pid
+            with self._lock:
+                self._connections.append(local.conn)
+        return local.conn
+
+    def _maybe_purge(self, conn: sqlite3.Connection, now: float) -> None:
+        if now < self._next_purge:
+            return
+        self._next_purge = now + self.purge_interval
+        deleted = conn.execute(_PURGE_SQL, (now, self.purge_batch)).rowcount
+        if deleted >= self.purge_batch:
+            # More expired rows remain; take another batch on the next check.
+            self._next_purge = now
+        with self._lock:
+            self.expirations += deleted
+
+    def _check_and_mark(self, tenant_id: str, nonce: str, now: Optional[float]) -> bool:
+        now = time.time() if now is None else now
+        conn = self._conn()
+        self._maybe_purge(conn, now)
+        fresh = conn.execute(_MARK_SQL, (tenant_id, nonce, now + float(self.ttl_for(tenant_id)), now)).rowcount == 1
+        with self._lock:
+            if fresh:
+                self.marked += 1
+            else:
+                self.replays += 1
+        return fresh
+
+    def _mark_many(self, pairs: Sequence[Tuple[str, str]], now: Optional[float]) -> List[str]:
+        # One write transaction for the batch instead of a commit per pair.
+        if not pairs:
+            return []
+        now = time.time() if now is None else now
+        conn = self._conn()
+        self._maybe_purge(conn, now)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            fresh = [conn.execute(_MARK_SQL, (t, n, now + float(self.ttl_for(t)), now)).rowcount == 1 for t, n in pairs]
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        marked = sum(fresh)
+        with self._lock:
+            self.marked += marked
+            self.replays += len(fresh) - marked
+        return ["ok" if f else "replay" for f in fresh]
+
+    def __len__(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM nonces").fetchone()[0]
+
+    def live_entries(self) -> Iterable[Entry]:
+        return self._conn().execute("SELECT tenant_id, nonce, expires_at FROM nonces WHERE expires_at > ?", (time.time(),)).fetchall()
+
+    def stats(self) -> Dict[str, Any]:
+        # Counters are this process's; ``entries`` is the shared table.
+        entries = len(self)
+        with self._lock:
+            return {
+                "backend": self.name,
+                "path": self.path,
+                "entries": entries,
+                "ttl_seconds": self.ttl_seconds,
+                "marked": self.marked,
+                "replays": self.replays,
+                "expirations": self.expirations,
+                **self._timing_stats(),
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        self._local = threading.local()
+
+
+FALLBACK_POLICIES = ("local", "reject")
+
+
+class RedisNonceStore(NonceBackend):
+    """Cluster-wide backend on a Redis-protocol server.
+
+    Each check is one ``SET key 1 NX EX ttl``: the server sets the key only
+    if it is absent and expires it itself, so the check is atomic across
+    every node and needs no purge. ``mark_many`` pipelines a whole batch
+    into one round trip on one pooled connection.
+
+    When the server cannot be reached (or errors), ``fallback="local"``
+    checks against an in-process ``NonceStore`` (replays that reach another
+    node go undetected meanwhile) and ``fallback="reject"`` fails the
+    tokens with ``nonce_store_unavailable``. After a failure the server is
+    not retried for ``retry_interval`` seconds, so an outage costs one
+    timeout per interval rather than one per request.
+    """
+
+    name = "redis"
+
+    def __init__(
+        self,
+        pool: RespPool,
+        ttl_seconds: int,
+        key_prefix: str = "tapsure:nonce:",
+        fallback: str = "local",
+        retry_interval: float = 5.0,
+        tenant_ttls: Optional[Mapping[str, int]] = None,
+    ):
+        if fallback not in FALLBACK_POLICIES:
+            raise ValueError(f"unknown nonce store fallback policy: {fallback}")
+        self.pool = pool
+        self.ttl_seconds = ttl_seconds
+        self.tenant_ttls = dict(tenant_ttls or {})
+        self.key_prefix = key_prefix
+        self.fallback = fallback
+        self.retry_interval = retry_interval
+        self._local = NonceStore(ttl_seconds=ttl_seconds, tenant_ttls=self.tenant_ttls)
+        self._lock = threading.Lock()
+        self._down_until = float("-inf")
+        self.marked = 0
+        self.replays = 0
+        self.errors = 0
+        self.fallbacks = 0
+        self.rejections = 0
+
+    @classmethod
+    def from_env(cls) -> "RedisNonceStore":
+        pool = RespPool.from_url(
+            os.getenv("POS_QR_NONCE_REDIS_URL", "redis://localhost:6379/0"),
+            timeout=float(os.getenv("POS_QR_NONCE_REDIS_TIMEOUT", "0.25")),
+            max_connections=int(os.getenv("POS_QR_NONCE_REDIS_POOL", "8")),
+        )
+        return cls(
+            pool,
+            ttl_seconds=int(os.getenv("POS_QR_NONCE_TTL_SECONDS", "900")),
+            key_prefix=os.getenv("POS_QR_NONCE_REDIS_PREFIX", "tapsure:nonce:"),
+            fallback=os.getenv("POS_QR_NONCE_FALLBACK", "local").strip().lower() or "local",
+            tenant_ttls=tenant_policy_values("max_age_seconds"),
+        )
+
+    def _key(self, tenant_id: str, nonce: str) -> bytes:
+        # Length-prefixed so no tenant/nonce pair can collide with another.
+        return f"{self.key_prefix}{len(tenant_id)}:{tenant_id}:{nonce}".encode("utf-8")
+
+    def _check_and_mark(self, tenant_id: str, nonce: str, now: Optional[float]) -> bool:
+        reason = self._mark_many([(tenant_id, nonce)], now)[0]
+        if reason == "nonce_store_unavailable":
+            raise NonceStoreUnavailable(reason)
+        return reason == "ok"
+
+    def _mark_many(self, pairs: Sequence[Tuple[str, str]], now: Optional[float]) -> List[str]:
+        if not pairs:
+            return []
+        if time.monotonic() >= self._down_until:
+            try:
+                replies = self.pool.pipeline([("SET", self._key(t, n), "1", "NX", "EX", int(self.ttl_for(t))) for t, n in pairs])
+            except (OSError, ValueError, RespError) as e:
+                self._down_until = time.monotonic() + self.retry_interval
+                with self._lock:
+                    self.errors += 1
+                log.warning("nonce store unreachable at %s: %s; %s for %.0fs", self.pool.address, e, self.fallback, self.retry_interval)
+            else:
+                return self._reasons(pairs, replies, now)
+        return self._fallback(pairs, now)
+
+    def _reasons(self, pairs: Sequence[Tuple[str, str]], replies: List[Any], now: Optional[float]) -> List[str]:
+        # An error reply (e.g. OOM, READONLY) fails only its own SET; the
+        # server answered, so it is not marked down and the rest stand.
+        failed = [i for i, r in enumerate(replies) if isinstance(r, RespError)]
+        reasons = ["ok" if r == "OK" else "replay" for r in replies]
+        marked = reasons.count("ok")
+        with self._lock:
+            self.marked += marked
+            self.replays += len(reasons) - marked - len(failed)
+            self.errors += len(failed)
+        if failed:
+            log.warning("nonce store at %s refused %d of %d marks: %s; %s", self.pool.address, len(failed), len(pairs), replies[failed[0]], self.fallback)
+            for i, reason in zip(failed, self._fallback([pairs[i] for i in failed], now)):
+                reasons[i] = reason
+        return reasons
+
+    def _fallback(self, pairs: Sequence[Tuple[str, str]], now: Optional[float]) -> List[str]:
+        with self._lock:
+            if self.fallback == "reject":
+                self.rejections += len(pairs)
+                return ["nonce_store_unavailable"] * len(pairs)
+            self.fallbacks += len(pairs)
+        return self._local._mark_many(pairs, now)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "backend": self.name,
+                "server": self.pool.address,
+                "ttl_seconds": self.ttl_seconds,
+                "fallback": self.fallback,
+                "available": time.monotonic() >= self._down_until,
+                "connections_opened": self.pool.connects,
+                "marked": self.marked,
+                "replays": self.replays,
+                "errors": self.errors,
+                "fallbacks": self.fallbacks,
+                "rejections": self.rejections,
+                "local_entries": len(self._local),
+                **self._timing_stats(),
+            }
+
+    def close(self) -> None:
+        self.pool.close()
+
+
+class PrefilteredNonceStore(NonceBackend):
+    """A rotating Bloom filter in front of an authoritative backend.
+
+    A nonce the filter has definitely not seen is accepted at once; its
+    mark is queued and written to ``inner`` in pipelined batches of
+    ``flush_batch`` (or after ``flush_interval`` seconds, checked on each
+    call) instead of costing a round trip per verification. Only possible
+    hits (real replays and filter false positives) wait for ``inner``.
+
+    The filter is per process, so this is exact only when one process fronts
+    the store (a single worker, or ``memory``). With several workers or
+    nodes sharing ``inner``, a replay that reaches a process whose filter
+    never saw the nonce is accepted and only shows up when the queued mark
+    is refused (``late_replays``).
+    """
+
+    name = "prefiltered"
+
+    def __init__(self, inner: NonceBackend, bloom: RotatingBloomFilter, flush_batch: int = 64, flush_interval: float = 0.05):
+        self.inner = inner
+        self.bloom = bloom
+        self.ttl_seconds = inner.ttl_seconds
+        self.tenant_ttls = inner.tenant_ttls
+        self.flush_batch = flush_batch
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        # Held while talking to ``inner``: a possible hit must not overtake a
+        # flush that is still writing the mark it should find.
+        self._io_lock = threading.Lock()
+        self._pending: List[Tuple[str, str]] = []
+        self._pending_since = 0.0
+        self.definite_misses = 0
+        self.possible_hits = 0
+        self.false_positives = 0
+        self.late_replays = 0
+        self.write_errors = 0
+        # A fresh filter would wave through replays of nonces the store
+        # already holds (e.g. after a restart), so seed it from the store.
+        now = time.time()
+        self.seeded = 0
+        for tenant_id, nonce, _ in inner.live_entries():
+            bloom.add_if_absent(self._filter_key(tenant_id, nonce), now)
+            self.seeded += 1
+
+    @classmethod
+    def wrap_from_env(cls, inner: NonceBackend) -> "PrefilteredNonceStore":
+        bloom = RotatingBloomFilter(
+            capacity=int(os.getenv("POS_QR_NONCE_FILTER_CAPACITY", "1000000")),
+            fp_rate=float(os.getenv("POS_QR_NONCE_FILTER_FP_RATE", "0.001")),
+            ttl_seconds=inner.max_ttl(),
+        )
+        return cls(inner, bloom)
+
+    @staticmethod
+    def _filter_key(tenant_id: str, nonce: str) -> bytes:
+        return f"{len(tenant_id)}:{tenant_id}:{nonce}".encode("utf-8")
+
+    def _flush(self) -> None:
+        # Caller holds ``_io_lock``.
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return
+        # Untimed inner calls: this wrapper's own timing already covers them.
+        reasons = self.inner._mark_many(pending, None)
+        late = reasons.count("replay")
+        failed = len(reasons) - late - reasons.count("ok")
+        if late or failed:
+            with self._lock:
+                self.late_replays += late
+                self.write_errors += failed
+            if late:
+                log.warning("nonce prefilter: %d accepted nonce(s) were already marked in %s", late, self.inner.name)
+
+    def _check_and_mark(self, tenant_id: str, nonce: str, now: Optional[float]) -> bool:
+        now = time.time() if now is None else now
+        with self._lock:
+            fresh = self.bloom.add_if_absent(self._filter_key(tenant_id, nonce), now)
+            # A miss is accepted before ``inner`` sees it, which is only sound
+            # while ``inner`` cannot refuse the mark (a tenant quota or a full
+            # store under overflow="reject"); otherwise it waits for ``inner``.
+            write_behind = fresh and not self.inner._may_refuse(tenant_id, len(self._pending))
+            if fresh:
+                self.definite_misses += 1
+            else:
+                self.possible_hits += 1
+            if write_behind:
+                if not self._pending:
+                    self._pending_since = time.monotonic()
+                self._pending.append((tenant_id, nonce))
+                due = len(self._pending) >= self.flush_batch or time.monotonic() - self._pending_since >= self.flush_interval
+        if write_behind:
+            if due:
+                with self._io_lock:
+                    self._flush()
+            return True
+
+        with self._io_lock:
+            # Queued marks first, so the authoritative answer covers them.
+            self._flush()
+            reason = self.inner._mark_many([(tenant_id, nonce)], now)[0]
+        if reason == "ok":
+            if not fresh:
+                with self._lock:
+                    self.false_positives += 1
+            return True
+        if reason == "nonce_store_full":
+            raise NonceStoreFull(reason)
+        if reason == "nonce_store_unavailable":
+            raise NonceStoreUnavailable(reason)
+        return False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            filter_stats = {
+                **self.bloom.stats(),
+                "definite_misses": self.definite_misses,
+                "possible_hits": self.possible_hits,
+                "false_positives": self.false_positives,
+                "late_replays": self.late_replays,
+                "write_errors": self.write_errors,
+                "pending_writes": len(self._pending),
+                "seeded": self.seeded,
+            }
+        return {**self.inner.stats(), "prefilter": filter_stats, **self._timing_stats()}
+
+    def close(self) -> None:
+        with self._io_lock:
+            self._flush()
+        self.inner.close()
+
+
+_BACKENDS: Dict[str, Callable[[], NonceBackend]] = {}
+
+
+def register_nonce_backend(name: str, factory: Callable[[], NonceBackend]) -> None:
+    """Register a nonce backend; ``factory`` builds it from env (selected by ``POS_QR_NONCE_BACKEND``)."""
+    _BACKENDS[name] = factory
+
+
+def nonce_store_from_env() -> NonceBackend:
+    name = (os.getenv("POS_QR_NONCE_BACKEND", "memory") or "").strip().lower() or "memory"
+    factory = _BACKENDS.get(name)
+    if factory is None:
+        # No silent fallback: a per-process store would quietly re-open
+        # replays across workers.
+        raise ValueError(f"unknown nonce backend: {name} (known: {', '.join(sorted(_BACKENDS))})")
+    store = factory()
+    prefilter = (os.getenv("POS_QR_NONCE_PREFILTER", "off") or "").strip().lower() in {"1", "true", "yes", "on"}
+    if prefilter:
+        store = PrefilteredNonceStore.wrap_from_env(store)
+    log.info("nonce store backend=%s prefilter=%s ttl=%ss", name, prefilter, store.ttl_seconds)
+    return store
+
+
+register_nonce_backend("memory", NonceStore.from_env)
+register_nonce_backend("sqlite", SqliteNonceStore.from_env)
+register_nonce_backend("redis", RedisNonceStore.from_env)
+
+_global_nonce_store: Optional[NonceBackend] = None
+_global_lock = threading.Lock()
+
+
+def get_nonce_store() -> NonceBackend:
+    # Built on first use (not at import) so .env files loaded after import apply.
+    global _global_nonce_store
+    if _global_nonce_store is None:
+        with _global_lock:
+            if _global_nonce_store is None:
+                _global_nonce_store = nonce_store_from_env()
+    return _global_nonce_store
@@ -0,0 +1,482 @@
+"""A pool of long-lived OCR worker processes.
+
+pytesseract starts a ``tesseract`` process per image, which writes temp files
+and reloads the language model every time. Each worker here loads its OCR
+engine once and then serves jobs from a pipe for its whole life:
+
+- ``capi``: libtesseract's C API through ctypes (``TessBaseAPIInit3`` once,
+  then ``SetImage``/``GetUTF8Text`` per job on the raw gray buffer), found
+  via ``TAPSURE_TESSERACT_LIB`` or the system library path. Page
+  segmentation is set to ``PSM_AUTO``, as the ``tesseract`` CLI uses.
+- ``cli``: pytesseract, when libtesseract is not available. Still one
+  subprocess per image, but preprocessing and decoding stay in the worker.
+
+Images reach the workers through shared memory, as with the image executor:
+an ``IngestedImage`` from the process executor is mapped as-is, anything else
+is copied into a segment for the job. Only the segment name crosses the pipe.
+
+Jobs wait in a bounded queue; when it is full ``submit`` raises
+``OcrPoolBusy`` at once instead of letting latency grow without limit. The
+parent runs one dispatcher thread per worker. A job that runs past
+``timeout`` gets ``OcrTimeout`` and its worker is killed. If a worker dies
+mid-job, the job gets ``OcrWorkerCrashed``. Either way the worker is
+restarted at once; when restarts keep failing, they back off exponentially
+up to ``max_backoff`` seconds.
+"""
+from __future__ import annotations
+
+import asyncio
+import ctypes
+import ctypes.util
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import get_context, shared_memory
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .image_executor import IngestedImage, _run_with_shared_bytes, _run_with_shared_gray
+
+log = logging.getLogger("tapsure.ocr_pool")
+
+# tesseract's PageSegMode: fully automatic, no OSD. The C API's own default
+# is PSM_SINGLE_BLOCK.
+PSM_AUTO = 3
+
+
+class OcrPoolError(RuntimeError):
+    pass
+
+
+class OcrPoolBusy(OcrPoolError):
+    """The job queue is full."""
+
+
+class OcrJobFailed(OcrPoolError):
+    pass
+
+
+class OcrTimeout(OcrJobFailed):
+    pass
+
+
+class OcrWorkerCrashed(OcrJobFailed):
+    pass
+
+
+class CApiEngine:
+    """libtesseract through its C API; the model is loaded once, in ``__init__``."""
+
+    name = "capi"
+
+    def __init__(self, lang: str = "eng", lib_path: Optional[str] = None):
+        path = lib_path or ctypes.util.find_library("tesseract")
+        if not path:
+            raise OSError("libtesseract not found")
+        lib = ctypes.CDLL(path)
+        lib.TessBaseAPICreate.restype = ctypes.c_void_p
+        lib.TessBaseAPIInit3.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p]
+        lib.TessBaseAPIInit3.restype = ctypes.c_int
+        lib.TessBaseAPISetPageSegMode.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        lib.TessBaseAPISetImage.argtypes = [ctypes.c_void_p, ctypes.c_void_p] + [ctypes.c_int] * 4
+        lib.TessBaseAPISetSourceResolution.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        lib.TessBaseAPIGetUTF8Text.argtypes = [ctypes.c_void_p]
+        lib.TessBaseAPIGetUTF8Text.restype = ctypes.c_void_p  # freed with TessDeleteText
+        lib.TessDeleteText.argtypes = [ctypes.c_void_p]
+        for fn in ("TessBaseAPIClear", "TessBaseAPIEnd", "TessBaseAPIDelete"):
+            getattr(lib, fn).argtypes = [ctypes.c_void_p]
+        self._lib = lib
+        self._api = lib.TessBaseAPICreate()
+        # A None datapath means TESSDATA_PREFIX or the build default.
+        if lib.TessBaseAPIInit3(self._api, None, lang.encode()) != 0:
+            lib.TessBaseAPIDelete(self._api)
+            raise OSError(f"tesseract could not load language {lang!r}")
+        lib.TessBaseAPISetPageSegMode(self._api, PSM_AUTO)
+
+    def recognize(self, gray: Any, dpi: Optional[int]) -> str:
+        import numpy as np
+
+        pixels = np.ascontiguousarray(gray, dtype=np.uint8)
+        height, width = pixels.shape
+        lib = self._lib
+        lib.TessBaseAPISetImage(self._api, pixels.ctypes.data, width, height, 1, width)
+        if dpi:
+            lib.TessBaseAPISetSourceResolution(self._api, int(dpi))
+        text_ptr = lib.TessBaseAPIGetUTF8Text(self._api)
+        try:
+            return ctypes.string_at(text_ptr).decode("utf-8", "replace") if text_ptr else ""
+        finally:
+            if text_ptr:
+                lib.TessDeleteText(text_ptr)
+            lib.TessBaseAPIClear(self._api)
+
+    def close(self) -> None:
+        self._lib.TessBaseAPIEnd(self._api)
+        self._lib.TessBaseAPIDelete(self._api)
+
+
+class CliEngine:
+    """pytesseract (a subprocess per image), for hosts without libtesseract."""
+
+    name = "cli"
+
+    def __init__(self, lang: str = "eng"):
+        from .agents import receipt  # sets TESSERACT_CMD
+
+        self._pytesseract = receipt.pytesseract
+        self.lang = lang
+
+    def recognize(self, gray: Any, dpi: Optional[int]) -> str:
+        return self._pytesseract.image_to_string(gray, lang=self.lang, config=f"--dpi {dpi}" if dpi else "")
+
+    def close(self) -> None:
+        pass
+
+
+def load_engine(lang: str = "eng") -> Any:
+    """The C API engine if libtesseract loads, else the pytesseract one."""
+    try:
+        return CApiEngine(lang, os.getenv("TAPSURE_TESSERACT_LIB") or None)
+    except (OSError, AttributeError) as e:
+        log.info("tesseract C API unavailable (%s); OCR workers use the tesseract CLI", e)
+        return CliEngine(lang)
+
+
+def _recognize(image: Any, engine: Any, preprocess: Optional[bool]) -> str:
+    from .agents.receipt import ocr_input
+
+    gray, dpi = ocr_input(image, preprocess)
+    return engine.recognize(gray, dpi)
+
+
+def _share(image: Any) -> Tuple[tuple, Optional[shared_memory.SharedMemory]]:
+    """The job's image as a shared-memory reference, and the segment if one was created for it.
+
+    A process-executor ``IngestedImage`` is already in a segment; other images
+    are copied into a new one, which the caller closes and unlinks.
+    """
+    import numpy as np
+
+    if isinstance(image, IngestedImage):
+        if image.shm_name is not None:
+            return ("gray", image.shm_name, image.shape), None
+        image = image.gray
+    if isinstance(image, np.ndarray):
+        gray = np.ascontiguousarray(image, dtype=np.uint8)
+        shm = shared_memory.SharedMemory(create=True, size=max(1, gray.nbytes))
+        np.ndarray(gray.shape, dtype=np.uint8, buffer=shm.buf)[...] = gray
+        return ("gray", shm.name, gray.shape), shm
+    size = len(image)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, size))
+    shm.buf[:size] = image
+    return ("bytes", shm.name, size), shm
+
+
+def _worker_main(conn: Any, engine_factory: Callable[[str], Any], lang: str) -> None:
+    # Runs in the worker process: load the engine once, then serve jobs
+    # until the parent sends None or goes away.
+    started = time.perf_counter()
+    engine = engine_factory(lang)
+    conn.send(("ready", engine.name, time.perf_counter() - started))
+    try:
+        while True:
+            try:
+                job = conn.recv()
+            except EOFError:
+                break
+            if job is None:
+                break
+            job_id, (kind, shm_name, layout), preprocess = job
+            run = _run_with_shared_gray if kind == "gray" else _run_with_shared_bytes
+            try:
+                conn.send((job_id, True, run(_recognize, shm_name, layout, (engine, preprocess), {})))
+            except Exception as e:
+                conn.send((job_id, False, f"{type(e).__name__}: {e}"))
+    finally:
+        engine.close()
+
+
+class _Job:
+    __slots__ = ("id", "image", "preprocess", "future")
+
+    def __init__(self, job_id: int, image: Any, preprocess: Optional[bool]):
+        self.id = job_id
+        self.image = image
+        self.preprocess = preprocess
+        self.future: "Future[str]" = Future()
+
+
+class _Slot:
+    """One worker process and the parent-side end of its pipe."""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.process: Any = None
+        self.conn: Any = None
+        self.engine = ""
+        self.failures = 0  # consecutive failed starts or jobs, for backoff
+
+    def kill(self) -> None:
+        process, self.process = self.process, None
+        conn, self.conn = self.conn, None
+        if conn is not None:
+            conn.close()
+        if process is not None and process.is_alive():
+            process.kill()
+        if process is not None:
+            process.join(timeout=5)
+
+
+class OcrPool:
+    def __init__(
+        self,
+        workers: int = 0,
+        max_queue: int = 64,
+        timeout: float = 30.0,
+        lang: str = "eng",
+        engine_factory: Callable[[str], Any] = load_engine,
+        startup_timeout: float = 60.0,
+        max_backoff: float = 5.0,
+    ):
+        self.workers = max(0, int(workers))
+        self.max_queue = max(1, int(max_queue))
+        self.timeout = timeout
+        self.lang = lang
+        self.engine_factory = engine_factory
+        self.startup_timeout = startup_timeout
+        self.max_backoff = max_backoff
+        self._ctx = get_context("spawn")
+        self._queue: "queue.Queue[Optional[_Job]]" = queue.Queue(maxsize=self.max_queue)
+        self._ids = itertools.count(1)
+        self._slots: List[_Slot] = []
+        self._threads: List[threading.Thread] = []
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self.jobs = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.crashes = 0
+        self.starts = 0
+        self.start_failures = 0
+        self.rejected = 0
+        self.startup_seconds = 0.0
+        self.busy_seconds = 0.0
+
+    @classmethod
+    def from_env(cls) -> "OcrPool":
+        return cls(
+            workers=int(os.getenv("TAPSURE_OCR_WORKERS", "0") or "0"),
+            max_queue=int(os.getenv("TAPSURE_OCR_QUEUE", "64")),
+            timeout=float(os.getenv("TAPSURE_OCR_TIMEOUT_SECONDS", "30")),
+            lang=os.getenv("TAPSURE_OCR_LANG", "eng"),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 0
+
+    @property
+    def started(self) -> bool:
+        return bool(self._threads)
+
+    def start(self) -> None:
+        """Start the dispatchers; each spawns its worker in the background."""
+        if self.started or not self.enabled:
+            return
+        self._stopping.clear()
+        for index in range(self.workers):
+            slot = _Slot(index)
+            thread = threading.Thread(target=self._serve, args=(slot,), name=f"tapsure-ocr-{index}", daemon=True)
+            self._slots.append(slot)
+            self._threads.append(thread)
+            thread.start()
+        log.info("OCR pool started workers=%d queue=%d timeout=%.1fs", self.workers, self.max_queue, self.timeout)
+
+    def submit(self, image: Any, preprocess: Optional[bool] = None) -> "Future[str]":
+        if not self.started or self._stopping.is_set():
+            raise OcrPoolError("OCR pool is not running")
+        job = _Job(next(self._ids), image, preprocess)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            raise OcrPoolBusy(f"OCR queue full ({self.max_queue} jobs waiting)") from None
+        return job.future
+
+    async def ocr(self, image: Any, preprocess: Optional[bool] = None) -> str:
+        return await asyncio.wrap_future(self.submit(image, preprocess))
+
+    # --- dispatcher side (one thread per worker) ---
+
+    def _spawn(self, slot: _Slot) -> None:
+        parent, child = self._ctx.Pipe()
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(child, self.engine_factory, self.lang),
+            name=f"tapsure-ocr-worker-{slot.index}",
+            daemon=True,
+        )
+        process.start()
+        child.close()
+        slot.process, slot.conn = process, parent
+        if not parent.poll(self.startup_timeout):
+            slot.kill()
+            raise OcrWorkerCrashed(f"OCR worker {slot.index} did not start within {self.startup_timeout}s")
+        try:
+            _, slot.engine, seconds = parent.recv()
+        except EOFError:
+            slot.kill()
+            raise OcrWorkerCrashed(f"OCR worker {slot.index} exited while loading its engine") from None
+        with self._lock:
+            self.starts += 1
+            self.startup_seconds += seconds
+        log.info("OCR worker %d ready engine=%s load=%.0fms", slot.index, slot.engine, seconds * 1000.0)
+
+    def _ensure_worker(self, slot: _Slot) -> bool:
+        while slot.process is None and not self._stopping.is_set():
+            if slot.failures:
+                self._stopping.wait(min(self.max_backoff, 0.1 * 2 ** (slot.failures - 1)))
+                if self._stopping.is_set():
+                    break
+            try:
+                self._spawn(slot)
+            except Exception as e:
+                slot.failures += 1
+                with self._lock:
+                    self.start_failures += 1
+                log.warning("OCR worker %d failed to start (%s); retrying", slot.index, e)
+        return slot.process is not None
+
+    def _serve(self, slot: _Slot) -> None:
+        try:
+            while not self._stopping.is_set():
+                # Start (or restart) the worker before taking a job, so the
+                # model load is not charged to the next request.
+                if not self._ensure_worker(slot):
+                    break
+                try:
+                    # Polled, so a shutdown reaches every dispatcher even
+                    # when the queue has no room for one wake-up per thread.
+                    job = self._queue.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                if job is None:
+                    break
+                if job.future.set_running_or_notify_cancel():
+                    self._run_job(slot, job)
+        finally:
+            if slot.conn is not None:
+                try:
+                    slot.conn.send(None)
+                except OSError:
+                    pass
+                if slot.process is not None:
+                    slot.process.join(timeout=2)
+            slot.kill()
+
+    def _run_job(self, slot: _Slot, job: _Job) -> None:
+        started = time.perf_counter()
+        shm: Optional[shared_memory.SharedMemory] = None
+        try:
+            try:
+                ref, shm = _share(job.image)
+            except Exception as e:
+                with self._lock:
+                    self.errors += 1
+                job.future.set_exception(OcrJobFailed(f"{type(e).__name__}: {e}"))
+                return
+            slot.conn.send((job.id, ref, job.preprocess))
+            if not slot.conn.poll(self.timeout):
+                raise OcrTimeout(f"OCR job exceeded {self.timeout}s")
+            job_id, ok, result = slot.conn.recv()
+        except OcrTimeout as e:
+            slot.kill()
+            slot.failures += 1
+            with self._lock:
+                self.timeouts += 1
+            log.warning("OCR worker %d timed out; restarting it", slot.index)
+            job.future.set_exception(e)
+            return
+        except (EOFError, OSError) as e:
+            exitcode = slot.process.exitcode if slot.process is not None else None
+            slot.kill()
+            slot.failures += 1
+            with self._lock:
+                self.crashes += 1
+            log.warning("OCR worker %d died (exit code %s); restarting it", slot.index, exitcode)
+            job.future.set_exception(OcrWorkerCrashed(f"OCR worker died mid-job: {e or exitcode}"))
+            return
+        finally:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+            with self._lock:
+                self.jobs += 1
+                self.busy_seconds += time.perf_counter() - started
+        slot.failures = 0
+        if ok:
+            job.future.set_result(result)
+        else:
+            with self._lock:
+                self.errors += 1
+            job.future.set_exception(OcrJobFailed(result))
+
+    def shutdown(self) -> None:
+        if not self.started:
+            return
+        self._stopping.set()
+        # Fail whatever is still queued, then wake the idle dispatchers; any
+        # that find no wake-up see the stop flag on their next poll.
+        self._fail_queued()
+        for _ in self._threads:
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                break
+        for thread in self._threads:
+            thread.join(timeout=self.timeout + 5)
+        self._fail_queued()  # submitted while stopping
+        self._threads, self._slots = [], []
+        self._queue = queue.Queue(maxsize=self.max_queue)
+        log.info("OCR pool stopped")
+
+    def _fail_queued(self) -> None:
+        while True:
+            try:
+                job = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if job is not None and job.future.set_running_or_notify_cancel():
+                job.future.set_exception(OcrPoolError("OCR pool shut down"))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            jobs = self.jobs
+            out: Dict[str, Any] = {
+                "workers": self.workers,
+                "alive": sum(1 for s in self._slots if s.process is not None and s.process.is_alive()),
+                "engines": sorted({s.engine for s in self._slots if s.engine}),
+                "queued": self._queue.qsize(),
+                "max_queue": self.max_queue,
+                "jobs": jobs,
+                "errors": self.errors,
+                "timeouts": self.timeouts,
+                "crashes": self.crashes,
+                "rejected": self.rejected,
+                "worker_starts": self.starts,
+                "worker_start_failures": self.start_failures,
+                "avg_startup_ms": round(self.startup_seconds * 1000.0 / self.starts, 1) if self.starts else 0.0,
+                "avg_job_ms": round(self.busy_seconds * 1000.0 / jobs, 1) if jobs else 0.0,
+            }
+        return out
+
+
+_global_ocr_pool = OcrPool.from_env()
+
+
+def get_ocr_pool() -> OcrPool:
+    return _global_ocr_pool
@@ -1,6 +1,9 @@
 from .agents.receipt import ReceiptAnalyzer
 from .agents.coverage import CoverageRecommender
 from .agents.conversation import ConversationalAgent
+from .config import LAZY_OCR_MAX_BYTES, LAZY_OCR_MAX_ENTRIES, LAZY_OCR_MAX_UPLOAD_BYTES, LAZY_OCR_MODE
+from .deferred_ocr import DeferredOcr, has_pos_facts, receipt_from_pos_payload
+from .image_executor import IngestedImage
 from .models import ReceiptData, RecommendationResponse, CoverageOption, PolicyConfirmation, PosQrPayload
 import json
 import uuid
@@ -86,11 +89,26 @@ def _compute_trust_from_profile(analysis: ReceiptData) -> tuple[int, float] | No
     rating = max(1, min(5, rating))
     return rating, conf
 
+def _payload_model(pos_qr_payload: dict | None) -> PosQrPayload | None:
+    if not isinstance(pos_qr_payload, dict) or not pos_qr_payload:
+        return None
+    try:
+        return PosQrPayload(**pos_qr_payload)
+    except Exception:
+        return None
+
 class Orchestrator:
-    def __init__(self):
+    def __init__(self, lazy_ocr: str | None = None):
         self.receipt = ReceiptAnalyzer()
         self.coverage = CoverageRecommender()
         self.chat = ConversationalAgent()
+        self.deferred_ocr = DeferredOcr(
+            self.receipt.analyze,
+            mode=LAZY_OCR_MODE if lazy_ocr is None else lazy_ocr,
+            max_entries=LAZY_OCR_MAX_ENTRIES,
+            max_bytes=LAZY_OCR_MAX_BYTES,
+            max_upload_bytes=LAZY_OCR_MAX_UPLOAD_BYTES,
+        )
         self._state = {}
 
     async def handle_image_upload(
@@ -101,15 +119,18 @@ class Orchestrator:
         pos_qr_verified: bool = False,
         pos_qr_reason: str | None = None,
         pos_qr_payload: dict | None = None,
+        image: IngestedImage | None = None,
     ) -> ReceiptData:
-        analysis = await self.receipt.analyze(image_bytes, filename)
-
-        payload_model = None
-        if isinstance(pos_qr_payload, dict) and pos_qr_payload:
-            try:
-                payload_model = PosQrPayload(**pos_qr_payload)
-            except Exception:
-                payload_model = None
+        payload_model = _payload_model(pos_qr_payload)
+
+        # POS fast path: the signed payload has the facts, so OCR is deferred.
+        deferred = self.defers_ocr(pos_qr_verified, pos_qr_payload, len(image_bytes))
+        if deferred:
+            category = self.receipt._infer_category(f"{payload_model.merchant_id} {filename}")
+            analysis = receipt_from_pos_payload(payload_model, category)
+            analysis = analysis.model_copy(update={"receipt_id": uuid.uuid4().hex})
+        else:
+            analysis = await self.receipt.analyze(image_bytes, filename, image=image)
 
         analysis = analysis.model_copy(
             update={
@@ -126,6 +147,8 @@ class Orchestrator:
         else:
             trust_rating, trust_confidence = trust
         analysis = analysis.model_copy(update={"trust_rating": trust_rating, "trust_confidence": trust_confidence})
+        if deferred:
+            self.deferred_ocr.park(analysis, image_bytes, filename)
 
         self._state["receipt"] = analysis.model_dump()
         self._state["trust"] = {"rating": trust_rating, "confidence": trust_confidence}
@@ -141,6 +164,19 @@ class Orchestrator:
             self._state["pos_qr"] = {"verified": bool(pos_qr_verified), "reason": pos_qr_reason}
         return analysis
 
+    def defers_ocr(self, pos_qr_verified: bool, pos_qr_payload: dict | None, size: int) -> bool:
+        """Whether ``handle_image_upload`` will answer from the payload and leave OCR for later."""
+        if not (pos_qr_verified and self.deferred_ocr.accepts(size)):
+            return False
+        return has_pos_facts(_payload_model(pos_qr_payload))
+
+    async def receipt_ocr(self, receipt_id: str) -> ReceiptData | None:
+        """A fast-path receipt with its deferred OCR filled in; None if unknown or evicted."""
+        result = await self.deferred_ocr.complete(receipt_id)
+        if result is not None and (self._state.get("receipt") or {}).get("receipt_id") == receipt_id:
+            self._state["receipt"] = result.model_dump()
+        return result
+
     async def recommend_coverage(self, receipt: ReceiptData) -> RecommendationResponse:
         rec = self.coverage.make_options(receipt)
         self._state['recommendation'] = rec.model_dump()
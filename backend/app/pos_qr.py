@@ -3,14 +3,18 @@ from __future__ import annotations
 import base64
 import hashlib
 import hmac
-import io
 import json
+import logging
 import os
 import time
-from dataclasses import dataclass
-from typing import Any, Dict, Optional, Tuple
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, Mapping, Optional, Sequence, Tuple, Union
 
-from PIL import Image
+from . import compact_token
+from .imaging import ImageSource, as_gray, decode_gray_reduced
+from .nonce_store import NonceBackend, NonceStore  # noqa: F401
+from .qr_detectors import backend_order, get_detector
+from .tenant_keys import TenantKeyRegistry, parse_keyring
 
 try:
     import cv2  # type: ignore
@@ -21,6 +25,16 @@ except Exception:  # pragma: no cover
 
 
 TOKEN_PREFIX = "TSQR1"
+# Every accepted format; ``parse_token`` and ``check_token`` dispatch on it.
+TOKEN_PREFIXES = (TOKEN_PREFIX, compact_token.PREFIX)
+
+# A plain {"tenant": "secret" | keyring} mapping or a prepared, reloading registry.
+TenantSecrets = Union[Dict[str, Any], TenantKeyRegistry]
+
+# One token window for every tenant, or per tenant with a required "*" default.
+MaxAge = Union[int, Mapping[str, int]]
+
+log = logging.getLogger("tapsure.pos_qr")
 
 
 def _b64url_encode(raw: bytes) -> str:
@@ -32,19 +46,120 @@ def _b64url_decode(text: str) -> bytes:
     return base64.urlsafe_b64decode(text + padding)
 
 
-def build_token(payload: Dict[str, Any], secret: str) -> str:
+def build_token(
+    payload: Dict[str, Any],
+    secret: str,
+    prefix: str = TOKEN_PREFIX,
+    mac_bytes: Optional[int] = None,
+    kid: Optional[str] = None,
+) -> str:
+    """Sign ``payload`` as a TSQR1 (JSON) or, with ``prefix="TSQR2"``, a compact token.
+
+    ``mac_bytes`` truncates the TSQR2 MAC (8-32 bytes, default 16); TSQR1
+    always carries the full 32-byte MAC. ``kid`` names the tenant key
+    ``secret`` belongs to and is embedded (signed) so the verifier can select
+    it directly.
+    """
+    if kid:
+        payload = dict(payload, kid=kid)
+    if prefix == compact_token.PREFIX:
+        return compact_token.build(payload, secret, mac_bytes or compact_token.DEFAULT_MAC_BYTES)
+    if prefix != TOKEN_PREFIX or mac_bytes not in (None, SIG_BYTES):
+        raise ValueError("unsupported_token_format")
     payload_json = json.dumps(payload, separators=(",", ":"), sort_keys=True).encode("utf-8")
     sig = hmac.new(secret.encode("utf-8"), payload_json, hashlib.sha256).digest()
     return f"{TOKEN_PREFIX}.{_b64url_encode(payload_json)}.{_b64url_encode(sig)}"
 
 
-def parse_token(token: str) -> Tuple[Dict[str, Any], bytes]:
-    parts = token.strip().split(".")
+# Tokens are printed as QR codes, so anything much past a few hundred bytes is
+# not ours; reject it before decoding or hashing.
+MAX_TOKEN_CHARS = int(os.getenv("POS_QR_MAX_TOKEN_CHARS", "2048"))
+SIG_BYTES = hashlib.sha256().digest_size
+
+_JSON_WS = " \t\r\n"
+_json_decoder = json.JSONDecoder()
+
+
+def split_token(token: str) -> Tuple[bytes, bytes]:
+    """Return the raw signed payload bytes and signature, without parsing them."""
+    token = token.strip()
+    if len(token) > MAX_TOKEN_CHARS:
+        raise ValueError("token_too_large")
+    if token.startswith(compact_token.PREFIX):
+        return compact_token.split(token)
+    parts = token.split(".")
     if len(parts) != 3 or parts[0] != TOKEN_PREFIX:
         raise ValueError("invalid_token_format")
+    try:
+        return _b64url_decode(parts[1]), _b64url_decode(parts[2])
+    except (ValueError, TypeError):
+        raise ValueError("invalid_token_format") from None
+
 
-    payload_json = _b64url_decode(parts[1])
-    sig = _b64url_decode(parts[2])
+def _peek_ids(payload_json: bytes) -> Tuple[str, str]:
+    """Read ``tenant_id`` and ``kid`` out of the payload without parsing the whole document.
+
+    Only used to pick the HMAC key; once the signature checks out the payload
+    is parsed and must agree (see ``check_token``).
+    """
+    try:
+        text = payload_json.decode("utf-8")
+    except UnicodeDecodeError:
+        return "", ""
+    ids = _peek_top_level(text, ("tenant_id", "kid"))
+    tenant_id = ids.get("tenant_id", "")
+    return tenant_id, (ids.get("kid", "") if tenant_id else "")
+
+
+def _peek_top_level(text: str, fields: Tuple[str, ...]) -> Dict[str, str]:
+    """String values of ``fields`` among the top-level keys of a JSON object.
+
+    Walks the object key by key, so a value (or a nested key) that happens to
+    spell a field name is never taken for it. String values are only scanned;
+    anything else is decoded to be skipped. A repeated key keeps its first
+    value; ``check_token`` rejects the token when the parsed (last) one
+    differs. Stops quietly at the first malformed spot.
+    """
+    found: Dict[str, str] = {}
+    seen = set()
+    n = len(text)
+
+    def skip_ws(i: int) -> int:
+        while i < n and text[i] in _JSON_WS:
+            i += 1
+        return i
+
+    i = skip_ws(0)
+    if i >= n or text[i] != "{":
+        return found
+    i = skip_ws(i + 1)
+    try:
+        while i < n and text[i] == '"':
+            key, i = json.decoder.scanstring(text, i + 1)
+            i = skip_ws(i)
+            if i >= n or text[i] != ":":
+                break
+            i = skip_ws(i + 1)
+            if i < n and text[i] == '"':
+                value, i = json.decoder.scanstring(text, i + 1)
+                if key in fields and key not in seen:
+                    found[key] = value
+            else:
+                _, i = _json_decoder.raw_decode(text, i)
+            seen.add(key)
+            i = skip_ws(i)
+            if i >= n or text[i] != ",":
+                break
+            i = skip_ws(i + 1)
+    except ValueError:
+        pass
+    return found
+
+
+def parse_token(token: str) -> Tuple[Dict[str, Any], bytes]:
+    payload_json, sig = split_token(token)
+    if token.lstrip().startswith(compact_token.PREFIX):
+        return compact_token.unpack(payload_json), sig
 
     payload = json.loads(payload_json.decode("utf-8"))
     if not isinstance(payload, dict):
@@ -54,158 +169,519 @@ def parse_token(token: str) -> Tuple[Dict[str, Any], bytes]:
 
 
 @dataclass
-class NonceStore:
-    ttl_seconds: int
-    _seen: Dict[Tuple[str, str], float]
+class QrDecodeResult:
+    """Texts decoded from an image plus which cascade stage produced them."""
 
-    def __init__(self, ttl_seconds: int):
-        self.ttl_seconds = ttl_seconds
-        self._seen = {}
+    texts: list[str]
+    stage: Optional[str] = None
+    stages_tried: list[str] = field(default_factory=list)
+    timings_ms: Dict[str, float] = field(default_factory=dict)
 
-    def _purge(self, now: float) -> None:
-        expired = [k for k, exp in self._seen.items() if exp <= now]
-        for k in expired:
-            self._seen.pop(k, None)
+    @property
+    def tokens(self) -> list[str]:
+        """Decoded texts carrying the token prefix, in decode order."""
+        return [t for t in self.texts if t.startswith(TOKEN_PREFIXES)]
 
-    def check_and_mark(self, tenant_id: str, nonce: str, now: Optional[float] = None) -> bool:
-        """Returns True if nonce is new (and marks it), False if replay."""
-        now = time.time() if now is None else now
-        self._purge(now)
-        key = (tenant_id, nonce)
-        if key in self._seen:
-            return False
-        self._seen[key] = now + float(self.ttl_seconds)
-        return True
 
+def is_token_text(text: str) -> bool:
+    """True when ``text`` parses as a well-formed token (signature not checked)."""
+    if not text.startswith(TOKEN_PREFIXES):
+        return False
+    try:
+        parse_token(text)
+    except Exception:
+        return False
+    return True
 
-_global_nonce_store = NonceStore(ttl_seconds=int(os.getenv("POS_QR_NONCE_TTL_SECONDS", "900")))
 
+_UPSCALES = (1.5, 2.0, 3.0)
 
-def get_nonce_store() -> NonceStore:
-    return _global_nonce_store
+# Coarse-to-fine ("pyramid") localization for large photos: find the QR quad on a
+# downsampled copy, then decode only that region of the full-resolution image.
+PYRAMID_MAX_SIDE = int(os.getenv("POS_QR_PYRAMID_MAX_SIDE", "1024"))
+PYRAMID_MIN_CROP_SIDE = int(os.getenv("POS_QR_PYRAMID_MIN_CROP_SIDE", "400"))
+PYRAMID_PAD_RATIO = 0.2
+# The detector's finder-pattern search is sensitive to module size, so a quad
+# missed at one coarse level is often found at the next.
+PYRAMID_LEVELS = (1.0, 0.75, 0.5)
 
 
-def decode_qr_texts(image_bytes: bytes) -> list[str]:
-    if cv2 is None or np is None:
-        raise RuntimeError("qr_decoder_unavailable")
+def _pyramid_enabled() -> bool:
+    return (os.getenv("POS_QR_PYRAMID", "on") or "on").strip().lower() not in {"0", "off", "false", "disabled"}
 
-    img = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-    base = np.array(img)
-
-    detector = cv2.QRCodeDetector()
-
-    def _decode(arr) -> list[str]:
-        out: list[str] = []
-        if hasattr(detector, "detectAndDecodeMulti"):
-            ok, decoded_info, _, _ = detector.detectAndDecodeMulti(arr)  # type: ignore[assignment]
-            if ok and decoded_info:
-                for d in decoded_info:
-                    if isinstance(d, str) and d.strip():
-                        out.append(d.strip())
-        data, _, _ = detector.detectAndDecode(arr)
-        if isinstance(data, str) and data.strip():
-            out.append(data.strip())
-        # preserve order, drop duplicates
-        dedup: list[str] = []
-        seen: set[str] = set()
-        for t in out:
-            if t not in seen:
-                seen.add(t)
-                dedup.append(t)
-        return dedup
-
-    # Fast path: try the original RGB first.
-    try:
-        texts = _decode(base)
-        if texts:
-            return texts
-    except Exception:
-        pass
 
-    gray = None
-    try:
-        gray = cv2.cvtColor(base, cv2.COLOR_RGB2GRAY)
-        texts = _decode(gray)
-        if texts:
-            return texts
-    except Exception:
-        gray = None
+# First attempt on large JPEG uploads: decode at reduced scale, keeping the long
+# side at or above this many pixels.
+REDUCED_MIN_SIDE = int(os.getenv("POS_QR_REDUCED_MIN_SIDE", "1200"))
 
-    # Slow path: scale up + thresholding for tricky photos.
-    candidates: list = []
 
-    for scale in (1.5, 2.0, 3.0):
-        try:
-            w = int(base.shape[1] * scale)
-            h = int(base.shape[0] * scale)
-            candidates.append(cv2.resize(base, (w, h), interpolation=cv2.INTER_CUBIC))
-            if gray is not None:
-                candidates.append(cv2.resize(gray, (w, h), interpolation=cv2.INTER_CUBIC))
-        except Exception:
-            pass
+def _reduced_decode_enabled() -> bool:
+    return (os.getenv("POS_QR_REDUCED_DECODE", "on") or "on").strip().lower() not in {"0", "off", "false", "disabled"}
+
+
+# A region hint (fractions of the frame) is tried first, then widened this many
+# times before falling back to the whole frame.
+REGION_WIDEN_STEPS = 2
+
+_REGION_PRESETS = {
+    "top": lambda f: (0.0, 0.0, 1.0, f),
+    "bottom": lambda f: (0.0, 1.0 - f, 1.0, f),
+    "left": lambda f: (0.0, 0.0, f, 1.0),
+    "right": lambda f: (1.0 - f, 0.0, f, 1.0),
+}
 
-    if gray is not None:
+
+def parse_region_hint(text: str) -> Optional[Tuple[float, float, float, float]]:
+    """Parse a QR placement hint into ``(x, y, w, h)`` fractions of the frame.
+
+    Accepts ``"<top|bottom|left|right>:<fraction>"`` (e.g. ``"bottom:0.25"``)
+    or four comma-separated fractions ``"x,y,w,h"``. Returns None when the
+    hint is empty or malformed.
+    """
+    text = (text or "").strip().lower()
+    if not text:
+        return None
+    try:
+        if ":" in text:
+            side, _, frac = text.partition(":")
+            preset = _REGION_PRESETS.get(side.strip())
+            if preset is None:
+                return None
+            x, y, w, h = preset(float(frac))
+        else:
+            x, y, w, h = (float(p) for p in text.split(","))
+    except ValueError:
+        return None
+    if not (0.0 <= x < 1.0 and 0.0 <= y < 1.0 and 0.0 < w <= 1.0 and 0.0 < h <= 1.0):
+        return None
+    return x, y, min(w, 1.0 - x), min(h, 1.0 - y)
+
+
+def _widen_region(region: Tuple[float, float, float, float]) -> Iterator[Tuple[float, float, float, float]]:
+    """Yield ``region`` and then progressively larger boxes around it.
+
+    Each step doubles the width and height (clamped to the frame); the whole
+    frame itself is left to the regular cascade.
+    """
+    x, y, w, h = region
+    for _ in range(REGION_WIDEN_STEPS + 1):
+        if w >= 1.0 and h >= 1.0:
+            return
+        yield x, y, w, h
+        x0, y0 = max(0.0, x - w / 2), max(0.0, y - h / 2)
+        x1, y1 = min(1.0, x + w * 1.5), min(1.0, y + h * 1.5)
+        x, y, w, h = x0, y0, x1 - x0, y1 - y0
+
+
+def _crop_fraction(gray, region: Tuple[float, float, float, float]):
+    h, w = gray.shape[:2]
+    x, y, rw, rh = region
+    x0, y0 = int(x * w), int(y * h)
+    x1, y1 = max(x0 + 1, int(round((x + rw) * w))), max(y0 + 1, int(round((y + rh) * h)))
+    return gray[y0:y1, x0:x1]  # a view
+
+
+def _locate_regions(detectors: list, gray, max_side: int) -> list[Tuple[int, int, int, int]]:
+    """Detect QR quads on a downsampled copy of ``gray``.
+
+    Detectors are asked in order until one finds something. Returns padded
+    ``(x0, y0, x1, y1)`` boxes in full-resolution coordinates.
+    """
+    h, w = gray.shape[:2]
+    scale = float(max_side) / float(max(h, w))
+    small = cv2.resize(gray, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+
+    quads: list = []
+    for detector in detectors:
         try:
-            thr = cv2.adaptiveThreshold(
-                gray,
-                255,
-                cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-                cv2.THRESH_BINARY,
-                31,
-                2,
-            )
-            candidates.append(thr)
+            quads = detector.locate(small)
         except Exception:
-            pass
+            quads = []
+        if quads:
+            break
+
+    boxes: list[Tuple[int, int, int, int]] = []
+    for quad in quads:
+        q = quad / scale
+        x0, y0 = q.min(axis=0)
+        x1, y1 = q.max(axis=0)
+        pad = PYRAMID_PAD_RATIO * float(max(x1 - x0, y1 - y0))
+        box = (
+            max(0, int(x0 - pad)),
+            max(0, int(y0 - pad)),
+            min(w, int(x1 + pad) + 1),
+            min(h, int(y1 + pad) + 1),
+        )
+        if box[2] > box[0] and box[3] > box[1]:
+            boxes.append(box)
+    return boxes
+
+
+def _crop_for_decode(gray, box: Tuple[int, int, int, int], min_side: int, max_side: int):
+    """Cut ``box`` out of ``gray``, resized into ``[min_side, max_side]``."""
+    x0, y0, x1, y1 = box
+    crop = gray[y0:y1, x0:x1]  # a view: no copy of the full frame
+    side = max(crop.shape[:2])
+    if 0 < side < min_side:
+        scale = float(min_side) / float(side)
+        interpolation = cv2.INTER_CUBIC
+    elif side > max_side:
+        scale = float(max_side) / float(side)
+        interpolation = cv2.INTER_AREA
+    else:
+        return crop
+    size = (max(1, round(crop.shape[1] * scale)), max(1, round(crop.shape[0] * scale)))
+    return cv2.resize(crop, size, interpolation=interpolation)
+
+
+def _iter_candidates(
+    gray, detectors: Optional[list] = None, pyramid: bool = False, quick: bool = False
+) -> Iterator[Tuple[str, Any]]:
+    """Yield ``(stage, array)`` decode candidates in increasing cost order.
+
+    Candidates are built only when the caller asks for them, so an early exit
+    never pays for the upscales further down the cascade. With ``pyramid`` set
+    and a photo larger than ``PYRAMID_MAX_SIDE``, located QR regions are tried
+    first and whole-frame upscales are skipped. ``quick`` stops after the
+    plain gray frame.
+    """
+    h, w = gray.shape[:2]
+    large = pyramid and bool(detectors) and max(h, w) > PYRAMID_MAX_SIDE
+
+    if large:
+        tried: set[Tuple[int, int, int, int]] = set()
+        for level in PYRAMID_LEVELS:
+            side = int(PYRAMID_MAX_SIDE * level)
+            try:
+                boxes = _locate_regions(detectors, gray, side)
+            except Exception:
+                boxes = []
+            for i, box in enumerate(boxes):
+                if box in tried:
+                    continue
+                tried.add(box)
+                try:
+                    crop = _crop_for_decode(gray, box, PYRAMID_MIN_CROP_SIDE, PYRAMID_MAX_SIDE)
+                except Exception:
+                    continue
+                yield f"pyramid{side}" + (f"_{i}" if i else ""), crop
+                del crop
+
+    yield "gray", gray
+    if quick:
+        return
 
-    all_texts: list[str] = []
-    for arr in candidates:
+    try:
+        thr = cv2.adaptiveThreshold(
+            gray,
+            255,
+            cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+            cv2.THRESH_BINARY,
+            31,
+            2,
+        )
+    except Exception:
+        thr = None
+    if thr is not None:
+        yield "threshold", thr
+        del thr
+
+    if large:
+        # The located crops already got their own upscale; blowing up the whole
+        # photo would only multiply the cost by the frame size.
+        return
+
+    # Slow path: scale up for small or blurry codes.
+    for scale in _UPSCALES:
+        size = (int(w * scale), int(h * scale))
         try:
-            texts = _decode(arr)
+            up = cv2.resize(gray, size, interpolation=cv2.INTER_CUBIC)
         except Exception:
             continue
-        for t in texts:
-            if t not in all_texts:
-                all_texts.append(t)
+        yield f"gray_x{scale:g}", up
+        del up
+
+
+def _run_cascade(
+    result: QrDecodeResult,
+    candidates: Iterator[Tuple[str, Any]],
+    names: list[str],
+    detectors: list,
+    accept: Callable[[str], bool],
+    prefix: str = "",
+) -> bool:
+    """Feed ``candidates`` to the detectors; True once an accepted token is found."""
+    for candidate, arr in candidates:
+        for name, detector in zip(names, detectors):
+            stage = f"{prefix}{candidate}@{name}"
+            result.stages_tried.append(stage)
+            started = time.perf_counter()
+            try:
+                texts = detector.decode(arr)
+            except Exception:
+                texts = []
+            result.timings_ms[stage] = (time.perf_counter() - started) * 1000.0
+
+            for t in texts:
+                if t not in result.texts:
+                    result.texts.append(t)
+            if any(t.startswith(TOKEN_PREFIXES) and accept(t) for t in texts):
+                result.stage = stage
+                return True
+            if texts and result.stage is None:
+                result.stage = stage
+        del arr
+    return False
+
+
+def decode_qr(
+    image: ImageSource,
+    pyramid: Optional[bool] = None,
+    backends: Optional[list[str]] = None,
+    accept: Optional[Callable[[str], bool]] = None,
+    reduced: Optional[bool] = None,
+    region: Optional[Tuple[float, float, float, float]] = None,
+) -> QrDecodeResult:
+    """Run the decode cascade, stopping at the first stage that yields a token.
+
+    ``image`` is an encoded upload or an already decoded array (see
+    ``app.imaging``); the cascade itself only works on grayscale. Each
+    candidate image is offered to the detector ``backends`` in order
+    (default: ``POS_QR_DETECTOR_BACKENDS``); stages are reported as
+    ``"<candidate>@<backend>"``. Non-token texts (e.g. a marketing QR) are
+    collected but do not stop the cascade; they are returned when no stage
+    produces a token. ``pyramid`` defaults to the ``POS_QR_PYRAMID`` env toggle.
+
+    ``accept`` decides which token-prefixed text ends the cascade (default: any
+    well-formed token); pass ``token_passes_checks`` bound to the tenant
+    secrets to keep decoding past tokens that would fail verification.
+
+    For large encoded JPEGs (``reduced``, default ``POS_QR_REDUCED_DECODE``) the
+    first attempt decodes at 1/2-1/8 scale and runs only the cheap stages
+    (prefixed ``"reduced<N>/"``); the full-resolution decode happens only if
+    that finds no token.
+
+    ``region`` (see ``parse_region_hint``) restricts the first attempts to
+    where the tenant prints its QR, widening step by step (stages prefixed
+    ``"region<N>/"``) before the whole frame is scanned.
+    """
+    if accept is None:
+        accept = is_token_text
 
-    return all_texts
+    if cv2 is None or np is None:
+        raise RuntimeError("qr_decoder_unavailable")
 
+    names = backend_order() if backends is None else list(backends)
+    if not names:
+        raise RuntimeError("qr_decoder_unavailable")
+    detectors = [get_detector(n) for n in names]
+    result = QrDecodeResult(texts=[])
+    if pyramid is None:
+        pyramid = _pyramid_enabled()
+    if reduced is None:
+        reduced = _reduced_decode_enabled()
+
+    small = None
+    if reduced and not isinstance(image, np.ndarray):
+        small = decode_gray_reduced(image, REDUCED_MIN_SIDE)
+    gray = None
 
-def verify_token(
+    done = False
+    if region is not None:
+        # Search the hinted area first, on the cheapest frame we have.
+        if small is not None:
+            frame, label = small[0], f"reduced{small[1]}/"
+        else:
+            gray = as_gray(image)
+            frame, label = gray, ""
+        for step, box in enumerate(_widen_region(region)):
+            candidates = _iter_candidates(_crop_fraction(frame, box), detectors, pyramid=pyramid, quick=True)
+            if _run_cascade(result, candidates, names, detectors, accept, prefix=f"{label}region{step}/"):
+                done = True
+                break
+        del frame
+
+    if not done and small is not None:
+        candidates = _iter_candidates(small[0], detectors, pyramid=pyramid, quick=True)
+        done = _run_cascade(result, candidates, names, detectors, accept, prefix=f"reduced{small[1]}/")
+    small = None
+
+    if not done:
+        if gray is None:
+            gray = as_gray(image)
+        _run_cascade(result, _iter_candidates(gray, detectors, pyramid=pyramid), names, detectors, accept)
+
+    if result.stage is not None:
+        log.debug("qr decode stage=%s tried=%d", result.stage, len(result.stages_tried))
+    return result
+
+
+def decode_qr_texts(image: ImageSource) -> list[str]:
+    return decode_qr(image).texts
+
+
+def _tenant_mac(tenant_secrets: TenantSecrets, tenant_id: str, kid: str) -> Tuple[Optional["hmac.HMAC"], str]:
+    if isinstance(tenant_secrets, TenantKeyRegistry):
+        return tenant_secrets.mac_for(tenant_id, kid)
+    ring = parse_keyring(tenant_secrets.get(tenant_id))
+    if ring is None:
+        return None, "unknown_tenant"
+    return ring.mac_for(kid)
+
+
+def tenant_max_age(max_age_seconds: MaxAge, tenant_id: str) -> int:
+    if isinstance(max_age_seconds, int):
+        return max_age_seconds
+    return max_age_seconds.get(tenant_id, max_age_seconds["*"])
+
+
+def check_token(
     token: str,
-    tenant_secrets: Dict[str, str],
-    nonce_store: NonceStore,
-    max_age_seconds: int,
+    tenant_secrets: TenantSecrets,
+    max_age_seconds: MaxAge,
     max_future_skew_seconds: int,
 ) -> Tuple[bool, str, Optional[Dict[str, Any]]]:
+    """Stateless part of ``verify_token``: format, signature and time window.
+
+    Does not touch the nonce store, so it is safe to call speculatively (e.g.
+    inside the decode cascade on an image worker).
+    """
+    # The MAC covers the exact payload bytes as signed, so it is checked before
+    # (and independently of) JSON parsing: forged or oversized tokens never
+    # reach the parser, and signer whitespace/key order does not matter.
+    compact = token.lstrip().startswith(compact_token.PREFIX)
     try:
-        payload, sig = parse_token(token)
+        payload_json, sig = split_token(token)
     except ValueError as e:
         return False, str(e), None
+    if not compact and len(sig) != SIG_BYTES:
+        return False, "bad_signature", None
 
-    tenant_id = str(payload.get("tenant_id") or "")
-    nonce = str(payload.get("nonce") or "")
-    ts = payload.get("timestamp")
+    tenant_id, kid = compact_token.peek_ids(payload_json) if compact else _peek_ids(payload_json)
+    if not tenant_id:
+        return False, "missing_required_fields", None
 
-    if not tenant_id or not nonce or not isinstance(ts, int):
-        return False, "missing_required_fields", payload
+    # The token names its key, so exactly one HMAC is computed even while a
+    # tenant has several keys during rotation.
+    mac, reason = _tenant_mac(tenant_secrets, tenant_id, kid)
+    if mac is None:
+        return False, reason, None
 
-    secret = tenant_secrets.get(tenant_id)
-    if not secret:
-        return False, "unknown_tenant", payload
+    mac.update(payload_json)
+    # TSQR2 may carry a truncated MAC; its length is itself signed.
+    if not hmac.compare_digest(mac.digest()[: len(sig)], sig):
+        return False, "bad_signature", None
 
-    payload_json = json.dumps(payload, separators=(",", ":"), sort_keys=True).encode("utf-8")
-    expected = hmac.new(secret.encode("utf-8"), payload_json, hashlib.sha256).digest()
-    if not hmac.compare_digest(expected, sig):
-        return False, "bad_signature", payload
+    try:
+        payload = compact_token.unpack(payload_json) if compact else json.loads(payload_json)
+    except ValueError:
+        return False, "invalid_payload", None
+    if not isinstance(payload, dict):
+        return False, "invalid_payload", None
+    if payload.get("tenant_id") != tenant_id:
+        # e.g. a duplicated key: the parsed document must name the tenant
+        # whose key signed it.
+        return False, "tenant_mismatch", None
+    if (payload.get("kid") or "") != kid:
+        return False, "key_mismatch", None
+
+    nonce = str(payload.get("nonce") or "")
+    ts = payload.get("timestamp")
+    if not nonce or not isinstance(ts, int):
+        return False, "missing_required_fields", payload
 
     now = int(time.time())
     if ts > now + max_future_skew_seconds:
         return False, "timestamp_in_future", payload
-    if now - ts > max_age_seconds:
+    if now - ts > tenant_max_age(max_age_seconds, tenant_id):
         return False, "expired", payload
 
-    if not nonce_store.check_and_mark(tenant_id, nonce):
-        return False, "replay", payload
-
     return True, "ok", payload
+
+
+def token_passes_checks(
+    text: str,
+    tenant_secrets: TenantSecrets,
+    max_age_seconds: MaxAge,
+    max_future_skew_seconds: int,
+) -> bool:
+    """``decode_qr(accept=...)`` predicate; bind the settings with functools.partial."""
+    return check_token(text, tenant_secrets, max_age_seconds, max_future_skew_seconds)[0]
+
+
+def verify_token(
+    token: str,
+    tenant_secrets: TenantSecrets,
+    nonce_store: NonceBackend,
+    max_age_seconds: MaxAge,
+    max_future_skew_seconds: int,
+) -> Tuple[bool, str, Optional[Dict[str, Any]]]:
+    valid, reason, payload = check_token(token, tenant_secrets, max_age_seconds, max_future_skew_seconds)
+    if not valid:
+        return valid, reason, payload
+
+    reason = nonce_store.mark_many([(str(payload["tenant_id"]), str(payload["nonce"]))])[0]  # type: ignore[index]
+    return reason == "ok", reason, payload
+
+
+def verify_tokens(
+    tokens: Sequence[str],
+    tenant_secrets: TenantSecrets,
+    nonce_store: NonceBackend,
+    max_age_seconds: MaxAge,
+    max_future_skew_seconds: int,
+) -> list[Tuple[bool, str, Optional[Dict[str, Any]]]]:
+    """``verify_token`` for many tokens, marking all fresh nonces in one store call.
+
+    Shared backends pipeline that call into a single round trip. Results
+    are in input order; a nonce repeated within ``tokens`` verifies once.
+    """
+    results = [check_token(t, tenant_secrets, max_age_seconds, max_future_skew_seconds) for t in tokens]
+    passed = [i for i, (valid, _, _) in enumerate(results) if valid]
+    if passed:
+        pairs = [(str(results[i][2]["tenant_id"]), str(results[i][2]["nonce"])) for i in passed]  # type: ignore[index]
+        for i, reason in zip(passed, nonce_store.mark_many(pairs)):
+            results[i] = (reason == "ok", reason, results[i][2])
+    return results
+
+
+@dataclass
+class CandidateVerification:
+    valid: bool
+    reason: str
+    payload: Optional[Dict[str, Any]]
+    token: Optional[str]
+    candidate_index: Optional[int]
+    candidates_tried: int
+
+
+def verify_token_candidates(
+    candidates: Sequence[str],
+    tenant_secrets: TenantSecrets,
+    nonce_store: NonceBackend,
+    max_age_seconds: MaxAge,
+    max_future_skew_seconds: int,
+) -> CandidateVerification:
+    """Verify candidates in order and stop at the first valid one.
+
+    Only the winner's nonce is marked. When none is valid, the first
+    candidate's failure is reported.
+    """
+    first: Optional[CandidateVerification] = None
+    for i, token in enumerate(candidates):
+        valid, reason, payload = verify_token(
+            token=token,
+            tenant_secrets=tenant_secrets,
+            nonce_store=nonce_store,
+            max_age_seconds=max_age_seconds,
+            max_future_skew_seconds=max_future_skew_seconds,
+        )
+        outcome = CandidateVerification(valid, reason, payload, token, i, i + 1)
+        if valid:
+            return outcome
+        if first is None:
+            first = outcome
+    if first is None:
+        return CandidateVerification(False, "no_candidates", None, None, None, 0)
+    first.candidates_tried = len(candidates)
+    return first
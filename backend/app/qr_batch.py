@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import zipfile
+from dataclasses import dataclass
+from typing import AsyncIterator, Optional
+
+from starlette.datastructures import FormData, UploadFile
+from starlette.formparsers import MultiPartParser
+from starlette.requests import Request
+
+
+BATCH_IMAGE_SUFFIXES = {".png", ".jpg", ".jpeg", ".webp", ".bmp", ".gif"}
+ARCHIVE_CONTENT_TYPES = {"application/zip", "application/x-zip-compressed"}
+
+
+@dataclass
+class BatchItem:
+    """One image of a batch upload; ``error`` is set when it cannot be decoded."""
+
+    filename: str
+    data: Optional[bytes] = None
+    error: Optional[str] = None
+
+
+def _is_archive(upload: UploadFile) -> bool:
+    content_type = (upload.content_type or "").lower()
+    return content_type in ARCHIVE_CONTENT_TYPES or (upload.filename or "").lower().endswith(".zip")
+
+
+class _DiskMultiPartParser(MultiPartParser):
+    # Starlette keeps each file part in memory up to ``max_file_size``, so a
+    # batch of a thousand 1 MB images would sit in RAM before the first result
+    # goes out. Rolling every part over to its temp file on the first write
+    # keeps the parse itself at a constant footprint.
+    max_file_size = 1
+
+
+async def parse_batch_form(request: Request, max_files: int) -> FormData:
+    """Parse a multipart batch upload with every file part spooled to disk.
+
+    Raises ``starlette.formparsers.MultiPartException`` on a malformed body.
+    Anything other than ``multipart/form-data`` yields an empty form.
+    """
+    content_type = request.headers.get("content-type", "").lower()
+    if not content_type.startswith("multipart/form-data"):
+        return FormData()
+    parser = _DiskMultiPartParser(request.headers, request.stream(), max_files=max_files)
+    return await parser.parse()
+
+
+async def _iter_archive(upload: UploadFile, max_bytes: int) -> AsyncIterator[BatchItem]:
+    # Members are read one at a time, straight from the spooled upload, so
+    # only the images currently in flight are held in memory. Opening the
+    # archive and inflating members is blocking file I/O: both run in a
+    # thread, off the event loop.
+    name = upload.filename or "archive.zip"
+    try:
+        archive = await asyncio.to_thread(zipfile.ZipFile, upload.file)
+    except (zipfile.BadZipFile, OSError):
+        yield BatchItem(filename=name, error="invalid_archive")
+        return
+    with archive:
+        for info in archive.infolist():
+            if info.is_dir() or os.path.splitext(info.filename)[1].lower() not in BATCH_IMAGE_SUFFIXES:
+                continue
+            member = f"{name}/{info.filename}"
+            # Checked against the declared size before inflating anything.
+            if info.file_size > max_bytes:
+                yield BatchItem(filename=member, error="file_too_large")
+                continue
+            try:
+                data = await asyncio.to_thread(archive.read, info)
+            except (zipfile.BadZipFile, OSError, RuntimeError, NotImplementedError):
+                yield BatchItem(filename=member, error="invalid_archive_member")
+                continue
+            yield BatchItem(filename=member, data=data)
+
+
+async def iter_batch_items(uploads: list[UploadFile], max_bytes: int) -> AsyncIterator[BatchItem]:
+    """Yield the images of a batch upload (plain images and ``.zip`` archives) lazily."""
+    for upload in uploads:
+        name = upload.filename or "upload"
+        if _is_archive(upload):
+            async for item in _iter_archive(upload, max_bytes):
+                yield item
+            continue
+
+        content_type = (upload.content_type or "").lower()
+        if not (content_type.startswith("image/") or content_type in {"application/octet-stream"}):
+            yield BatchItem(filename=name, error="unsupported_content_type")
+            continue
+        data = await upload.read(max_bytes + 1)
+        if len(data) > max_bytes:
+            yield BatchItem(filename=name, error="file_too_large")
+            continue
+        yield BatchItem(filename=name, data=data)
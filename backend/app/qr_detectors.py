@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import os
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional
+
+try:
+    import cv2  # type: ignore
+    import numpy as np  # type: ignore
+except Exception:  # pragma: no cover
+    cv2 = None
+    np = None
+
+
+# Picked by tools/bench_qr_backends.py on backend/fixtures: ArUco decodes the whole
+# corpus and is faster per stage; classic stays as a second opinion.
+DEFAULT_BACKEND_ORDER = "aruco,classic"
+
+
+def _dedup(texts: list[str]) -> list[str]:
+    # preserve order, drop duplicates
+    out: list[str] = []
+    seen: set[str] = set()
+    for t in texts:
+        if t not in seen:
+            seen.add(t)
+            out.append(t)
+    return out
+
+
+class OpenCvDetector:
+    """Adapter over cv2's GraphicalCodeDetector family (classic and ArUco-based)."""
+
+    def __init__(self, detector: Any):
+        self._detector = detector
+
+    def decode(self, arr) -> list[str]:
+        out: list[str] = []
+        detector = self._detector
+        if hasattr(detector, "detectAndDecodeMulti"):
+            ok, decoded_info, _, _ = detector.detectAndDecodeMulti(arr)
+            if ok and decoded_info:
+                for d in decoded_info:
+                    if isinstance(d, str) and d.strip():
+                        out.append(d.strip())
+        data, _, _ = detector.detectAndDecode(arr)
+        if isinstance(data, str) and data.strip():
+            out.append(data.strip())
+        return _dedup(out)
+
+    def locate(self, arr) -> list:
+        """Return the QR quads found in ``arr`` as ``(4, 2)`` float arrays."""
+        quads: list = []
+        detector = self._detector
+        if hasattr(detector, "detectMulti"):
+            ok, pts = detector.detectMulti(arr)
+            if ok and pts is not None:
+                quads.extend(np.asarray(p, dtype=np.float32).reshape(-1, 2) for p in pts)
+        if not quads:
+            ok, pts = detector.detect(arr)
+            if ok and pts is not None:
+                quads.append(np.asarray(pts, dtype=np.float32).reshape(-1, 2))
+        return quads
+
+
+class WeChatDetector:
+    """Adapter over ``cv2.wechat_qrcode`` (opencv-contrib builds only).
+
+    Set ``POS_QR_WECHAT_MODEL_DIR`` to a directory holding the CNN detector and
+    super-resolution models; without it the contrib detector uses its
+    traditional (model-free) pipeline.
+    """
+
+    _MODEL_FILES = ("detect.prototxt", "detect.caffemodel", "sr.prototxt", "sr.caffemodel")
+
+    def __init__(self) -> None:
+        model_dir = (os.getenv("POS_QR_WECHAT_MODEL_DIR") or "").strip()
+        if model_dir:
+            paths = [os.path.join(model_dir, f) for f in self._MODEL_FILES]
+            self._detector = cv2.wechat_qrcode_WeChatQRCode(*paths)
+        else:
+            self._detector = cv2.wechat_qrcode_WeChatQRCode()
+
+    def decode(self, arr) -> list[str]:
+        res, _ = self._detector.detectAndDecode(arr)
+        return _dedup([t.strip() for t in (res or ()) if isinstance(t, str) and t.strip()])
+
+    def locate(self, arr) -> list:
+        _, points = self._detector.detectAndDecode(arr)
+        return [np.asarray(p, dtype=np.float32).reshape(-1, 2) for p in (points or ())]
+
+
+@dataclass(frozen=True)
+class DetectorBackend:
+    name: str
+    factory: Callable[[], Any]
+    available: Callable[[], bool]
+
+
+_BACKENDS: Dict[str, DetectorBackend] = {}
+_local = threading.local()
+
+
+def register_backend(name: str, factory: Callable[[], Any], available: Optional[Callable[[], bool]] = None) -> None:
+    """Register a detector backend.
+
+    ``factory`` returns an object with ``decode(arr) -> list[str]`` and
+    ``locate(arr) -> list[quad]``; it is called at most once per thread.
+    """
+    _BACKENDS[name] = DetectorBackend(name=name, factory=factory, available=available or (lambda: True))
+
+
+def available_backends() -> list[str]:
+    out: list[str] = []
+    for name, backend in _BACKENDS.items():
+        try:
+            if backend.available():
+                out.append(name)
+        except Exception:
+            continue
+    return out
+
+
+def backend_order(raw: Optional[str] = None) -> list[str]:
+    """Backends to try, in order, from ``POS_QR_DETECTOR_BACKENDS``.
+
+    Unknown or unavailable names are skipped; an empty result falls back to
+    every available backend.
+    """
+    if raw is None:
+        raw = os.getenv("POS_QR_DETECTOR_BACKENDS", DEFAULT_BACKEND_ORDER)
+    available = available_backends()
+    order = [n.strip() for n in (raw or "").split(",") if n.strip() in available]
+    return _dedup(order) or available
+
+
+def get_detector(name: str) -> Any:
+    """Return this thread's (or worker process's) detector for ``name``.
+
+    Detector objects are not thread-safe, so each thread keeps its own and
+    reuses it across calls instead of rebuilding it per image.
+    """
+    cache: Optional[Dict[str, Any]] = getattr(_local, "detectors", None)
+    if cache is None:
+        cache = _local.detectors = {}
+    detector = cache.get(name)
+    if detector is None:
+        backend = _BACKENDS.get(name)
+        if backend is None:
+            raise KeyError(f"unknown_qr_backend:{name}")
+        detector = cache[name] = backend.factory()
+    return detector
+
+
+def _cv2_has(attr: str) -> Callable[[], bool]:
+    return lambda: cv2 is not None and hasattr(cv2, attr)
+
+
+register_backend("classic", lambda: OpenCvDetector(cv2.QRCodeDetector()), _cv2_has("QRCodeDetector"))
+register_backend("aruco", lambda: OpenCvDetector(cv2.QRCodeDetectorAruco()), _cv2_has("QRCodeDetectorAruco"))
+register_backend("wechat", WeChatDetector, _cv2_has("wechat_qrcode_WeChatQRCode"))
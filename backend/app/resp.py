@@ -0,0 +1,189 @@
+"""Minimal RESP2 (Redis protocol) client: a connection pool with pipelining.
+
+Only what the nonce backend needs: send a batch of commands on one pooled
+connection in a single write, then read the replies in order. Works with
+Redis, Valkey, KeyDB, Dragonfly and other servers speaking RESP2.
+"""
+from __future__ import annotations
+
+import queue
+import socket
+import threading
+from typing import Any, List, Optional, Sequence
+from urllib.parse import unquote, urlparse
+
+
+class RespError(Exception):
+    """An error reply from the server (``-ERR ...``); returned in pipelines, raised by ``execute``."""
+
+
+def encode_command(args: Sequence[Any]) -> bytes:
+    out = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        raw = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+        out.append(b"$%d\r\n%s\r\n" % (len(raw), raw))
+    return b"".join(out)
+
+
+class RespConnection:
+    def __init__(self, host: str, port: int, timeout: float):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._reader = self.sock.makefile("rb")
+
+    def _line(self) -> bytes:
+        line = self._reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("resp_connection_closed")
+        return line[:-2]
+
+    def read_reply(self) -> Any:
+        line = self._line()
+        kind, rest = line[:1], line[1:]
+        if kind == b"+":
+            return rest.decode("utf-8", "replace")
+        if kind == b"-":
+            return RespError(rest.decode("utf-8", "replace"))
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            n = int(rest)
+            if n < 0:
+                return None
+            data = self._reader.read(n + 2)
+            if len(data) != n + 2:
+                raise ConnectionError("resp_connection_closed")
+            return data[:-2]
+        if kind == b"*":
+            n = int(rest)
+            return None if n < 0 else [self.read_reply() for _ in range(n)]
+        raise ConnectionError(f"resp_protocol_error:{line[:20]!r}")
+
+    def close(self) -> None:
+        try:
+            self._reader.close()
+        finally:
+            self.sock.close()
+
+
+class RespPool:
+    """Thread-safe pool of up to ``max_connections`` connections to one server.
+
+    A connection that fails mid-command is discarded, never returned to the
+    pool, so a half-read reply cannot leak into the next caller's pipeline.
+    An idle connection the server has since dropped (idle timeout, restart)
+    fails before any reply is read; the pipeline is then retried once on a
+    fresh connection, so a stale pool does not look like an outage.
+    """
+
+    def __init__(
+        self,
+        host: str = "localhost",
+        port: int = 6379,
+        db: int = 0,
+        password: Optional[str] = None,
+        username: Optional[str] = None,
+        timeout: float = 0.25,
+        max_connections: int = 8,
+    ):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.username = username
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self._idle: "queue.LifoQueue[RespConnection]" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self.connects = 0
+        self.stale_retries = 0
+
+    @classmethod
+    def from_url(cls, url: str, timeout: float = 0.25, max_connections: int = 8) -> "RespPool":
+        """``redis://[[user]:password@]host[:port][/db]``."""
+        parts = urlparse(url)
+        if parts.scheme not in ("redis", ""):
+            raise ValueError(f"unsupported resp url scheme: {parts.scheme}")
+        db = (parts.path or "/").lstrip("/")
+        return cls(
+            host=parts.hostname or "localhost",
+            port=parts.port or 6379,
+            db=int(db) if db else 0,
+            password=unquote(parts.password) if parts.password else None,
+            username=unquote(parts.username) if parts.username else None,
+            timeout=timeout,
+            max_connections=max_connections,
+        )
+
+    @property
+    def address(self) -> str:
+        return f"{self.host}:{self.port}/{self.db}"
+
+    def _connect(self) -> RespConnection:
+        conn = RespConnection(self.host, self.port, self.timeout)
+        setup: List[List[Any]] = []
+        if self.password:
+            setup.append(["AUTH", self.username, self.password] if self.username else ["AUTH", self.password])
+        if self.db:
+            setup.append(["SELECT", self.db])
+        try:
+            if setup:
+                conn.sock.sendall(b"".join(encode_command(c) for c in setup))
+                for _ in setup:
+                    reply = conn.read_reply()
+                    if isinstance(reply, RespError):
+                        raise ConnectionError(f"resp_setup_failed:{reply}")
+        except BaseException:
+            conn.close()
+            raise
+        self.connects += 1
+        return conn
+
+    def pipeline(self, commands: Sequence[Sequence[Any]]) -> List[Any]:
+        """Send ``commands`` in one write and return their replies in order.
+
+        Error replies come back as ``RespError`` values; network failures
+        raise ``OSError`` (``ConnectionError``, ``socket.timeout``).
+        """
+        if not commands:
+            return []
+        if not self._slots.acquire(timeout=self.timeout):
+            raise ConnectionError("resp_pool_exhausted")
+        try:
+            try:
+                conn, reused = self._idle.get_nowait(), True
+            except queue.Empty:
+                conn, reused = self._connect(), False
+            while True:
+                replies: List[Any] = []
+                try:
+                    conn.sock.sendall(b"".join(encode_command(c) for c in commands))
+                    for _ in commands:
+                        replies.append(conn.read_reply())
+                except BaseException as e:
+                    conn.close()
+                    stale = reused and not replies and isinstance(e, OSError) and not isinstance(e, socket.timeout)
+                    if not stale:
+                        raise
+                    # Its idle siblings are most likely just as dead.
+                    self.close()
+                    self.stale_retries += 1
+                    conn, reused = self._connect(), False
+                    continue
+                self._idle.put(conn)
+                return replies
+        finally:
+            self._slots.release()
+
+    def execute(self, *args: Any) -> Any:
+        reply = self.pipeline([args])[0]
+        if isinstance(reply, RespError):
+            raise reply
+        return reply
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
@@ -0,0 +1,261 @@
+from __future__ import annotations
+
+import hashlib
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from .config import parse_tenant_secrets
+
+log = logging.getLogger("tapsure.tenant_keys")
+
+# Key id of a tenant configured with a single plain secret.
+LEGACY_KID = ""
+
+
+def _prepare_key(secret: str) -> "hmac.HMAC":
+    # Keyed HMAC state (inner/outer pads already absorbed); verification
+    # copies it instead of re-deriving the key schedule per token.
+    return hmac.new(secret.encode("utf-8"), digestmod=hashlib.sha256)
+
+
+@dataclass(frozen=True)
+class Keyring:
+    """One tenant's signing keys, by key id (``kid``).
+
+    ``active`` is the key new tokens are minted under; ``default`` verifies
+    tokens that carry no ``kid`` (everything printed before rotation started).
+    A key listed in ``retire_after`` stops verifying after that unix time.
+    """
+
+    keys: Dict[str, "hmac.HMAC"]
+    active: str
+    default: str
+    retire_after: Dict[str, int]
+
+    def mac_for(self, kid: Optional[str] = None, now: Optional[float] = None) -> Tuple[Optional["hmac.HMAC"], str]:
+        """``(fresh HMAC, "ok")`` for ``kid``, or ``(None, reason)``."""
+        kid = kid or self.default
+        prepared = self.keys.get(kid)
+        if prepared is None:
+            return None, "unknown_key"
+        deadline = self.retire_after.get(kid)
+        if deadline is not None and (time.time() if now is None else now) > deadline:
+            return None, "key_retired"
+        return prepared.copy(), "ok"
+
+
+def parse_keyring(entry: Any) -> Optional[Keyring]:
+    """Build a ``Keyring`` from one tenant's config entry; None when invalid.
+
+    Accepted forms::
+
+      "secret"
+      {"active": "k2", "keys": {"k1": "old", "k2": "new"},
+       "default": "k1", "retire_after": {"k1": 1767225600}}
+
+    ``active`` may be omitted when there is one key; ``default`` falls back
+    to ``active``.
+    """
+    if isinstance(entry, str):
+        return Keyring({LEGACY_KID: _prepare_key(entry)}, LEGACY_KID, LEGACY_KID, {}) if entry else None
+    if not isinstance(entry, dict):
+        return None
+    raw_keys = entry.get("keys")
+    if not isinstance(raw_keys, dict):
+        return None
+    secrets = {k: v for k, v in raw_keys.items() if isinstance(k, str) and isinstance(v, str) and k and v}
+    if not secrets:
+        return None
+    active = entry.get("active") or (next(iter(secrets)) if len(secrets) == 1 else None)
+    default = entry.get("default") or active
+    if active not in secrets or default not in secrets:
+        return None
+    retire = entry.get("retire_after") or {}
+    if not isinstance(retire, dict):
+        return None
+    retire_after = {k: int(v) for k, v in retire.items() if k in secrets and isinstance(v, (int, float))}
+    return Keyring({kid: _prepare_key(s) for kid, s in secrets.items()}, active, default, retire_after)
+
+
+def signing_key(entry: Any, kid: Optional[str] = None) -> Tuple[str, str]:
+    """``(kid, secret)`` to mint a token with, from a raw keyring entry (tools).
+
+    Defaults to the active key; ``kid`` picks another one. A plain-secret
+    entry has the single key id ``""`` (tokens then carry no ``kid``).
+    """
+    if isinstance(entry, str) and entry:
+        if kid:
+            raise ValueError("unknown_key")
+        return LEGACY_KID, entry
+    ring = parse_keyring(entry)
+    if ring is None:
+        raise ValueError("invalid_keyring")
+    kid = kid or ring.active
+    secret = entry["keys"].get(kid)
+    if not isinstance(secret, str) or not secret:
+        raise ValueError("unknown_key")
+    return kid, secret
+
+
+def _prepare(secrets: Dict[str, Any]) -> Dict[str, Keyring]:
+    out: Dict[str, Keyring] = {}
+    for tenant, entry in secrets.items():
+        ring = parse_keyring(entry)
+        if ring is None:
+            log.warning("tenant keys: ignoring invalid keyring tenant=%s", tenant)
+            continue
+        out[tenant] = ring
+    return out
+
+
+class TenantKeyRegistry:
+    """Tenant id -> prepared HMAC state for POS QR token verification.
+
+    Keys come from a JSON file (``{"tenant": <keyring>, ...}``, see
+    ``parse_keyring``; ``path`` or
+    the file named by the ``path_var`` env var) that is reloaded when its mtime/size/inode
+    changes, checked at most every ``check_interval`` seconds. Without a
+    file (or while it is missing) the ``POS_TENANT_SECRETS`` env var is used,
+    re-parsed only when its value changes. A reload builds a complete new
+    table and swaps it in one assignment, so readers never see a partial
+    one; a file that fails to parse keeps the previous table.
+
+    Pickling carries only the configuration (not the keys), so a registry
+    bound into a job for a process worker reloads from the same source there.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        env_var: str = "POS_TENANT_SECRETS",
+        secrets: Optional[Dict[str, Any]] = None,
+        check_interval: float = 1.0,
+        path_var: Optional[str] = None,
+    ):
+        self.path = path or None
+        self.path_var = path_var
+        self.env_var = env_var
+        self.check_interval = check_interval
+        self._static = dict(secrets) if secrets is not None else None
+        self._lock = threading.Lock()
+        self._keys: Dict[str, Keyring] = _prepare(self._static) if self._static is not None else {}
+        self._stamp: Any = None
+        self._checked_at = float("-inf")
+        self.reloads = 0
+
+    @classmethod
+    def from_env(cls) -> "TenantKeyRegistry":
+        # The path is read on each check (not here) so .env files loaded
+        # after import still apply.
+        return cls(
+            path_var="POS_TENANT_KEYS_FILE",
+            check_interval=float(os.getenv("POS_TENANT_KEYS_CHECK_SECONDS", "1")),
+        )
+
+    @classmethod
+    def from_secrets(cls, secrets: Dict[str, Any]) -> "TenantKeyRegistry":
+        """A fixed registry (tools and tests); never reloads."""
+        return cls(secrets=secrets)
+
+    def __reduce__(self):
+        if self is _global_tenant_keys:
+            # The receiving process uses its own global registry.
+            return (get_tenant_keys, ())
+        return (type(self), (self.path, self.env_var, self._static, self.check_interval, self.path_var))
+
+    def _current_path(self) -> Optional[str]:
+        if self.path or not self.path_var:
+            return self.path
+        return (os.getenv(self.path_var) or "").strip() or None
+
+    @staticmethod
+    def _file_stamp(path: str) -> Optional[tuple]:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return ("file", path, st.st_mtime_ns, st.st_size, st.st_ino)
+
+    @staticmethod
+    def _load_file(path: str) -> Dict[str, Any]:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if not isinstance(data, dict):
+            raise ValueError("tenant_keys_file_not_an_object")
+        return {k: v for k, v in data.items() if isinstance(k, str) and isinstance(v, (str, dict)) and k and v}
+
+    def _refresh(self) -> None:
+        if self._static is not None:
+            return
+
+        stamp: Any = None
+        path = self._current_path()
+        if path:
+            now = time.monotonic()
+            if now - self._checked_at < self.check_interval:
+                return
+            self._checked_at = now
+            stamp = self._file_stamp(path)
+        if stamp is None:
+            # No file configured (or it is missing): fall back to the env var.
+            stamp = ("env", os.getenv(self.env_var, ""))
+        if stamp == self._stamp:
+            return
+
+        with self._lock:
+            if stamp == self._stamp:
+                return
+            if stamp[0] == "file":
+                try:
+                    secrets = self._load_file(path)  # type: ignore[arg-type]
+                except (OSError, ValueError) as e:
+                    log.warning("tenant keys reload failed path=%s error=%s; keeping %d tenants", path, e, len(self._keys))
+                    self._stamp = stamp
+                    return
+            else:
+                secrets = parse_tenant_secrets(stamp[1])
+            self._keys = _prepare(secrets)
+            self._stamp = stamp
+            self.reloads += 1
+            log.info("tenant keys loaded source=%s tenants=%d", stamp[0], len(secrets))
+
+    def mac_for(self, tenant_id: str, kid: Optional[str] = None) -> Tuple[Optional["hmac.HMAC"], str]:
+        """A fresh HMAC for ``tenant_id``'s key ``kid`` (a copy of the prepared state).
+
+        Returns ``(mac, "ok")`` or ``(None, reason)`` with reason
+        ``unknown_tenant``, ``unknown_key`` or ``key_retired``.
+        """
+        self._refresh()
+        ring = self._keys.get(tenant_id)
+        if ring is None:
+            return None, "unknown_tenant"
+        return ring.mac_for(kid)
+
+    def keyring(self, tenant_id: str) -> Optional[Keyring]:
+        self._refresh()
+        return self._keys.get(tenant_id)
+
+    def __contains__(self, tenant_id: object) -> bool:
+        self._refresh()
+        return tenant_id in self._keys
+
+    def __len__(self) -> int:
+        self._refresh()
+        return len(self._keys)
+
+    def __iter__(self) -> Iterator[str]:
+        self._refresh()
+        return iter(list(self._keys))
+
+
+_global_tenant_keys = TenantKeyRegistry.from_env()
+
+
+def get_tenant_keys() -> TenantKeyRegistry:
+    return _global_tenant_keys
@@ -0,0 +1,71 @@
+import json
+import time
+from io import BytesIO
+
+import pytest
+import qrcode
+from fastapi.testclient import TestClient
+
+from app.decode_cache import ENTRY_OVERHEAD_BYTES, DecodeCache, get_decode_cache
+from app.main import app
+from app.pos_qr import build_token
+
+
+@pytest.fixture()
+def client(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv("POS_TENANT_SECRETS", json.dumps({"demo": "dev-secret"}))
+    monkeypatch.setenv("POS_QR_MAX_AGE_SECONDS", "3600")
+    monkeypatch.setenv("POS_QR_NONCE_TTL_SECONDS", "3600")
+    return TestClient(app)
+
+
+def _make_qr_png_bytes(text: str) -> bytes:
+    img = qrcode.make(text)
+    buf = BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def test_lru_ttl_and_byte_budget():
+    cache = DecodeCache(max_entries=2, max_bytes=3 * (ENTRY_OVERHEAD_BYTES + 10), ttl_seconds=10)
+    cache.put("a", "qr", ["a"], size=10, now=0)
+    cache.put("b", "qr", ["b"], size=10, now=0)
+    assert cache.get("a", "qr", now=1) == ["a"]  # "a" is now most recent
+    cache.put("c", "qr", ["c"], size=10, now=1)
+    assert cache.get("b", "qr", now=1) is None  # least recently used went first
+    assert cache.get("a", "qr", now=11) is None  # expired
+
+    # Entries larger than the whole budget are never stored.
+    cache.put("big", "ocr", "x" * 10_000, size=10_000, now=1)
+    assert cache.get("big", "ocr", now=1) is None
+
+    stats = cache.stats()
+    assert stats["evictions"] == 1 and stats["expirations"] == 1
+    assert stats["hits"] == 1 and stats["misses"] == 3
+
+
+def test_disabled_cache_stores_nothing():
+    cache = DecodeCache(max_entries=0)
+    cache.put("a", "qr", ["a"], size=1)
+    assert cache.get("a", "qr") is None
+    assert cache.stats()["misses"] == 0
+
+
+def test_repeat_upload_hits_cache_but_still_checks_replay(client: TestClient):
+    payload = {
+        "tenant_id": "demo",
+        "transaction_id": "tx_cache",
+        "timestamp": int(time.time()),
+        "nonce": "nonce_cache",
+    }
+    png = _make_qr_png_bytes(build_token(payload, secret="dev-secret"))
+    before = get_decode_cache().stats()["hits"]
+
+    r1 = client.post("/api/pos/qr/verify", files={"receipt": ("qr.png", png, "image/png")})
+    assert r1.status_code == 200 and r1.json()["valid"] is True
+
+    r2 = client.post("/api/pos/qr/verify", files={"receipt": ("qr.png", png, "image/png")})
+    assert r2.status_code == 409 and r2.json()["reason"] == "replay"
+
+    metrics = client.get("/api/metrics").json()
+    assert metrics["decode_cache"]["hits"] == before + 1
@@ -0,0 +1,217 @@
+import asyncio
+import json
+import time
+import uuid
+from io import BytesIO
+
+import pytest
+import qrcode
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from app import main, pos_qr
+from app.models import Item, ReceiptData
+from app.ocr_pool import OcrPoolBusy
+from app.orchestrator import Orchestrator
+from app.pos_qr import build_token
+
+
+def _blank_png() -> bytes:
+    buf = BytesIO()
+    Image.new("RGB", (64, 64), color="white").save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def _payload(**extra) -> dict:
+    return {
+        "tenant_id": "demo",
+        "transaction_id": f"tx_{uuid.uuid4().hex[:8]}",
+        "timestamp": int(time.time()),
+        "nonce": uuid.uuid4().hex,
+        **extra,
+    }
+
+
+FACTS = {"merchant_id": "merchant_walmart", "plan_id": "plan_basic_12m", "amount_cents": 1299, "currency": "USD"}
+
+
+class _CountingAnalyze:
+    def __init__(self, delay: float = 0.0):
+        self.calls = 0
+        self.delay = delay
+
+    async def __call__(self, image_bytes: bytes, filename: str = "upload.jpg", image=None) -> ReceiptData:
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return ReceiptData(
+            merchant="Walmart",
+            category="Grocery",
+            items=[Item(name="Milk", price=12.99)],
+            total=99.0,  # OCR misread: the signed amount must win
+            raw_text="WALMART\nMilk 12.99\nTOTAL 12.99",
+        )
+
+
+@pytest.fixture()
+def client(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv("POS_TENANT_SECRETS", json.dumps({"demo": "dev-secret"}))
+    monkeypatch.setenv("POS_QR_MAX_AGE_SECONDS", "3600")
+    analyze = _CountingAnalyze()
+    monkeypatch.setattr(main.orch.receipt, "analyze", analyze)
+    monkeypatch.setattr(main.orch.deferred_ocr, "analyze", analyze)
+    monkeypatch.setattr(main.orch.deferred_ocr, "mode", "demand")
+    client = TestClient(main.app)
+    client.analyze = analyze
+    return client
+
+
+def _upload(client: TestClient, payload: dict):
+    return client.post(
+        "/api/receipt/analyze",
+        files={"receipt": ("blank.png", _blank_png(), "image/png")},
+        data={"pos_qr_token": build_token(payload, secret="dev-secret")},
+    )
+
+
+def test_signed_facts_skip_ocr_until_asked(client: TestClient):
+    r = _upload(client, _payload(**FACTS))
+    assert r.status_code == 200, r.text
+    body = r.json()
+    assert body["ocr_deferred"] and body["receipt_id"] and body["raw_text"] is None
+    assert body["total"] == 12.99 and body["merchant"] == "merchant_walmart" and body["trust_rating"] == 5
+    assert client.analyze.calls == 0
+
+    ocr = client.get(f"/api/receipt/{body['receipt_id']}/ocr").json()
+    assert not ocr["ocr_deferred"] and ocr["raw_text"].startswith("WALMART")
+    assert ocr["items"] == [{"name": "Milk", "price": 12.99, "eligible": True}] and ocr["category"] == "Grocery"
+    assert ocr["total"] == 12.99 and ocr["pos_qr_verified"]
+    client.get(f"/api/receipt/{body['receipt_id']}/ocr")
+    assert client.analyze.calls == 1
+    assert client.get("/api/receipt/nope/ocr").status_code == 404
+    assert client.get("/api/metrics").json()["deferred_ocr"]["ocr_runs"] >= 1
+
+
+def test_busy_ocr_pool_is_a_503_and_retried(client: TestClient, monkeypatch: pytest.MonkeyPatch):
+    body = _upload(client, _payload(**FACTS)).json()
+    url = f"/api/receipt/{body['receipt_id']}/ocr"
+
+    async def busy(image_bytes: bytes, filename: str = "upload.jpg", image=None) -> ReceiptData:
+        raise OcrPoolBusy("ocr_pool_busy")
+
+    monkeypatch.setattr(main.orch.deferred_ocr, "analyze", busy)
+    errors = main.orch.deferred_ocr.ocr_errors
+    r = client.get(url)
+    assert r.status_code == 503 and main.orch.deferred_ocr.ocr_errors == errors
+
+    monkeypatch.setattr(main.orch.deferred_ocr, "analyze", client.analyze)
+    ocr = client.get(url).json()
+    assert not ocr["ocr_deferred"] and client.analyze.calls == 1
+
+
+def test_payload_without_facts_runs_ocr_inline(client: TestClient):
+    body = _upload(client, _payload(merchant_id="merchant_walmart")).json()
+    assert not body["ocr_deferred"] and body["receipt_id"] is None
+    assert body["raw_text"].startswith("WALMART") and client.analyze.calls == 1
+
+
+def test_lazy_ocr_off_keeps_inline_ocr(client: TestClient, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(main.orch.deferred_ocr, "mode", "off")
+    body = _upload(client, _payload(**FACTS)).json()
+    assert not body["ocr_deferred"] and client.analyze.calls == 1
+
+
+def test_fast_path_skips_image_decode(client: TestClient, monkeypatch: pytest.MonkeyPatch):
+    ingested = []
+
+    async def ingest(data):
+        ingested.append(len(data))
+
+    monkeypatch.setattr(main.get_image_executor(), "ingest", ingest)
+    assert _upload(client, _payload(**FACTS)).json()["ocr_deferred"] and ingested == []
+    _upload(client, _payload(merchant_id="merchant_walmart"))
+    assert len(ingested) == 1  # OCR ran inline
+
+    # A QR decode already in the cache needs no pixels either.
+    buf = BytesIO()
+    qrcode.make(build_token(_payload(**FACTS), secret="dev-secret")).save(buf, format="PNG")
+    png = buf.getvalue()
+    asyncio.run(main._decode_qr_cached(png, main.get_tenant_keys()))
+    r = client.post("/api/receipt/analyze", files={"receipt": ("qr.png", png, "image/png")})
+    assert r.status_code == 200, r.text
+    assert r.json()["ocr_deferred"] and len(ingested) == 1
+
+
+def test_oversized_uploads_are_not_parked(client: TestClient, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(main.orch.deferred_ocr, "max_upload_bytes", 100)
+    r = _upload(client, _payload(**FACTS))
+    assert r.status_code == 200 and not r.json()["ocr_deferred"] and client.analyze.calls == 1
+
+
+def test_background_mode_runs_once_and_shares_result():
+    async def flow():
+        orch = Orchestrator(lazy_ocr="background")
+        analyze = _CountingAnalyze(delay=0.01)
+        orch.deferred_ocr.analyze = analyze
+        fast = await orch.handle_image_upload(b"img", "r.png", pos_qr_verified=True, pos_qr_payload=_payload(**FACTS))
+        await asyncio.sleep(0)
+        assert fast.ocr_deferred and analyze.calls == 1  # started without being asked
+        first, second = await asyncio.gather(orch.receipt_ocr(fast.receipt_id), orch.receipt_ocr(fast.receipt_id))
+        return orch, analyze, first, second
+
+    orch, analyze, first, second = asyncio.run(flow())
+    assert analyze.calls == 1 and first == second and first.items[0].name == "Milk"
+    assert orch._state["receipt"]["raw_text"] == first.raw_text
+
+
+def test_parked_uploads_are_bounded():
+    async def flow():
+        orch = Orchestrator(lazy_ocr="demand")
+        orch.deferred_ocr.max_entries = 2
+        orch.deferred_ocr.analyze = _CountingAnalyze()
+        ids = []
+        for _ in range(3):
+            r = await orch.handle_image_upload(b"img", "r.png", pos_qr_verified=True, pos_qr_payload=_payload(**FACTS))
+            ids.append(r.receipt_id)
+        return orch, ids, [await orch.receipt_ocr(i) for i in ids]
+
+    orch, ids, results = asyncio.run(flow())
+    assert results[0] is None and all(r is not None for r in results[1:])
+    assert orch.deferred_ocr.stats()["evicted"] == 1 and len(orch.deferred_ocr) == 2
+
+
+def test_parked_bytes_are_bounded():
+    async def flow():
+        orch = Orchestrator(lazy_ocr="demand")
+        orch.deferred_ocr.max_bytes = 250
+        orch.deferred_ocr.analyze = _CountingAnalyze()
+        ids = []
+        for _ in range(3):
+            r = await orch.handle_image_upload(b"x" * 100, "r.png", pos_qr_verified=True, pos_qr_payload=_payload(**FACTS))
+            ids.append(r.receipt_id)
+        stats = orch.deferred_ocr.stats()
+        await orch.receipt_ocr(ids[2])  # OCR done: its image is released
+        return ids, stats, orch.deferred_ocr.stats()
+
+    ids, parked, after = asyncio.run(flow())
+    assert parked["evicted"] == 1 and parked["parked"] == 2 and parked["bytes"] == 200
+    assert after["bytes"] == 100
+
+
+def test_analyze_tries_the_reduced_jpeg_decode(client: TestClient, monkeypatch: pytest.MonkeyPatch):
+    stages = []
+
+    def decode_qr(image, **kwargs):
+        result = pos_qr.decode_qr(image, **kwargs)
+        stages.append(result.stage)
+        return result
+
+    monkeypatch.setattr(main, "decode_qr", decode_qr)
+    qr = qrcode.make(build_token(_payload(**FACTS), secret="dev-secret")).convert("RGB").resize((600, 600))
+    photo = Image.new("RGB", (3200, 2400), color="white")
+    photo.paste(qr, (2400, 1650))
+    buf = BytesIO()
+    photo.save(buf, format="JPEG", quality=90)
+
+    r = client.post("/api/receipt/analyze", files={"receipt": ("photo.jpg", buf.getvalue(), "image/jpeg")})
+    assert r.status_code == 200, r.text
+    assert r.json()["ocr_deferred"] and stages[0].startswith("reduced")
@@ -0,0 +1,76 @@
+import asyncio
+import os
+from pathlib import Path
+
+import pytest
+
+from app.image_executor import ImageExecutor
+from app.pos_qr import decode_qr
+
+
+FIXTURE = Path(__file__).resolve().parents[0] / "fixtures" / "demo_pos_qr_receipt.png"
+
+
+def _shm_segments() -> set[str]:
+    try:
+        return {n for n in os.listdir("/dev/shm") if n.startswith("psm_")}
+    except FileNotFoundError:
+        return set()
+
+
+@pytest.mark.parametrize("mode", ["inline", "thread", "process"])
+def test_executor_decodes_fixture_in_every_mode(mode: str):
+    data = FIXTURE.read_bytes()
+    executor = ImageExecutor(mode=mode, max_workers=2)
+    before = _shm_segments()
+    executor.start()
+    try:
+        result = asyncio.run(executor.run(decode_qr, data))
+    finally:
+        executor.shutdown()
+
+    assert result.texts and result.texts[0].startswith("TSQR1.")
+    # Shared-memory segments are unlinked once the job finishes.
+    assert _shm_segments() <= before
+
+
+def test_executor_falls_back_to_default_pool_when_not_started():
+    executor = ImageExecutor(mode="process")
+    assert not executor.started
+    result = asyncio.run(executor.run(len, b"abc"))
+    assert result == 3
+
+
+def test_executor_rejects_unknown_mode():
+    with pytest.raises(ValueError):
+        ImageExecutor(mode="gpu")
+
+
+@pytest.mark.parametrize("mode", ["inline", "thread", "process"])
+def test_ingested_image_is_shared_by_qr_and_ocr_stages(mode: str):
+    data = FIXTURE.read_bytes()
+    executor = ImageExecutor(mode=mode, max_workers=2)
+    before = _shm_segments()
+    executor.start()
+
+    async def _flow():
+        image = await executor.ingest(data)
+        try:
+            result = await executor.run(decode_qr, image)
+            shape = await executor.run(_shape_of, image)
+        finally:
+            image.close()
+        return result, shape, image
+
+    try:
+        result, shape, image = asyncio.run(_flow())
+    finally:
+        executor.shutdown()
+
+    assert result.texts and result.texts[0].startswith("TSQR1.")
+    assert shape == image.shape and len(shape) == 2
+    assert _shm_segments() <= before
+
+
+def _shape_of(gray) -> tuple:
+    return tuple(gray.shape)
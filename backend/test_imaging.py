@@ -0,0 +1,65 @@
+from io import BytesIO
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from app.imaging import as_gray, decode_gray
+
+
+def _encode(img: Image.Image, fmt: str, **kwargs) -> bytes:
+    buf = BytesIO()
+    img.save(buf, format=fmt, **kwargs)
+    return buf.getvalue()
+
+
+def _marked_image() -> Image.Image:
+    # 200x100 white image with a black square in the top-left corner.
+    img = Image.new("L", (200, 100), color=255)
+    img.paste(0, (0, 0, 20, 20))
+    return img
+
+
+@pytest.mark.parametrize("fmt", ["JPEG", "PNG"])
+def test_decode_gray_applies_exif_orientation(fmt: str):
+    img = _marked_image()
+    exif = img.getexif()
+    exif[0x0112] = 6  # rotate 90 CW on display
+    gray = decode_gray(_encode(img, fmt, exif=exif.tobytes()))
+
+    assert gray.ndim == 2 and gray.dtype == np.uint8
+    assert gray.shape == (200, 100)
+    # The marker moved to the top-right corner.
+    assert gray[5, -5] < 64 and gray[5, 5] > 192
+
+
+def test_decode_gray_reads_memoryview_and_falls_back_to_pil():
+    data = _encode(_marked_image(), "GIF")  # not readable by cv2.imdecode
+    gray = decode_gray(memoryview(data))
+    assert gray.shape == (100, 200)
+    assert gray[5, 5] < 64
+
+
+def test_as_gray_passes_arrays_through():
+    gray = np.zeros((4, 6), dtype=np.uint8)
+    assert as_gray(gray) is gray
+    assert as_gray(np.zeros((4, 6, 3), dtype=np.uint8)).shape == (4, 6)
+
+
+def test_jpeg_size_reads_header_only():
+    from app.imaging import jpeg_size
+
+    data = _encode(Image.new("RGB", (321, 123)), "JPEG", progressive=True)
+    assert jpeg_size(data) == (321, 123)
+    assert jpeg_size(memoryview(data)[:2]) is None
+    assert jpeg_size(_encode(Image.new("RGB", (8, 8)), "PNG")) is None
+
+
+def test_decode_gray_reduced_picks_largest_factor_above_min_side():
+    from app.imaging import decode_gray_reduced
+
+    data = _encode(Image.new("RGB", (1600, 1200)), "JPEG")
+    gray, factor = decode_gray_reduced(data, min_side=400)
+    assert factor == 4 and gray.shape == (300, 400)
+    assert decode_gray_reduced(data, min_side=1000) is None
+    assert decode_gray_reduced(_encode(Image.new("RGB", (1600, 1200)), "PNG"), min_side=400) is None
@@ -0,0 +1,121 @@
+import time
+from pathlib import Path
+
+import pytest
+
+from app.nonce_filter import RotatingBloomFilter
+from app.nonce_journal import JournalLocked, NonceJournal, read_blocks
+from app.nonce_store import NonceStore, PrefilteredNonceStore, nonce_store_from_env
+
+
+def _store(path: Path, **journal_kwargs) -> NonceStore:
+    return NonceStore(ttl_seconds=600, journal=NonceJournal(str(path), **journal_kwargs))
+
+
+def test_restart_restores_unexpired_nonces(tmp_path: Path):
+    path = tmp_path / "nonces.journal"
+    store = _store(path)
+    now = time.time()
+    store.check_and_mark("demo", "live")
+    store.check_and_mark("other", "live")
+    store.check_and_mark("demo", "stale", now=now - 700)  # already expired on disk
+    store.close()
+
+    restarted = _store(path)
+    assert len(restarted) == 2 and restarted.journal.loaded == 2
+    assert not restarted.check_and_mark("demo", "live")
+    assert not restarted.check_and_mark("other", "live")
+    assert restarted.check_and_mark("demo", "stale")
+    assert restarted.stats()["journal"]["loaded"] == 2
+    restarted.close()
+
+
+def test_writes_are_group_committed_off_the_request_path(tmp_path: Path):
+    path = tmp_path / "nonces.journal"
+    store = _store(path, commit_interval=3600)
+    for i in range(100):
+        store.check_and_mark(f"t{i % 3}", f"n{i}")
+    # Nothing written yet: checks only queue their record.
+    assert read_blocks(str(path), 0.0)[1] == 0 and store.journal.stats()["pending"] == 100
+    store.close()
+    blocks, records, tail = read_blocks(str(path), 0.0)
+    assert records == 100 and tail == "clean" and len(blocks) == 3 and store.journal.commits == 1
+
+
+def test_torn_tail_is_dropped_and_rewritten(tmp_path: Path):
+    path = tmp_path / "nonces.journal"
+    store = _store(path)
+    store.check_and_mark("demo", "a\tb\\c\nd")  # escaped on disk
+    store.check_and_mark("demo", "plain")
+    store.close()
+    expires = time.time() + 600
+    with open(path, "ab") as f:
+        f.write(f"={expires:.3f}\tdemo\t3\t0\nlost1\nlo".encode())  # crashed mid-commit
+
+    restarted = _store(path)
+    assert len(restarted) == 2 and not restarted.check_and_mark("demo", "a\tb\\c\nd")
+    assert restarted.check_and_mark("demo", "lost1")
+    restarted.close()
+    blocks, records, tail = read_blocks(str(path), 0.0)
+    assert tail == "clean" and records == 3
+
+
+def test_corrupt_journal_is_quarantined_not_compacted(tmp_path: Path):
+    path = tmp_path / "nonces.journal"
+    store = _store(path)
+    store.check_and_mark("demo", "before")
+    store.close()
+    expires = time.time() + 600
+    with open(path, "ab") as f:
+        f.write(b"=garbage\n" + f"={expires:.3f}\tdemo\t1\t0\nafter\n".encode())
+    damaged = path.read_bytes()
+
+    restarted = _store(path)
+    quarantined = restarted.journal.quarantined
+    assert quarantined and Path(quarantined).read_bytes() == damaged
+    assert len(restarted) == 1 and not restarted.check_and_mark("demo", "before")
+    restarted.close()
+    assert read_blocks(str(path), 0.0)[2] == "clean"
+
+
+def test_compaction_keeps_only_live_entries(tmp_path: Path):
+    path = tmp_path / "nonces.journal"
+    store = _store(path, commit_interval=0.01, compact_min_records=20)
+    now = time.time()
+    for i in range(30):
+        store.check_and_mark("demo", f"old{i}", now=now - 700)  # journaled, but expired
+    for i in range(5):
+        store.check_and_mark("demo", f"new{i}")
+    deadline = time.time() + 5
+    while store.journal.compactions == 0 and time.time() < deadline:
+        time.sleep(0.01)
+    store.close()
+    assert store.journal.compactions == 1
+    assert read_blocks(str(path), 0.0)[1] == 5
+
+    restarted = _store(path)
+    assert len(restarted) == 5 and not restarted.check_and_mark("demo", "new0")
+    restarted.close()
+
+
+def test_journal_from_env_is_exclusive(monkeypatch: pytest.MonkeyPatch, tmp_path: Path):
+    monkeypatch.setenv("POS_QR_NONCE_BACKEND", "memory")
+    monkeypatch.setenv("POS_QR_NONCE_JOURNAL_PATH", str(tmp_path / "j" / "nonces.journal"))
+    store = nonce_store_from_env()
+    assert store.stats()["journal"]["path"].endswith("nonces.journal")
+    with pytest.raises(JournalLocked):
+        nonce_store_from_env()
+    store.close()
+
+
+def test_prefilter_is_seeded_from_restored_store(tmp_path: Path):
+    path = tmp_path / "nonces.journal"
+    first = _store(path)
+    first.check_and_mark("demo", "n")
+    first.close()
+
+    inner = _store(path)
+    store = PrefilteredNonceStore(inner, RotatingBloomFilter(capacity=1000, fp_rate=0.001, ttl_seconds=600))
+    assert store.stats()["prefilter"]["seeded"] == 1
+    assert not store.check_and_mark("demo", "n")
+    store.close()
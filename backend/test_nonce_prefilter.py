@@ -0,0 +1,107 @@
+from pathlib import Path
+
+import pytest
+
+from app.nonce_filter import RotatingBloomFilter
+from app.nonce_store import NonceStore, NonceStoreFull, PrefilteredNonceStore, SqliteNonceStore, nonce_store_from_env
+
+
+def test_bloom_sizing_meets_target_false_positive_rate():
+    bloom = RotatingBloomFilter(capacity=20000, fp_rate=0.01, ttl_seconds=60, generations=3)
+    # A full window's worth of marks, spread over the ttl like real traffic.
+    for i in range(20000):
+        bloom.add_if_absent(f"seen{i}".encode(), now=100.0 + i * 0.003)
+    assert all(bloom.might_contain(f"seen{i}".encode(), now=160.0) for i in range(20000))  # no false negatives
+    false_hits = sum(bloom.might_contain(f"new{i}".encode(), now=160.0) for i in range(20000))
+    assert false_hits / 20000 < 0.01 * 1.5
+    assert bloom.estimated_fp_rate() < 0.01
+    # Roughly 1.2 bytes per nonce per generation at 1%: far below a dict entry.
+    assert bloom.nbytes < 20000 * 4
+    with pytest.raises(ValueError):
+        RotatingBloomFilter(capacity=10, fp_rate=1.5, ttl_seconds=60)
+
+
+def test_bloom_rotation_keeps_marks_for_at_least_ttl():
+    def marked_at(t: float) -> RotatingBloomFilter:
+        bloom = RotatingBloomFilter(capacity=100, fp_rate=0.001, ttl_seconds=10, generations=3)  # rotates every 5s
+        assert bloom.add_if_absent(b"n", now=t)
+        return bloom
+
+    assert not marked_at(104.9).add_if_absent(b"n", now=114.8)  # within ttl of the mark
+    late = marked_at(104.9)
+    assert late.add_if_absent(b"n", now=115.0)  # its generation has rotated out
+    assert late.stats()["rotations"] == 1
+
+
+def _store(inner, **kwargs) -> PrefilteredNonceStore:
+    bloom = RotatingBloomFilter(capacity=1000, fp_rate=0.001, ttl_seconds=inner.ttl_seconds)
+    return PrefilteredNonceStore(inner, bloom, **kwargs)
+
+
+def test_definite_misses_are_written_behind_in_batches(tmp_path: Path):
+    inner = SqliteNonceStore(str(tmp_path / "n.sqlite3"), ttl_seconds=60)
+    store = _store(inner, flush_batch=10, flush_interval=3600)
+    for i in range(9):
+        assert store.check_and_mark("demo", f"n{i}")
+    assert len(inner) == 0 and store.stats()["prefilter"]["pending_writes"] == 9
+    assert store.check_and_mark("demo", "n9")  # fills the batch
+    assert len(inner) == 10 and inner.store_calls == 0  # one untimed batch, not counted twice
+
+    # A replay is a possible hit: queued marks are flushed first, then the store decides.
+    store.check_and_mark("demo", "queued")
+    assert not store.check_and_mark("demo", "queued")
+    assert not store.check_and_mark("demo", "n3")
+    stats = store.stats()["prefilter"]
+    assert stats["definite_misses"] == 11 and stats["possible_hits"] == 2 and stats["false_positives"] == 0
+    store.close()
+
+
+def test_false_positive_is_resolved_by_the_store():
+    inner = NonceStore(ttl_seconds=60)
+    store = _store(inner)
+    key = store._filter_key("demo", "never-seen")
+    store.bloom.add_if_absent(key, now=100.0)  # simulate a colliding earlier nonce
+    assert store.check_and_mark("demo", "never-seen", now=100.0)
+    assert store.stats()["prefilter"]["false_positives"] == 1
+    assert not store.check_and_mark("demo", "never-seen", now=100.0)
+
+
+def test_misses_respect_the_store_admission_policy():
+    inner = NonceStore(ttl_seconds=60, overflow="reject", tenant_quotas={"demo": 2})
+    store = _store(inner, flush_batch=10, flush_interval=3600)
+    assert store.check_and_mark("demo", "n0") and store.check_and_mark("demo", "n1")
+    # The quota is full counting the queued marks: refused now, not at flush time.
+    with pytest.raises(NonceStoreFull):
+        store.check_and_mark("demo", "n2")
+    assert store.check_and_mark("other", "n0")
+    stats = store.stats()["prefilter"]
+    assert stats["write_errors"] == 0 and stats["false_positives"] == 0
+    store.close()
+    assert len(inner) == 3
+
+
+def test_shared_store_reports_late_replays(tmp_path: Path):
+    # Two workers, one file: the second filter has not seen the nonce, so it
+    # accepts it and the store only refuses the queued write afterwards.
+    path = str(tmp_path / "n.sqlite3")
+    first = _store(SqliteNonceStore(path, ttl_seconds=60), flush_batch=1)
+    second = _store(SqliteNonceStore(path, ttl_seconds=60), flush_batch=1)
+    assert first.check_and_mark("demo", "n")
+    assert second.check_and_mark("demo", "n")
+    assert second.stats()["prefilter"]["late_replays"] == 1
+    first.close()
+    second.close()
+
+
+def test_prefilter_enabled_from_env(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv("POS_QR_NONCE_BACKEND", "memory")
+    monkeypatch.setenv("POS_QR_NONCE_PREFILTER", "on")
+    monkeypatch.setenv("POS_QR_NONCE_FILTER_CAPACITY", "5000")
+    monkeypatch.setenv("POS_QR_NONCE_FILTER_FP_RATE", "0.01")
+    store = nonce_store_from_env()
+    assert isinstance(store, PrefilteredNonceStore) and isinstance(store.inner, NonceStore)
+    stats = store.stats()
+    assert stats["prefilter"]["capacity"] == 5000 and stats["prefilter"]["target_fp_rate"] == 0.01
+    assert "entries" in stats
+    monkeypatch.setenv("POS_QR_NONCE_PREFILTER", "off")
+    assert isinstance(nonce_store_from_env(), NonceStore)
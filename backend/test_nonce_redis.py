@@ -0,0 +1,234 @@
+import json
+import socket
+import socketserver
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app.main as main_module
+from app.main import app
+from app.nonce_store import NonceStoreUnavailable, RedisNonceStore
+from app.pos_qr import build_token, verify_token, verify_tokens
+from app.resp import RespError, RespPool
+
+
+class FakeRespServer(socketserver.ThreadingTCPServer):
+    """Just enough of a Redis-protocol server: SET [NX] [EX], GET, PING, AUTH, SELECT."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, password=None, idle_timeout=None):
+        super().__init__(("127.0.0.1", 0), _RespHandler)
+        self.password = password
+        self.idle_timeout = idle_timeout
+        self.data = {}
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.max_pipelined = 0
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self) -> str:
+        return f"redis://127.0.0.1:{self.server_address[1]}/0"
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def handle_command(self, args: list, state: dict) -> bytes:
+        name = args[0].upper()
+        if self.password and not state.get("authed") and name != b"AUTH":
+            return b"-NOAUTH Authentication required.\r\n"
+        if name == b"AUTH":
+            state["authed"] = args[-1].decode() == self.password
+            return b"+OK\r\n" if state["authed"] else b"-WRONGPASS invalid password\r\n"
+        if name in (b"PING", b"SELECT"):
+            return b"+OK\r\n"
+        if name == b"GET":
+            with self.lock:
+                value = self.data.get(args[1])
+            return b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+        if name == b"SET":
+            if b"oom" in args[1]:
+                return b"-OOM command not allowed when used memory > 'maxmemory'.\r\n"
+            opts = [a.upper() for a in args[3:]]
+            with self.lock:
+                if b"NX" in opts and args[1] in self.data:
+                    return b"$-1\r\n"
+                self.data[args[1]] = args[2]
+            return b"+OK\r\n"
+        return b"-ERR unknown command\r\n"
+
+
+class _RespHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        server: FakeRespServer = self.server  # type: ignore[assignment]
+        server.connections += 1
+        state: dict = {}
+        buf = b""
+        # Like Redis' ``timeout`` setting: drop clients that stay idle.
+        self.request.settimeout(server.idle_timeout)
+        while True:
+            try:
+                chunk = self.request.recv(65536)
+            except socket.timeout:
+                return
+            if not chunk:
+                return
+            buf += chunk
+            # Every complete command in one read arrived as one pipeline.
+            replies = []
+            while True:
+                parsed = _parse_command(buf)
+                if parsed is None:
+                    break
+                args, buf = parsed
+                replies.append(server.handle_command(args, state))
+            if replies:
+                server.max_pipelined = max(server.max_pipelined, len(replies))
+                self.request.sendall(b"".join(replies))
+
+
+def _parse_command(buf: bytes):
+    """``(args, rest)`` for the first complete RESP array in ``buf``, else None."""
+    end = buf.find(b"\r\n")
+    if end < 0:
+        return None
+    n, pos, args = int(buf[1:end]), end + 2, []
+    for _ in range(n):
+        end = buf.find(b"\r\n", pos)
+        if end < 0:
+            return None
+        size = int(buf[pos + 1 : end])
+        pos = end + 2
+        if len(buf) < pos + size + 2:
+            return None
+        args.append(buf[pos : pos + size])
+        pos += size + 2
+    return args, buf[pos:]
+
+
+@pytest.fixture()
+def server():
+    srv = FakeRespServer()
+    yield srv
+    srv.stop()
+
+
+def _store(url: str, **kwargs) -> RedisNonceStore:
+    return RedisNonceStore(RespPool.from_url(url, timeout=0.5, max_connections=2), ttl_seconds=60, **kwargs)
+
+
+def test_set_nx_marks_once_over_one_pooled_connection(server: FakeRespServer):
+    store = _store(server.url)
+    assert store.check_and_mark("demo", "n1")
+    assert not store.check_and_mark("demo", "n1")
+    assert store.check_and_mark("other", "n1")
+    for i in range(20):
+        store.check_and_mark("demo", f"x{i}")
+    assert server.connections == 1
+    assert store.stats()["marked"] == 22 and store.stats()["replays"] == 1
+    # Keys are length-prefixed, so tenant/nonce splits cannot collide.
+    assert b"tapsure:nonce:4:demo:n1" in server.data
+    assert store._key("a:b", "c") != store._key("a", "b:c")
+    store.close()
+
+
+def test_mark_many_is_one_pipelined_round_trip(server: FakeRespServer):
+    store = _store(server.url)
+    store.check_and_mark("demo", "seen")
+    calls = store.store_calls
+    reasons = store.mark_many([("demo", f"p{i}") for i in range(30)] + [("demo", "seen"), ("demo", "p0")])
+    assert reasons == ["ok"] * 30 + ["replay", "replay"]
+    assert store.store_calls == calls + 1
+    assert server.max_pipelined == 32
+    store.close()
+
+
+def test_error_reply_falls_back_for_that_mark_only(server: FakeRespServer):
+    store = _store(server.url)
+    store.check_and_mark("demo", "seen")
+    reasons = store.mark_many([("demo", "a"), ("demo", "oom1"), ("demo", "seen"), ("demo", "b")])
+    assert reasons == ["ok", "ok", "replay", "ok"]
+    assert b"tapsure:nonce:4:demo:b" in server.data and b"tapsure:nonce:4:demo:oom1" not in server.data
+    assert store.mark_many([("demo", "oom1")]) == ["replay"]  # caught by the local store
+    stats = store.stats()
+    assert (stats["marked"], stats["replays"], stats["errors"], stats["fallbacks"]) == (3, 1, 2, 2)
+    assert stats["available"] is True
+    rejecting = _store(server.url, fallback="reject")
+    assert rejecting.mark_many([("demo", "c"), ("demo", "oom2")]) == ["ok", "nonce_store_unavailable"]
+    store.close()
+    rejecting.close()
+
+
+def test_connection_dropped_while_idle_is_replaced_not_an_outage():
+    server = FakeRespServer(idle_timeout=0.1)
+    try:
+        store = _store(server.url)
+        assert store.check_and_mark("demo", "n1")
+        time.sleep(0.3)  # the server closes the pooled connection
+        assert not store.check_and_mark("demo", "n1")
+        assert store.check_and_mark("demo", "n2")
+        stats = store.stats()
+        assert stats["errors"] == 0 and stats["fallbacks"] == 0 and stats["available"] is True
+        assert store.pool.stale_retries == 1 and server.connections == 2
+        store.close()
+    finally:
+        server.stop()
+
+
+def test_unreachable_server_falls_back_to_local_store(server: FakeRespServer):
+    url = server.url
+    server.stop()
+    store = _store(url, retry_interval=60)
+    assert store.check_and_mark("demo", "n1")
+    assert not store.check_and_mark("demo", "n1")  # still caught, locally
+    stats = store.stats()
+    assert stats["errors"] == 1 and stats["fallbacks"] == 2 and stats["available"] is False
+
+
+def test_unreachable_server_with_reject_policy_fails_tokens(server: FakeRespServer):
+    url = server.url
+    server.stop()
+    store = _store(url, fallback="reject")
+    token = build_token({"tenant_id": "demo", "nonce": "n", "timestamp": int(time.time())}, "dev-secret")
+    assert verify_token(token, {"demo": "dev-secret"}, store, 3600, 60)[1] == "nonce_store_unavailable"
+    with pytest.raises(NonceStoreUnavailable):
+        store.check_and_mark("demo", "m")
+
+
+def test_pool_authenticates_and_surfaces_error_replies():
+    srv = FakeRespServer(password="s3cret")
+    try:
+        url = f"redis://:s3cret@127.0.0.1:{srv.server_address[1]}/0"
+        pool = RespPool.from_url(url)
+        assert pool.execute("SET", "k", "v") == "OK"
+        assert pool.execute("GET", "k") == b"v"
+        with pytest.raises(RespError):
+            pool.execute("NOPE")
+        with pytest.raises(RespError, match="NOAUTH"):
+            RespPool.from_url(srv.url).execute("PING")
+    finally:
+        srv.stop()
+
+
+def test_tokens_endpoint_marks_nonces_in_one_store_call(server: FakeRespServer, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv("POS_TENANT_SECRETS", json.dumps({"demo": "dev-secret"}))
+    store = _store(server.url)
+    monkeypatch.setattr(main_module, "get_nonce_store", lambda: store)
+    now = int(time.time())
+    tokens = [build_token({"tenant_id": "demo", "nonce": f"b{i}_{now}", "timestamp": now}, "dev-secret") for i in range(5)]
+
+    r = TestClient(app).post("/api/pos/qr/verify/tokens", json={"tokens": tokens + tokens[:1]})
+    body = r.json()
+    assert [x["reason"] for x in body["results"]] == ["ok"] * 5 + ["replay"]
+    assert body["nonce_store_ms"] > 0 and store.store_calls == 1
+    assert server.max_pipelined == 6
+
+    # Same tokens through the module helper: all replays now.
+    assert {reason for _, reason, _ in verify_tokens(tokens, {"demo": "dev-secret"}, store, 3600, 60)} == {"replay"}
+    store.close()
@@ -0,0 +1,221 @@
+import json
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app import nonce_store as nonce_store_module
+from app.nonce_store import NonceStore, NonceStoreFull, SqliteNonceStore, nonce_store_from_env, tenant_policy_values
+from app.pos_qr import build_token, check_token, verify_token
+
+
+def test_replay_and_expiry():
+    store = NonceStore(ttl_seconds=10)
+    assert store.check_and_mark("demo", "n1", now=100.0)
+    assert not store.check_and_mark("demo", "n1", now=109.0)
+    assert store.check_and_mark("other", "n1", now=109.0)
+    # Expired (its slot not even purged yet): usable again.
+    assert store.check_and_mark("demo", "n1", now=110.0)
+    assert store.stats()["replays"] == 1
+
+
+def test_expiry_drops_whole_slots_without_scanning_live_entries():
+    store = NonceStore(ttl_seconds=10, bucket_seconds=1.0)
+    for i in range(100):
+        store.check_and_mark("demo", f"n{i}", now=100.0 + i * 0.1)  # expiries 110.0 .. 119.9
+    assert len(store) == 100 and store.stats()["buckets"] == 10
+
+    store.check_and_mark("demo", "late", now=115.0)
+    # Slots 110..114 are gone; 115 is only partially expired and stays filed.
+    assert len(store) == 51 and store.stats()["expirations"] == 50
+    assert store.check_and_mark("demo", "n50", now=115.05)  # expired at 115.0
+    assert not store.check_and_mark("demo", "n51", now=115.05)
+
+    store.check_and_mark("demo", "later", now=200.0)
+    assert len(store) == 1 and store.stats()["buckets"] == 1
+
+
+def test_re_marked_nonce_survives_its_old_slot():
+    store = NonceStore(ttl_seconds=10)
+    store.check_and_mark("demo", "n", now=100.0)
+    store.check_and_mark("demo", "n", now=110.5)  # re-marked after expiry
+    store.check_and_mark("demo", "x", now=112.0)  # purges slot 110
+    assert not store.check_and_mark("demo", "n", now=115.0)
+
+
+def test_overflow_evict_drops_entries_closest_to_expiry():
+    store = NonceStore(ttl_seconds=100, max_entries=3, overflow="evict")
+    for i in range(3):
+        store.check_and_mark("demo", f"n{i}", now=100.0 + i)
+    assert store.check_and_mark("demo", "n3", now=104.0)
+    assert len(store) == 3 and store.stats()["evictions"] == 1
+    assert store.check_and_mark("demo", "n0", now=104.0)  # evicted, so accepted again
+    assert not store.check_and_mark("demo", "n2", now=104.0)
+
+
+def test_overflow_reject_refuses_new_nonces():
+    store = NonceStore(ttl_seconds=3600, max_entries=1, overflow="reject")
+    secrets = {"demo": "dev-secret"}
+    now = int(time.time())
+    first = build_token({"tenant_id": "demo", "nonce": "a", "timestamp": now}, "dev-secret")
+    second = build_token({"tenant_id": "demo", "nonce": "b", "timestamp": now}, "dev-secret")
+
+    assert verify_token(first, secrets, store, 3600, 60)[:2] == (True, "ok")
+    assert verify_token(first, secrets, store, 3600, 60)[1] == "replay"
+    assert verify_token(second, secrets, store, 3600, 60)[1] == "nonce_store_full"
+    with pytest.raises(NonceStoreFull):
+        store.check_and_mark("demo", "c")
+    assert store.stats()["rejections"] == 2
+    with pytest.raises(ValueError):
+        NonceStore(ttl_seconds=1, overflow="drop")
+
+
+def test_metrics_report_nonce_store():
+    stats = TestClient(app).get("/api/metrics").json()["nonce_store"]
+    assert {"entries", "max_entries", "evictions", "expirations", "rejections"} <= set(stats)
+
+
+def test_sqlite_replay_expiry_and_batched_purge(tmp_path: Path):
+    store = SqliteNonceStore(str(tmp_path / "nonces.sqlite3"), ttl_seconds=10, purge_interval=60.0, purge_batch=2)
+    assert store.check_and_mark("demo", "n1", now=100.0)
+    assert not store.check_and_mark("demo", "n1", now=105.0)
+    assert store.check_and_mark("demo", "n1", now=110.0)  # reclaimed in place after expiry
+    for i in range(5):
+        store.check_and_mark("demo", f"x{i}", now=100.0)
+    assert len(store) == 6
+
+    # Six expired rows go two per check: a backlog does not stall one request.
+    store.check_and_mark("demo", "y0", now=200.0)
+    assert len(store) == 5
+    store.check_and_mark("demo", "y1", now=200.0)
+    store.check_and_mark("demo", "y2", now=200.0)
+    assert len(store) == 3 and store.stats()["expirations"] == 6
+
+    # A second handle on the same file sees the marks.
+    other = SqliteNonceStore(store.path, ttl_seconds=10)
+    assert not other.check_and_mark("demo", "y0", now=112.0)
+    store.close()
+    other.close()
+
+
+def _mark_all(path: str, nonces: list) -> int:
+    store = SqliteNonceStore(path, ttl_seconds=60)
+    try:
+        return sum(store.check_and_mark("demo", n) for n in nonces)
+    finally:
+        store.close()
+
+
+def test_sqlite_check_and_mark_is_atomic_across_processes(tmp_path: Path):
+    path = str(tmp_path / "nonces.sqlite3")
+    nonces = [f"n{i}" for i in range(300)]
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=4, mp_context=ctx) as pool:
+        accepted = list(pool.map(_mark_all, [path] * 4, [nonces] * 4))
+    # Every worker tried every nonce; each was accepted exactly once overall.
+    assert sum(accepted) == len(nonces)
+
+
+def test_backend_selected_from_env(monkeypatch: pytest.MonkeyPatch, tmp_path: Path):
+    monkeypatch.setenv("POS_QR_NONCE_BACKEND", "sqlite")
+    monkeypatch.setenv("POS_QR_NONCE_SQLITE_PATH", str(tmp_path / "n.sqlite3"))
+    store = nonce_store_from_env()
+    assert isinstance(store, SqliteNonceStore) and store.stats()["entries"] == 0
+    store.close()
+
+    monkeypatch.setenv("POS_QR_NONCE_BACKEND", "memory")
+    assert isinstance(nonce_store_from_env(), NonceStore)
+    monkeypatch.setenv("POS_QR_NONCE_BACKEND", "nosuch")
+    with pytest.raises(ValueError):
+        nonce_store_from_env()
+
+
+def test_sqlite_mark_many_is_one_transaction_with_in_batch_replays(tmp_path: Path):
+    store = SqliteNonceStore(str(tmp_path / "n.sqlite3"), ttl_seconds=60)
+    store.check_and_mark("demo", "seen", now=100.0)
+    reasons = store.mark_many([("demo", "a"), ("demo", "seen"), ("demo", "a"), ("demo", "b")], now=101.0)
+    assert reasons == ["ok", "replay", "replay", "ok"]
+    assert len(store) == 3 and store.stats()["replays"] == 2
+    store.close()
+
+
+def test_tenants_get_their_own_ttl_and_expiry_schedule():
+    store = NonceStore(ttl_seconds=100, tenant_ttls={"fast": 10})
+    store.check_and_mark("fast", "n", now=1000.0)
+    store.check_and_mark("slow", "n", now=1000.0)
+    assert store.check_and_mark("fast", "n", now=1010.0)  # its 10 s are up
+    assert not store.check_and_mark("slow", "n", now=1010.0)
+    # An idle tenant's slots are still dropped by the periodic sweep.
+    store.check_and_mark("slow", "x", now=1050.0)
+    tenants = store.stats()["tenants"]
+    assert tenants["fast"]["entries"] == 0 and tenants["fast"]["expirations"] == 2
+    assert tenants["slow"]["ttl_seconds"] == 100 and tenants["slow"]["entries"] == 2
+
+
+def test_tenant_quota_confines_a_noisy_tenant():
+    store = NonceStore(ttl_seconds=100, tenant_quotas={"noisy": 3, "*": 0})
+    for i in range(10):
+        store.check_and_mark("noisy", f"n{i}", now=100.0 + i)
+    store.check_and_mark("quiet", "q", now=100.0)
+    tenants = store.stats()["tenants"]
+    assert tenants["noisy"]["entries"] == 3 and tenants["noisy"]["evictions"] == 7
+    assert tenants["quiet"]["entries"] == 1 and len(store) == 4
+    assert not store.check_and_mark("noisy", "n9", now=111.0)  # its newest nonces survive
+
+    strict = NonceStore(ttl_seconds=100, overflow="reject", tenant_quotas={"*": 1})
+    strict.check_and_mark("a", "1", now=100.0)
+    assert strict.check_and_mark("b", "1", now=100.0)
+    with pytest.raises(NonceStoreFull):
+        strict.check_and_mark("a", "2", now=100.0)
+    assert strict.stats()["tenants"]["a"]["rejections"] == 1 and strict.stats()["rejections"] == 1
+
+
+def test_global_cap_evicts_from_the_largest_partition():
+    store = NonceStore(ttl_seconds=100, max_entries=4)
+    for i in range(3):
+        store.check_and_mark("noisy", f"n{i}", now=100.0 + i)
+    store.check_and_mark("quiet", "q", now=100.0)
+    store.check_and_mark("quiet", "r", now=104.0)
+    tenants = store.stats()["tenants"]
+    assert tenants["noisy"]["evictions"] == 1 and tenants["quiet"]["evictions"] == 0
+    assert not store.check_and_mark("quiet", "q", now=104.0)
+
+
+def test_tenant_policies_set_max_age_and_nonce_ttl(monkeypatch: pytest.MonkeyPatch):
+    policies = {"demo": {"max_age_seconds": 60, "nonce_quota": 5}, "*": {"nonce_quota": 100}, "bad": {"max_age_seconds": "x"}}
+    monkeypatch.setenv("POS_QR_TENANT_POLICIES", json.dumps(policies))
+    monkeypatch.setenv("POS_QR_NONCE_TTL_SECONDS", "900")
+    store = NonceStore.from_env()
+    assert store.ttl_for("demo") == 60 and store.ttl_for("other") == 900
+    store.check_and_mark("demo", "n")
+    store.check_and_mark("other", "n")
+    tenants = store.stats()["tenants"]
+    assert tenants["demo"]["quota"] == 5 and tenants["other"]["quota"] == 100
+
+    monkeypatch.setenv("POS_TENANT_SECRETS", json.dumps({"demo": "dev-secret", "other": "other-secret"}))
+    monkeypatch.setenv("POS_QR_MAX_AGE_SECONDS", "3600")
+    old = int(time.time()) - 120
+    demo = build_token({"tenant_id": "demo", "nonce": "p1", "timestamp": old}, "dev-secret")
+    other = build_token({"tenant_id": "other", "nonce": "p1", "timestamp": old}, "other-secret")
+    client = TestClient(app)
+    r = client.post("/api/pos/qr/verify/tokens", json={"tokens": [demo, other]})
+    assert [x["reason"] for x in r.json()["results"]] == ["expired", "ok"]
+    assert check_token(demo, {"demo": "dev-secret"}, {"*": 3600, "demo": 600}, 60)[1] == "ok"
+
+
+def test_tenant_policies_are_parsed_once_per_env_value(monkeypatch: pytest.MonkeyPatch):
+    parses = []
+    real = nonce_store_module.get_pos_qr_tenant_policies
+    monkeypatch.setattr(nonce_store_module, "get_pos_qr_tenant_policies", lambda: parses.append(1) or real())
+    monkeypatch.setenv("POS_QR_TENANT_POLICIES", json.dumps({"demo": {"max_age_seconds": 60}}))
+    for _ in range(3):
+        assert tenant_policy_values("max_age_seconds") == {"demo": 60}
+    assert len(parses) == 1
+
+    monkeypatch.setenv("POS_QR_TENANT_POLICIES", json.dumps({"demo": {"max_age_seconds": 90}}))
+    assert tenant_policy_values("max_age_seconds") == {"demo": 90}
+    assert len(parses) == 2
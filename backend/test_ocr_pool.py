@@ -0,0 +1,172 @@
+import asyncio
+import os
+import time
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+import pytest
+
+from app.agents import receipt
+from app.image_executor import IngestedImage
+from app.ocr_pool import (
+    CApiEngine,
+    OcrJobFailed,
+    OcrPool,
+    OcrPoolBusy,
+    OcrPoolError,
+    OcrTimeout,
+    OcrWorkerCrashed,
+    _share,
+)
+
+OK, HANG, CRASH, FAIL, SLOW = 0, 1, 2, 3, 4
+
+
+class FakeEngine:
+    """Stands in for tesseract in the workers; the first pixel picks the behaviour."""
+
+    name = "fake"
+    loads = 0  # per worker process
+
+    def __init__(self, lang: str):
+        FakeEngine.loads += 1
+
+    def recognize(self, gray, dpi) -> str:
+        mode = int(gray[0, 0])
+        if mode == HANG:
+            time.sleep(30)
+        elif mode == CRASH:
+            os._exit(3)
+        elif mode == FAIL:
+            raise ValueError("unreadable")
+        elif mode == SLOW:
+            time.sleep(1.0)
+        return f"{os.getpid()} {FakeEngine.loads} {gray.shape[1]}x{gray.shape[0]}"
+
+    def close(self) -> None:
+        pass
+
+
+def _job(mode: int) -> np.ndarray:
+    img = np.full((20, 30), 255, np.uint8)
+    img[0, 0] = mode
+    return img
+
+
+def _pool(**kwargs) -> OcrPool:
+    pool = OcrPool(engine_factory=FakeEngine, **kwargs)
+    pool.start()
+    return pool
+
+
+def _wait_ready(pool: OcrPool, workers: int) -> None:
+    deadline = time.time() + 60
+    while pool.stats()["worker_starts"] < workers and time.time() < deadline:
+        time.sleep(0.02)
+
+
+def test_each_worker_loads_its_engine_once():
+    pool = _pool(workers=2, timeout=10)
+    try:
+        results = [f.result(timeout=60) for f in [pool.submit(_job(OK), preprocess=False) for _ in range(20)]]
+        pids = {r.split()[0] for r in results}
+        assert all(r.split()[1] == "1" and r.endswith("30x20") for r in results)
+        assert 1 <= len(pids) <= 2 and os.getpid() not in {int(p) for p in pids}
+        stats = pool.stats()
+        assert stats["jobs"] == 20 and stats["worker_starts"] == 2 and stats["engines"] == ["fake"]
+    finally:
+        pool.shutdown()
+
+
+def test_timeouts_and_crashes_fail_the_job_and_restart_the_worker():
+    pool = _pool(workers=1, timeout=1.0)
+    try:
+        first = pool.submit(_job(OK), preprocess=False).result(timeout=60).split()[0]
+        with pytest.raises(OcrTimeout):
+            pool.submit(_job(HANG), preprocess=False).result(timeout=60)
+        second = pool.submit(_job(OK), preprocess=False).result(timeout=60).split()[0]
+        with pytest.raises(OcrWorkerCrashed):
+            pool.submit(_job(CRASH), preprocess=False).result(timeout=60)
+        third = pool.submit(_job(OK), preprocess=False).result(timeout=60).split()[0]
+        # An engine error is the job's problem, not the worker's.
+        with pytest.raises(OcrJobFailed, match="unreadable"):
+            pool.submit(_job(FAIL), preprocess=False).result(timeout=60)
+        fourth = pool.submit(_job(OK), preprocess=False).result(timeout=60).split()[0]
+        assert len({first, second, third}) == 3 and fourth == third
+        stats = pool.stats()
+        assert (stats["timeouts"], stats["crashes"], stats["errors"], stats["worker_starts"]) == (1, 1, 1, 3)
+    finally:
+        pool.shutdown()
+
+
+def test_full_queue_rejects_immediately():
+    pool = _pool(workers=1, max_queue=2, timeout=10)
+    try:
+        _wait_ready(pool, 1)
+        running = pool.submit(_job(SLOW), preprocess=False)
+        while pool.stats()["queued"]:
+            time.sleep(0.01)  # the worker has taken it
+        queued = [pool.submit(_job(OK), preprocess=False) for _ in range(2)]
+        with pytest.raises(OcrPoolBusy):
+            pool.submit(_job(OK), preprocess=False)
+        assert pool.stats()["rejected"] == 1
+        running.result(timeout=60)
+        assert all(f.result(timeout=60) for f in queued)
+    finally:
+        pool.shutdown()
+    with pytest.raises(OcrPoolError):
+        pool.submit(_job(OK))
+
+
+def test_analyzer_uses_the_pool_when_started(monkeypatch: pytest.MonkeyPatch):
+    pool = _pool(workers=1, timeout=1.0)
+    monkeypatch.setattr(receipt, "get_ocr_pool", lambda: pool)
+    analyzer = receipt.ReceiptAnalyzer()
+    try:
+        assert asyncio.run(analyzer._ocr_text(b"", IngestedImage(gray=_job(OK)))).endswith("30x20")
+        assert asyncio.run(analyzer._ocr_text(b"", IngestedImage(gray=_job(HANG)))) == ""  # heuristic fallback
+    finally:
+        pool.shutdown()
+
+
+def test_shutdown_wakes_more_dispatchers_than_queue_slots():
+    pool = _pool(workers=3, max_queue=1, timeout=10)
+    _wait_ready(pool, 3)
+    started = time.perf_counter()
+    pool.shutdown()
+    assert not pool.started and time.perf_counter() - started < 10
+
+
+def test_images_reach_workers_through_shared_memory():
+    segment = shared_memory.SharedMemory(create=True, size=600)
+    ingested = IngestedImage(shm=segment, shape=(20, 30))
+    ingested.gray[...] = _job(OK)
+    try:
+        # The executor's segment is handed over as-is; nothing new is created.
+        assert _share(ingested) == (("gray", segment.name, (20, 30)), None)
+        pool = _pool(workers=1, timeout=10)
+        try:
+            ok, png = cv2.imencode(".png", _job(OK))
+            for image in (ingested, _job(OK), png.tobytes()):
+                assert pool.submit(image, preprocess=False).result(timeout=60).endswith("30x20")
+        finally:
+            pool.shutdown()
+    finally:
+        ingested.close()
+
+
+def test_capi_engine_reads_text():
+    try:
+        engine = CApiEngine("eng", os.getenv("TAPSURE_TESSERACT_LIB") or None)
+    except OSError as e:
+        pytest.skip(f"libtesseract unavailable: {e}")
+
+    page = np.full((200, 900), 255, np.uint8)
+    cv2.putText(page, "TOTAL 12.99", (30, 90), cv2.FONT_HERSHEY_SIMPLEX, 2.0, 0, 4)
+    cv2.putText(page, "THANK YOU", (30, 170), cv2.FONT_HERSHEY_SIMPLEX, 2.0, 0, 4)
+    try:
+        text = engine.recognize(page, 300)
+    finally:
+        engine.close()
+    assert "TOTAL" in text and "THANK" in text
@@ -0,0 +1,71 @@
+import cv2
+import numpy as np
+import pytest
+
+from app.agents import receipt
+from app.ocr_preprocess import estimate_text_skew, find_paper, preprocess_for_ocr
+
+
+def _paper() -> np.ndarray:
+    # 64 mm x 140 mm receipt at 254 dpi (10 px/mm): light paper, dark text rows.
+    rng = np.random.default_rng(1)
+    paper = np.full((1400, 640), 235, np.uint8)
+    for y in range(60, 1340, 40):
+        paper[y : y + 18, 40 : 40 + int(rng.integers(200, 560))] = 30
+    return paper
+
+
+def _photo(angle: float) -> np.ndarray:
+    # The receipt rotated by ``angle`` on a dark, noisy table.
+    paper = _paper()
+    table = np.random.default_rng(0).integers(20, 90, (2400, 1800)).astype(np.uint8)
+    matrix = cv2.getRotationMatrix2D((320, 700), angle, 1.0)
+    matrix[0, 2] += 900 - 320
+    matrix[1, 2] += 1200 - 700
+    placed = cv2.warpAffine(paper, matrix, (1800, 2400))
+    mask = cv2.warpAffine(np.full_like(paper, 255), matrix, (1800, 2400))
+    return np.where(mask > 0, placed, table).astype(np.uint8)
+
+
+@pytest.mark.parametrize("angle", [7.0, -5.0, 0.0])
+def test_crops_to_the_paper_and_undoes_rotation(angle: float):
+    prepared = preprocess_for_ocr(_photo(angle), target_dpi=254, paper_mm=64)
+
+    assert prepared.paper_found
+    assert prepared.angle == pytest.approx(-angle, abs=0.5)
+    assert prepared.scale == pytest.approx(1.0, abs=0.02)
+    # Just the paper is left, upright, with none of the table.
+    assert prepared.image.shape == pytest.approx((1400, 640), abs=8)
+    assert set(np.unique(prepared.image)) <= {0, 255}
+    upright = preprocess_for_ocr(_photo(0.0), target_dpi=254, paper_mm=64).image
+    h, w = min(upright.shape[0], prepared.image.shape[0]), min(upright.shape[1], prepared.image.shape[1])
+    assert np.mean(upright[:h, :w] == prepared.image[:h, :w]) > 0.9
+
+
+def test_resamples_paper_to_target_dpi():
+    prepared = preprocess_for_ocr(_photo(3.0), target_dpi=127, paper_mm=64)  # half of 254 dpi
+    assert prepared.scale == pytest.approx(0.5, abs=0.02)
+    assert prepared.image.shape == pytest.approx((700, 320), abs=6)
+
+
+def test_scan_without_outline_is_deskewed_from_text():
+    paper = _paper()
+    assert find_paper(paper) is None  # the paper fills the frame
+    matrix = cv2.getRotationMatrix2D((320, 700), 4.0, 1.0)
+    skewed = cv2.warpAffine(paper, matrix, (640, 1400), borderValue=235)
+    assert estimate_text_skew(skewed) == pytest.approx(-4.0, abs=0.5)
+    prepared = preprocess_for_ocr(skewed)
+    assert not prepared.paper_found and prepared.angle == pytest.approx(-4.0, abs=0.5)
+
+
+def test_toggle_controls_what_tesseract_sees(monkeypatch: pytest.MonkeyPatch):
+    seen = []
+    monkeypatch.setattr(receipt.pytesseract, "image_to_string", lambda img, config="": seen.append((img, config)) or "")
+    photo = _photo(7.0)
+
+    receipt.ocr_image(photo, preprocess=False)
+    receipt.ocr_image(photo, preprocess=True)
+
+    (raw, raw_config), (pre, pre_config) = seen
+    assert raw is photo and raw_config == ""
+    assert pre.size < photo.size and pre_config == f"--dpi {receipt.OCR_TARGET_DPI}"
@@ -0,0 +1,123 @@
+import asyncio
+import json
+import time
+import zipfile
+from io import BytesIO
+
+import pytest
+import qrcode
+from fastapi.testclient import TestClient
+from PIL import Image
+from starlette.requests import Request
+
+from app.main import app
+from app.pos_qr import build_token
+from app.qr_batch import parse_batch_form
+
+
+@pytest.fixture()
+def client(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv("POS_TENANT_SECRETS", json.dumps({"demo": "dev-secret"}))
+    monkeypatch.setenv("POS_QR_MAX_AGE_SECONDS", "3600")
+    monkeypatch.setenv("POS_QR_NONCE_TTL_SECONDS", "3600")
+    return TestClient(app)
+
+
+def _qr_png(tx: str) -> bytes:
+    payload = {"tenant_id": "demo", "transaction_id": tx, "timestamp": int(time.time()), "nonce": f"batch_{tx}_{time.time_ns()}"}
+    buf = BytesIO()
+    qrcode.make(build_token(payload, secret="dev-secret")).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def _blank_png() -> bytes:
+    buf = BytesIO()
+    Image.new("RGB", (64, 64), color="white").save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def _zip(members: dict) -> bytes:
+    buf = BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        for name, data in members.items():
+            zf.writestr(name, data)
+    return buf.getvalue()
+
+
+def _lines(r) -> list[dict]:
+    return [json.loads(line) for line in r.text.splitlines() if line.strip()]
+
+
+def test_batch_streams_results_for_images_and_archives(client: TestClient, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv("POS_QR_BATCH_CONCURRENCY", "2")
+    first, second = _qr_png("b1"), _qr_png("b2")
+    archive = _zip({"day/r2.png": second, "day/dup.png": first, "notes.txt": b"ignored", "day/blank.png": _blank_png()})
+
+    r = client.post(
+        "/api/pos/qr/verify/batch",
+        files=[
+            ("receipts", ("r1.png", first, "image/png")),
+            ("receipts", ("close.zip", archive, "application/zip")),
+            ("receipts", ("notes.pdf", b"%PDF", "application/pdf")),
+        ],
+    )
+    assert r.status_code == 200, r.text
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+
+    lines = _lines(r)
+    summary = lines.pop()["summary"]
+    by_name = {line["filename"]: line for line in lines}
+    assert sorted(line["index"] for line in lines) == list(range(5))
+
+    # The same token twice in one batch: one copy verifies, the other is a replay.
+    dup_pair = sorted([by_name["r1.png"]["reason"], by_name["close.zip/day/dup.png"]["reason"]])
+    assert dup_pair == ["ok", "replay"]
+    assert by_name["close.zip/day/r2.png"]["valid"] is True
+    assert by_name["close.zip/day/r2.png"]["payload"]["transaction_id"] == "b2"
+    assert by_name["close.zip/day/blank.png"]["reason"] == "no_qr"
+    assert by_name["notes.pdf"]["reason"] == "unsupported_content_type"
+    assert summary == {"items": 5, "valid": 2, "reasons": {"ok": 2, "replay": 1, "no_qr": 1, "unsupported_content_type": 1}}
+
+
+def test_batch_enforces_item_and_size_limits(client: TestClient, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv("POS_QR_BATCH_MAX_ITEMS", "1")
+    monkeypatch.setenv("POS_QR_MAX_BYTES", "100000")
+    big = b"\0" * 200000
+
+    r = client.post(
+        "/api/pos/qr/verify/batch",
+        files=[
+            ("receipts", ("big.png", big, "image/png")),
+            ("receipts", ("r.png", _qr_png("b3"), "image/png")),
+        ],
+    )
+    lines = _lines(r)
+    assert [line.get("reason") for line in lines[:-1]] == ["file_too_large", "too_many_items"]
+    assert lines[-1]["summary"]["items"] == 1
+
+
+def test_batch_parts_are_spooled_to_disk():
+    boundary = "batchboundary"
+    body = b"".join(
+        b"--%s\r\nContent-Disposition: form-data; name=\"receipts\"; filename=\"r%d.png\"\r\n"
+        b"Content-Type: image/png\r\n\r\n%s\r\n" % (boundary.encode(), i, b"x" * 4096)
+        for i in range(3)
+    ) + b"--%s--\r\n" % boundary.encode()
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def flow():
+        scope = {
+            "type": "http",
+            "method": "POST",
+            "headers": [(b"content-type", f"multipart/form-data; boundary={boundary}".encode())],
+        }
+        form = await parse_batch_form(Request(scope, receive), max_files=10)
+        try:
+            return [(f.file._rolled, await f.read()) for f in form.getlist("receipts")]
+        finally:
+            await form.close()
+
+    parts = asyncio.run(flow())
+    assert len(parts) == 3 and all(rolled and data == b"x" * 4096 for rolled, data in parts)
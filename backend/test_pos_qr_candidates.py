@@ -0,0 +1,120 @@
+import json
+import time
+from io import BytesIO
+
+import pytest
+import qrcode
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from app.config import get_pos_qr_region_hints, parse_region_hints
+from app.main import app
+from app.pos_qr import NonceStore, build_token, verify_token_candidates
+
+
+@pytest.fixture()
+def client(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv("POS_TENANT_SECRETS", json.dumps({"demo": "dev-secret"}))
+    monkeypatch.setenv("POS_QR_MAX_AGE_SECONDS", "3600")
+    monkeypatch.setenv("POS_QR_NONCE_TTL_SECONDS", "3600")
+    monkeypatch.setenv("POS_QR_ENFORCEMENT", "on")
+    return TestClient(app)
+
+
+def _payload(tx: str) -> dict:
+    return {
+        "tenant_id": "demo",
+        "transaction_id": tx,
+        "timestamp": int(time.time()),
+        "nonce": f"nonce_{tx}",
+        "amount_cents": 1299,
+        "currency": "USD",
+    }
+
+
+def _make_multi_qr_png_bytes(texts: list[str]) -> bytes:
+    # Receipt-like canvas with several QR codes side by side.
+    side = 420
+    canvas = Image.new("RGB", (len(texts) * (side + 80) + 80, side + 160), color="white")
+    for i, text in enumerate(texts):
+        qr_img = qrcode.make(text).convert("RGB").resize((side, side), resample=Image.Resampling.NEAREST)
+        canvas.paste(qr_img, (80 + i * (side + 80), 80))
+    buf = BytesIO()
+    canvas.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def test_verify_picks_valid_token_next_to_marketing_and_foreign_qr(client: TestClient):
+    good = build_token(_payload("tx_good"), secret="dev-secret")
+    foreign = build_token(_payload("tx_foreign"), secret="someone-elses-secret")
+    png = _make_multi_qr_png_bytes(["https://example.com/promo", foreign, good])
+
+    r = client.post("/api/pos/qr/verify", files={"receipt": ("multi.png", png, "image/png")})
+    assert r.status_code == 200, r.text
+    body = r.json()
+    assert body["valid"] is True
+    assert body["decoded_text"] == good
+    assert body["payload"]["transaction_id"] == "tx_good"
+    assert body["candidate_index"] is not None and body["candidates"] >= 1
+
+
+def test_analyze_accepts_receipt_with_marketing_qr(client: TestClient):
+    good = build_token(_payload("tx_analyze"), secret="dev-secret")
+    png = _make_multi_qr_png_bytes(["https://example.com/promo", good])
+
+    r = client.post("/api/receipt/analyze", files={"receipt": ("multi.png", png, "image/png")})
+    assert r.status_code == 200, r.text
+    assert r.json()["pos_qr_payload"]["transaction_id"] == "tx_analyze"
+
+
+def test_verify_token_candidates_stops_at_first_valid_and_marks_only_it():
+    secrets = {"demo": "dev-secret"}
+    store = NonceStore(ttl_seconds=60)
+    bad = build_token(_payload("a"), secret="wrong")
+    good = build_token(_payload("b"), secret="dev-secret")
+    later = build_token(_payload("c"), secret="dev-secret")
+
+    outcome = verify_token_candidates([bad, good, later], secrets, store, 60, 60)
+    assert outcome.valid and outcome.candidate_index == 1 and outcome.candidates_tried == 2
+    # The untried candidate's nonce is still fresh.
+    assert store.check_and_mark("demo", "nonce_c")
+
+    outcome = verify_token_candidates([bad], secrets, store, 60, 60)
+    assert not outcome.valid and outcome.reason == "bad_signature" and outcome.candidate_index == 0
+
+    assert verify_token_candidates([], secrets, store, 60, 60).reason == "no_candidates"
+
+
+def test_verify_uses_tenant_region_hint(client: TestClient, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv("POS_QR_REGION_HINTS", json.dumps({"demo": "right:0.5"}))
+    good = build_token(_payload("tx_hinted"), secret="dev-secret")
+    png = _make_multi_qr_png_bytes(["https://example.com/promo", good])
+
+    r = client.post(
+        "/api/pos/qr/verify",
+        files={"receipt": ("hinted.png", png, "image/png")},
+        headers={"X-POS-Tenant": "demo"},
+    )
+    assert r.status_code == 200, r.text
+    body = r.json()
+    assert body["valid"] is True
+    assert body["decode_stage"].startswith("region0/")
+
+
+def test_region_hints_are_parsed_once_per_env_value(monkeypatch: pytest.MonkeyPatch):
+    parse_region_hints.cache_clear()
+    monkeypatch.setenv("POS_QR_REGION_HINTS", json.dumps({"demo": "right:0.5", "bad": 1}))
+    assert get_pos_qr_region_hints() == {"demo": "right:0.5"}
+    assert get_pos_qr_region_hints() is get_pos_qr_region_hints()
+    assert parse_region_hints.cache_info().misses == 1
+
+    monkeypatch.setenv("POS_QR_REGION_HINTS", json.dumps({"*": "bottom:0.25"}))
+    assert get_pos_qr_region_hints() == {"*": "bottom:0.25"}
+
+
+def test_verify_counts_the_fallback_text_as_a_candidate(client: TestClient):
+    png = _make_multi_qr_png_bytes(["https://example.com/promo"])
+
+    body = client.post("/api/pos/qr/verify", files={"receipt": ("promo.png", png, "image/png")}).json()
+    assert body["valid"] is False
+    assert body["candidates"] == 1 and body["candidate_index"] == 0
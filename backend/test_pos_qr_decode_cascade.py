@@ -0,0 +1,143 @@
+from io import BytesIO
+from pathlib import Path
+
+import qrcode
+from PIL import Image
+
+from app.pos_qr import build_token, decode_qr, decode_qr_texts, is_token_text, parse_region_hint
+
+
+FIXTURES = Path(__file__).resolve().parents[0] / "fixtures"
+
+
+def _make_png_bytes(text: str) -> bytes:
+    qr_img = qrcode.make(text).convert("RGB").resize((520, 520), resample=Image.Resampling.NEAREST)
+    canvas = Image.new("RGB", (800, 800), color="white")
+    canvas.paste(qr_img, (140, 140))
+    buf = BytesIO()
+    canvas.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def test_decode_stops_at_first_stage_with_token():
+    data = (FIXTURES / "demo_pos_qr_receipt.png").read_bytes()
+    result = decode_qr(data)
+
+    assert result.texts and is_token_text(result.texts[0])
+    assert result.stage == result.stages_tried[-1]
+    # Nothing past the winning stage was built or decoded.
+    assert not any("_x" in s for s in result.stages_tried)
+    assert set(result.timings_ms) == set(result.stages_tried)
+
+
+def test_non_token_qr_does_not_stop_the_cascade():
+    result = decode_qr(_make_png_bytes("https://example.com/promo"))
+
+    assert result.texts == ["https://example.com/promo"]
+    assert result.stage == result.stages_tried[0]
+    assert len(result.stages_tried) > 1
+
+
+def test_blank_image_tries_every_stage_and_reports_no_stage():
+    img = Image.new("RGB", (64, 64), color="white")
+    buf = BytesIO()
+    img.save(buf, format="PNG")
+
+    result = decode_qr(buf.getvalue())
+    assert result.texts == []
+    assert result.stage is None
+    assert decode_qr_texts(buf.getvalue()) == []
+
+
+def test_is_token_text_rejects_prefix_only():
+    assert not is_token_text("TSQR1.not-base64!.x")
+    assert not is_token_text("hello")
+
+
+def _make_large_photo_bytes(text: str, size=(2400, 1800), qr_side=300) -> bytes:
+    qr_img = qrcode.make(text).convert("RGB").resize((qr_side, qr_side))
+    canvas = Image.new("RGB", size, color="white")
+    canvas.paste(qr_img, (size[0] - qr_side - 200, size[1] - qr_side - 150))
+    buf = BytesIO()
+    canvas.save(buf, format="JPEG", quality=90)
+    return buf.getvalue()
+
+
+def test_pyramid_decodes_located_crop_of_large_photo():
+    token = build_token({"tenant_id": "demo", "transaction_id": "t", "timestamp": 1, "nonce": "n"}, "s")
+    result = decode_qr(_make_large_photo_bytes(token), pyramid=True, reduced=False)
+
+    assert result.texts == [token]
+    assert result.stage.startswith("pyramid")
+    assert not any("_x" in s for s in result.stages_tried)
+
+
+def test_pyramid_is_skipped_for_small_images():
+    result = decode_qr(_make_png_bytes("https://example.com/promo"), pyramid=True)
+    assert not any(s.startswith("pyramid") for s in result.stages_tried)
+
+
+def test_large_jpeg_decodes_from_reduced_scale_first():
+    token = build_token({"tenant_id": "demo", "transaction_id": "t", "timestamp": 1, "nonce": "n"}, "s")
+    data = _make_large_photo_bytes(token, size=(3200, 2400), qr_side=600)
+
+    result = decode_qr(data, reduced=True)
+    assert result.texts == [token]
+    assert result.stage.startswith("reduced2/")
+    assert all(s.startswith("reduced") for s in result.stages_tried)
+
+    result = decode_qr(data, reduced=False)
+    assert result.texts == [token]
+    assert not any(s.startswith("reduced") for s in result.stages_tried)
+
+
+def test_reduced_scale_falls_back_to_full_resolution(monkeypatch):
+    from app import qr_detectors
+
+    token = build_token({"tenant_id": "demo", "transaction_id": "t", "timestamp": 1, "nonce": "n"}, "s")
+
+    class FullResolutionOnly:
+        # Stands in for a detector that cannot read the code at reduced scale.
+        def decode(self, arr):
+            return [token] if max(arr.shape) >= 2400 else []
+
+        def locate(self, arr):
+            return []
+
+    monkeypatch.setattr(qr_detectors, "_BACKENDS", dict(qr_detectors._BACKENDS))
+    qr_detectors.register_backend("full_only", FullResolutionOnly)
+
+    data = _make_large_photo_bytes(token, size=(2400, 1800), qr_side=200)
+    result = decode_qr(data, reduced=True, backends=["full_only"])
+    assert result.texts == [token]
+    assert result.stages_tried[0].startswith("reduced2/")
+    assert result.stage == "gray@full_only"
+
+
+def test_parse_region_hint():
+    assert parse_region_hint("bottom:0.25") == (0.0, 0.75, 1.0, 0.25)
+    assert parse_region_hint(" Right:0.5 ") == (0.5, 0.0, 0.5, 1.0)
+    assert parse_region_hint("0.5,0.5,0.8,0.8") == (0.5, 0.5, 0.5, 0.5)
+    for bad in ("", "middle:0.3", "bottom:x", "0.1,0.2,0.3", "0,0,0,1", "1.2,0,0.1,0.1"):
+        assert parse_region_hint(bad) is None
+
+
+def test_region_hint_is_searched_first():
+    token = build_token({"tenant_id": "demo", "transaction_id": "t", "timestamp": 1, "nonce": "n"}, "s")
+    data = _make_large_photo_bytes(token)
+
+    result = decode_qr(data, reduced=False, region=parse_region_hint("bottom:0.25"))
+    assert result.texts == [token]
+    assert result.stage.startswith("region0/")
+    assert all(s.startswith("region0/") for s in result.stages_tried)
+
+
+def test_misplaced_region_hint_widens_then_scans_whole_frame():
+    token = build_token({"tenant_id": "demo", "transaction_id": "t", "timestamp": 1, "nonce": "n"}, "s")
+    data = _make_large_photo_bytes(token)
+
+    result = decode_qr(data, reduced=False, region=parse_region_hint("top:0.25"))
+    assert result.texts == [token]
+    tried = {s.split("/")[0] for s in result.stages_tried if "/" in s}
+    assert tried == {"region0", "region1", "region2"}
+    assert not result.stage.startswith("region")
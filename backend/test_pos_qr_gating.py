@@ -83,3 +83,28 @@ def test_analyze_receipt_requires_qr_header_accepts_valid_qr(client: TestClient)
     body = r.json()
     assert "merchant" in body
     assert "total" in body
+
+
+def test_analyze_receipt_accepts_scanned_token_without_qr_in_image(client: TestClient):
+    from PIL import Image
+
+    payload = {"tenant_id": "demo", "transaction_id": "tx_scan_1", "timestamp": int(time.time()), "nonce": "nonce_scan_1"}
+    token = build_token(payload, secret="dev-secret")
+    buf = BytesIO()
+    Image.new("RGB", (256, 256), color="white").save(buf, format="PNG")
+
+    r = client.post(
+        "/api/receipt/analyze",
+        files={"receipt": ("blank.png", buf.getvalue(), "image/png")},
+        data={"pos_qr_token": token},
+    )
+    assert r.status_code == 200, r.text
+    assert r.json()["pos_qr_verified"] is True
+
+    # Same nonce store as the image path.
+    r = client.post(
+        "/api/receipt/analyze",
+        files={"receipt": ("blank.png", buf.getvalue(), "image/png")},
+        data={"pos_qr_token": token},
+    )
+    assert r.status_code == 409
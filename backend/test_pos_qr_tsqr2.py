@@ -0,0 +1,103 @@
+import base64
+import json
+import time
+from io import BytesIO
+
+import pytest
+import qrcode
+from fastapi.testclient import TestClient
+
+from app import compact_token
+from app.main import app
+from app.pos_qr import build_token, check_token, is_token_text, parse_token
+
+
+SECRETS = {"demo": "dev-secret"}
+
+
+def _payload(**extra) -> dict:
+    payload = {
+        "tenant_id": "demo",
+        "transaction_id": "tx_gold_1",
+        "timestamp": int(time.time()),
+        "nonce": "nonce_merchant_gold_2b448de48732",
+        "actor_role": "merchant",
+        "profile_id": "merchant_gold",
+        "merchant_id": "m_gold_001",
+        "plan_id": "plan_plus_12m",
+        "amount_cents": 7999,
+        "currency": "USD",
+    }
+    payload.update(extra)
+    return payload
+
+
+def test_tsqr2_round_trips_and_is_much_shorter():
+    payload = _payload()
+    v1 = build_token(payload, "dev-secret")
+    v2 = build_token(payload, "dev-secret", prefix="TSQR2")
+
+    assert v2.startswith("TSQR2.") and len(v2) < 0.6 * len(v1)
+    # Stays inside the QR alphanumeric character set.
+    assert set(v2) <= set("0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ $%*+-./:")
+    assert parse_token(v2)[0] == payload
+    assert check_token(v2, SECRETS, 3600, 60) == (True, "ok", payload)
+    assert check_token(v1, SECRETS, 3600, 60)[1] == "ok"
+    assert is_token_text(v2)
+
+
+def test_tsqr2_hex_nonce_packs_raw_and_adds_no_fields():
+    payload = {"tenant_id": "demo", "timestamp": int(time.time()), "nonce": "a1b2c3d4e5f60718"}
+    token = build_token(payload, "dev-secret", prefix="TSQR2", mac_bytes=8)
+    assert parse_token(token)[0] == payload  # nothing unsigned is filled in
+    assert check_token(token, SECRETS, 3600, 60)[1] == "ok"
+    # A trailing newline is not hex: the nonce is kept as text.
+    newline = compact_token.pack({**payload, "nonce": "a1b2c3d4\n"})
+    assert not newline[1] & compact_token.F_NONCE_HEX
+
+
+@pytest.mark.parametrize(
+    "extra, reason",
+    [
+        ({"amount_cents": 12.5}, "tsqr2_bad_amount"),
+        ({"amount_cents": "1299"}, "tsqr2_bad_amount"),
+        ({"actor_role": "admin"}, "tsqr2_bad_role"),
+        ({"timestamp": -1}, "tsqr2_bad_timestamp"),
+        ({"timestamp": 1 << 32}, "tsqr2_bad_timestamp"),
+    ],
+)
+def test_tsqr2_rejects_unpackable_fields(extra: dict, reason: str):
+    with pytest.raises(ValueError, match=f"^{reason}$"):
+        compact_token.pack(_payload(**extra))
+
+
+def test_tsqr2_rejects_tampering_and_mac_shortening():
+    token = build_token(_payload(), "dev-secret", prefix="TSQR2", mac_bytes=16)
+    blob = bytearray(base64.b32decode(token[6:] + "=" * (-len(token[6:]) % 8)))
+
+    tampered = bytearray(blob)
+    tampered[-20] ^= 0x01  # inside the packed fields
+    assert check_token("TSQR2." + base64.b32encode(bytes(tampered)).decode().rstrip("="), SECRETS, 3600, 60)[1] == "bad_signature"
+
+    # Claim an 8-byte MAC and keep the first 8 bytes: the length is signed.
+    shortened = bytearray(blob[:-8])
+    shortened[0] = compact_token.LAYOUT_REV << 6 | 8
+    assert check_token("TSQR2." + base64.b32encode(bytes(shortened)).decode().rstrip("="), SECRETS, 3600, 60)[1] == "bad_signature"
+
+    with pytest.raises(ValueError):
+        build_token(_payload(), "dev-secret", prefix="TSQR2", mac_bytes=4)
+    assert check_token("TSQR2.!!!!", SECRETS, 3600, 60)[1] == "invalid_token_format"
+
+
+def test_verify_endpoint_accepts_tsqr2_qr(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv("POS_TENANT_SECRETS", json.dumps(SECRETS))
+    monkeypatch.setenv("POS_QR_NONCE_TTL_SECONDS", "3600")
+    token = build_token(_payload(nonce=f"{time.time_ns():016x}"), "dev-secret", prefix="TSQR2")
+    buf = BytesIO()
+    qrcode.make(token).save(buf, format="PNG")
+
+    r = TestClient(app).post("/api/pos/qr/verify", files={"receipt": ("v2.png", buf.getvalue(), "image/png")})
+    assert r.status_code == 200, r.text
+    body = r.json()
+    assert body["valid"] is True and body["decoded_text"] == token
+    assert body["payload"]["profile_id"] == "merchant_gold"
@@ -1,3 +1,6 @@
+import base64
+import hashlib
+import hmac
 import json
 import time
 from io import BytesIO
@@ -7,7 +10,7 @@ import qrcode
 from fastapi.testclient import TestClient
 
 from app.main import app
-from app.pos_qr import build_token
+from app.pos_qr import MAX_TOKEN_CHARS, build_token, check_token
 
 
 @pytest.fixture()
@@ -74,3 +77,76 @@ def test_pos_qr_verify_no_qr_found(client: TestClient):
     )
     assert r.status_code == 400
     assert "No QR code" in r.text
+
+
+def _sign_raw(payload_json: bytes, secret: str) -> str:
+    # Sign exactly these bytes, the way a non-Python POS might.
+    sig = hmac.new(secret.encode("utf-8"), payload_json, hashlib.sha256).digest()
+    enc = lambda b: base64.urlsafe_b64encode(b).decode("ascii").rstrip("=")  # noqa: E731
+    return f"TSQR1.{enc(payload_json)}.{enc(sig)}"
+
+
+def test_check_token_verifies_raw_payload_bytes():
+    ts = int(time.time())
+    raw = f'{{ "nonce": "n1",  "tenant_id" : "demo", "timestamp": {ts} }}'.encode("utf-8")
+    valid, reason, payload = check_token(_sign_raw(raw, "dev-secret"), {"demo": "dev-secret"}, 3600, 60)
+    assert (valid, reason) == (True, "ok")
+    assert payload["nonce"] == "n1"
+
+
+def test_check_token_rejects_before_parsing():
+    secrets = {"demo": "dev-secret"}
+    ts = int(time.time())
+    token = build_token({"tenant_id": "demo", "nonce": "n", "timestamp": ts}, "dev-secret")
+    prefix, body, sig = token.split(".")
+    tampered = _sign_raw(b'{"tenant_id":"demo","nonce":"m","timestamp":%d}' % ts, "wrong")
+
+    assert check_token(tampered, secrets, 3600, 60) == (False, "bad_signature", None)
+    assert check_token(f"{prefix}.{body}.{sig[:-4]}", secrets, 3600, 60)[1] == "bad_signature"
+    assert check_token("TSQR1." + "A" * MAX_TOKEN_CHARS + ".x", secrets, 3600, 60)[1] == "token_too_large"
+    assert check_token("TSQR1.@@@.x", secrets, 3600, 60)[1] == "invalid_token_format"
+
+
+def test_check_token_rejects_tenant_mismatch():
+    # The key is chosen by the first tenant_id; the parsed payload keeps the last.
+    raw = b'{"tenant_id":"demo","nonce":"n","timestamp":%d,"tenant_id":"other"}' % int(time.time())
+    secrets = {"demo": "dev-secret", "other": "other-secret"}
+    assert check_token(_sign_raw(raw, "dev-secret"), secrets, 3600, 60) == (False, "tenant_mismatch", None)
+
+    # Same for the key id: the key that signed must be the one the payload names.
+    raw = b'{"kid":"k1","tenant_id":"demo","nonce":"n","timestamp":%d,"kid":"k2"}' % int(time.time())
+    secrets = {"demo": {"active": "k1", "keys": {"k1": "dev-secret", "k2": "other-secret"}}}
+    assert check_token(_sign_raw(raw, "dev-secret"), secrets, 3600, 60) == (False, "key_mismatch", None)
+
+
+def test_check_token_finds_tenant_key_not_a_value_spelling_it():
+    # Keys are sorted, so merchant_id's value comes before the tenant_id key.
+    payload = {"tenant_id": "demo", "nonce": "tenant_id", "timestamp": int(time.time()), "merchant_id": "tenant_id"}
+    token = build_token(payload, "dev-secret")
+    assert check_token(token, {"demo": "dev-secret"}, 3600, 60) == (True, "ok", payload)
+    nested = b'{"extra":{"tenant_id":"other"},"nonce":"n","tenant_id":"demo","timestamp":%d}' % int(time.time())
+    assert check_token(_sign_raw(nested, "dev-secret"), {"demo": "dev-secret"}, 3600, 60)[1] == "ok"
+
+
+def test_token_endpoint_verifies_without_an_image(client: TestClient):
+    payload = {"tenant_id": "demo", "transaction_id": "tx_tok", "timestamp": int(time.time()), "nonce": "nonce_tok_1"}
+    token = build_token(payload, secret="dev-secret")
+
+    r1 = client.post("/api/pos/qr/verify/token", json={"token": token})
+    assert r1.status_code == 200
+    assert r1.json()["valid"] is True and r1.json()["decoded_text"] == token
+
+    r2 = client.post("/api/pos/qr/verify/token", json={"token": token})
+    assert r2.status_code == 409 and r2.json()["reason"] == "replay"
+
+
+def test_tokens_endpoint_verifies_each_token(client: TestClient):
+    now = int(time.time())
+    good = build_token({"tenant_id": "demo", "transaction_id": "a", "timestamp": now, "nonce": "nonce_tok_2"}, "dev-secret")
+    forged = build_token({"tenant_id": "demo", "transaction_id": "b", "timestamp": now, "nonce": "nonce_tok_3"}, "nope")
+
+    r = client.post("/api/pos/qr/verify/tokens", json={"tokens": [good, forged, good, "hello"]})
+    assert r.status_code == 200
+    body = r.json()
+    assert [x["reason"] for x in body["results"]] == ["ok", "bad_signature", "replay", "invalid_token_format"]
+    assert body["valid"] == 1
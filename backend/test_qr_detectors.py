@@ -0,0 +1,52 @@
+import threading
+from pathlib import Path
+
+from app import qr_detectors
+from app.pos_qr import decode_qr
+from app.qr_detectors import available_backends, backend_order, get_detector, register_backend
+
+
+FIXTURE = Path(__file__).resolve().parents[0] / "fixtures" / "demo_pos_qr_receipt.png"
+
+
+def test_detectors_are_reused_per_thread():
+    first = get_detector("classic")
+    assert get_detector("classic") is first
+
+    other: list = []
+    t = threading.Thread(target=lambda: other.append(get_detector("classic")))
+    t.start()
+    t.join()
+    assert other and other[0] is not first
+
+
+def test_backend_order_skips_unknown_and_falls_back_to_available():
+    assert backend_order("nope,classic,classic") == ["classic"]
+    assert backend_order("nope") == available_backends()
+
+
+def test_registered_backend_is_used_by_decode_qr(monkeypatch):
+    calls: list[int] = []
+
+    class Fake:
+        def decode(self, arr):
+            calls.append(1)
+            return ["TSQR1.e30.c2ln"]
+
+        def locate(self, arr):
+            return []
+
+    monkeypatch.setattr(qr_detectors, "_BACKENDS", dict(qr_detectors._BACKENDS))
+    register_backend("fake", Fake)
+
+    result = decode_qr(FIXTURE.read_bytes(), backends=["fake"])
+    assert result.texts == ["TSQR1.e30.c2ln"]
+    assert result.stage.endswith("@fake")
+    assert calls == [1]
+
+
+def test_each_available_backend_decodes_fixture():
+    data = FIXTURE.read_bytes()
+    for name in available_backends():
+        result = decode_qr(data, backends=[name])
+        assert result.texts and result.texts[0].startswith("TSQR1."), name
@@ -0,0 +1,135 @@
+import asyncio
+import functools
+import json
+import os
+import pickle
+import time
+from pathlib import Path
+
+import pytest
+
+from app.image_executor import ImageExecutor
+from app.pos_qr import build_token, check_token, decode_qr, token_passes_checks
+from app.tenant_keys import TenantKeyRegistry, get_tenant_keys, parse_keyring, signing_key
+
+
+FIXTURE = Path(__file__).resolve().parents[0] / "fixtures" / "demo_pos_qr_receipt.png"
+
+
+def _token(tenant: str, secret: str) -> str:
+    return build_token({"tenant_id": tenant, "nonce": "n", "timestamp": int(time.time())}, secret)
+
+
+def _write_keys(path: Path, secrets: dict) -> None:
+    # Atomic replace, as a deploy would do it.
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(secrets), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def test_registry_loads_file_and_reloads_on_change(tmp_path: Path):
+    path = tmp_path / "tenants.json"
+    _write_keys(path, {"demo": "dev-secret"})
+    keys = TenantKeyRegistry(path=str(path), check_interval=0)
+
+    assert "demo" in keys and len(keys) == 1
+    assert check_token(_token("demo", "dev-secret"), keys, 3600, 60)[1] == "ok"
+
+    _write_keys(path, {"demo": "rotated", "acme": "acme-secret"})
+    assert check_token(_token("demo", "dev-secret"), keys, 3600, 60)[1] == "bad_signature"
+    assert check_token(_token("acme", "acme-secret"), keys, 3600, 60)[1] == "ok"
+    assert keys.reloads == 2
+
+    # A broken file keeps serving the last good table.
+    path.write_text("{not json", encoding="utf-8")
+    assert sorted(keys) == ["acme", "demo"]
+
+
+def test_registry_falls_back_to_env_and_reparses_only_on_change(monkeypatch: pytest.MonkeyPatch, tmp_path: Path):
+    monkeypatch.setenv("POS_TENANT_SECRETS", json.dumps({"demo": "dev-secret"}))
+    keys = TenantKeyRegistry(path=str(tmp_path / "missing.json"), check_interval=0)
+
+    assert list(keys) == ["demo"]
+    assert len(keys) == 1 and keys.reloads == 1
+
+    monkeypatch.setenv("POS_TENANT_SECRETS", json.dumps({"other": "x"}))
+    assert list(keys) == ["other"] and keys.reloads == 2
+
+
+def test_mac_for_returns_independent_copies():
+    keys = TenantKeyRegistry.from_secrets({"demo": "dev-secret"})
+    (a, _), (b, _) = keys.mac_for("demo"), keys.mac_for("demo")
+    a.update(b"x")
+    assert a.digest() != b.digest()
+    assert keys.mac_for("nobody") == (None, "unknown_tenant")
+
+
+def test_keyring_rotation_selects_key_by_kid(tmp_path: Path):
+    path = tmp_path / "tenants.json"
+    # Mid-rotation: k2 signs new receipts, k1 still verifies old ones (which
+    # carry no kid) until it is retired.
+    _write_keys(path, {"demo": {"active": "k2", "default": "k1", "keys": {"k1": "old-secret", "k2": "new-secret"}}})
+    keys = TenantKeyRegistry(path=str(path), check_interval=0)
+    payload = {"tenant_id": "demo", "nonce": "n", "timestamp": int(time.time())}
+
+    for prefix in ("TSQR1", "TSQR2"):
+        assert check_token(build_token(payload, "new-secret", prefix=prefix, kid="k2"), keys, 3600, 60)[1] == "ok"
+        assert check_token(build_token(payload, "old-secret", prefix=prefix, kid="k1"), keys, 3600, 60)[1] == "ok"
+        assert check_token(build_token(payload, "old-secret", prefix=prefix), keys, 3600, 60)[1] == "ok"
+        # Signed with the wrong key for the kid it names: no fallback to other keys.
+        assert check_token(build_token(payload, "old-secret", prefix=prefix, kid="k2"), keys, 3600, 60)[1] == "bad_signature"
+        assert check_token(build_token(payload, "x", prefix=prefix, kid="k9"), keys, 3600, 60)[1] == "unknown_key"
+    ok, _, parsed = check_token(build_token(payload, "new-secret", prefix="TSQR2", kid="k2"), keys, 3600, 60)
+    assert ok and parsed["kid"] == "k2"
+
+    _write_keys(path, {"demo": {"active": "k2", "keys": {"k1": "old-secret", "k2": "new-secret"}, "retire_after": {"k1": 1}}})
+    assert check_token(build_token(payload, "old-secret", kid="k1"), keys, 3600, 60)[1] == "key_retired"
+    # Tokens without a kid now verify against the active key.
+    assert check_token(build_token(payload, "new-secret"), keys, 3600, 60)[1] == "ok"
+
+
+def test_keyring_kid_is_not_confused_with_a_value_spelling_it():
+    # "currency" sorts before "kid": its value must not be read as the key id.
+    keyring = {"demo": {"active": "k2", "default": "k1", "keys": {"k1": "old-secret", "k2": "new-secret"}}}
+    payload = {"tenant_id": "demo", "nonce": "n", "timestamp": int(time.time()), "currency": "kid"}
+    ok, reason, parsed = check_token(build_token(payload, "new-secret", kid="k2"), keyring, 3600, 60)
+    assert (ok, reason, parsed["kid"]) == (True, "ok", "k2")
+
+
+def test_keyring_parsing_and_signing_key():
+    assert parse_keyring({"keys": {"k1": "s"}}).active == "k1"
+    assert parse_keyring({"keys": {"k1": "s", "k2": "t"}}) is None  # active is ambiguous
+    assert parse_keyring({"active": "k3", "keys": {"k1": "s"}}) is None
+    assert signing_key("dev-secret") == ("", "dev-secret")
+    assert signing_key({"active": "k2", "keys": {"k1": "s", "k2": "t"}}) == ("k2", "t")
+    assert signing_key({"active": "k2", "keys": {"k1": "s", "k2": "t"}}, "k1") == ("k1", "s")
+    with pytest.raises(ValueError):
+        signing_key("dev-secret", "k1")
+    # A plain mapping accepts the same keyring entries as the registry.
+    payload = {"tenant_id": "demo", "nonce": "n", "timestamp": int(time.time())}
+    assert check_token(build_token(payload, "t", kid="k2"), {"demo": {"active": "k2", "keys": {"k2": "t"}}}, 3600, 60)[1] == "ok"
+    assert check_token(build_token(payload, "dev-secret", kid="k1"), {"demo": "dev-secret"}, 3600, 60)[1] == "unknown_key"
+
+
+def test_registry_pickles_configuration_not_keys(tmp_path: Path):
+    keys = TenantKeyRegistry(path=str(tmp_path / "k.json"), check_interval=5)
+    clone = pickle.loads(pickle.dumps(keys))
+    assert (clone.path, clone.check_interval) == (keys.path, 5)
+    assert pickle.loads(pickle.dumps(get_tenant_keys())) is get_tenant_keys()
+
+
+def test_process_worker_accept_uses_its_own_registry(monkeypatch: pytest.MonkeyPatch):
+    secret = json.loads(FIXTURE.with_suffix(".payload.json").read_text())["secret"]
+    # Spawned workers inherit this env and build their own registry from it.
+    monkeypatch.setenv("POS_TENANT_SECRETS", json.dumps({"demo": secret}))
+    accept = functools.partial(
+        token_passes_checks, tenant_secrets=get_tenant_keys(), max_age_seconds=10**10, max_future_skew_seconds=60
+    )
+    executor = ImageExecutor(mode="process", max_workers=1)
+    executor.start()
+    try:
+        result = asyncio.run(executor.run(decode_qr, FIXTURE.read_bytes(), accept=accept))
+    finally:
+        executor.shutdown()
+    # The cascade only stops early once ``accept`` passed in the worker.
+    assert result.tokens and result.stage == result.stages_tried[-1]
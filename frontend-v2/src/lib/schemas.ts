@@ -18,6 +18,8 @@ export const receiptSchema = z.object({
   confidence: z.number().min(0).max(1).default(0.5),
   eligibility: z.enum(['APPROVED', 'DENIED', 'PENDING']).default('PENDING'),
   raw_text: z.string().nullable().optional(),
+  receipt_id: z.string().nullable().optional(),
+  ocr_deferred: z.boolean().optional(),
 
   pos_qr_verified: z.boolean().default(false),
   pos_qr_reason: z.string().nullable().optional(),
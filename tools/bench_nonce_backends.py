@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""Contention benchmark for nonce backends shared by several worker processes.
+
+Starts N worker processes (like ``gunicorn -w N``), each with its own
+backend instance, and has them check-and-mark overlapping nonce sets: every
+nonce is tried by two workers, so exactly one of the two must win. Reports
+aggregate checks/s, per-check latency and how many replays got through
+(accepted minus unique nonces; must be 0 for a cross-process backend).
+
+The ``memory`` backend is included as the baseline: it is fast but private
+to each process, so it lets every cross-worker replay through.
+
+  python tools/bench_nonce_backends.py
+  python tools/bench_nonce_backends.py --workers 1,4,8,16 --checks 20000 --json contention.json
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict
+
+# Allow running from repo root
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "backend"))
+
+from app.nonce_store import NonceStore, SqliteNonceStore  # noqa: E402
+
+
+def _make(backend: str, path: str):
+    if backend == "sqlite":
+        return SqliteNonceStore(path, ttl_seconds=900)
+    return NonceStore(ttl_seconds=900)
+
+
+def _worker(backend: str, path: str, index: int, checks: int, unique: int, start_at: float) -> Dict[str, Any]:
+    sys.path.insert(0, str(ROOT / "backend"))
+    store = _make(backend, path)
+    store.check_and_mark("warmup", f"{os.getpid()}")  # open the connection before the clock starts
+    nonces = [f"n{(index * (checks // 2) + j) % unique}" for j in range(checks)]
+    while time.time() < start_at:
+        time.sleep(0.001)
+
+    samples: list[float] = []
+    accepted = 0
+    started = time.time()
+    for nonce in nonces:
+        t0 = time.perf_counter()
+        accepted += store.check_and_mark("demo", nonce)
+        samples.append(time.perf_counter() - t0)
+    ended = time.time()
+    store.close()
+    return {"accepted": accepted, "started": started, "ended": ended, "samples": samples}
+
+
+def _run(backend: str, workers: int, checks: int) -> Dict[str, Any]:
+    path = os.path.join(tempfile.mkdtemp(prefix="tapsure-nonces-"), "nonces.sqlite3")
+    unique = max(1, workers * checks // 2)
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        start_at = time.time() + 1.0 + 0.2 * workers  # leaves time for every worker to spawn
+        futures = [pool.submit(_worker, backend, path, i, checks, unique, start_at) for i in range(workers)]
+        results = [f.result() for f in futures]
+
+    samples = sorted(s for r in results for s in r["samples"])
+    wall = max(r["ended"] for r in results) - min(r["started"] for r in results)
+    accepted = sum(r["accepted"] for r in results)
+    return {
+        "backend": backend,
+        "workers": workers,
+        "checks": len(samples),
+        "checks_per_s": round(len(samples) / wall) if wall > 0 else 0,
+        "p50_us": round(samples[len(samples) // 2] * 1e6, 1),
+        "p99_us": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1e6, 1),
+        "max_us": round(samples[-1] * 1e6, 1),
+        "unique_nonces": unique,
+        "replays_accepted": accepted - unique,
+    }
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Benchmark nonce backends under multi-process contention")
+    ap.add_argument("--workers", default="1,2,4,8,16", help="Comma-separated worker process counts")
+    ap.add_argument("--checks", type=int, default=5000, help="Checks per worker")
+    ap.add_argument("--backends", default="memory,sqlite", help="Comma-separated backends to run")
+    ap.add_argument("--json", default="", help="Optional path to write the report as JSON")
+    args = ap.parse_args()
+
+    rows: list[Dict[str, Any]] = []
+    for backend in [b.strip() for b in args.backends.split(",") if b.strip()]:
+        for workers in [int(w) for w in args.workers.split(",") if w.strip()]:
+            row = _run(backend, workers, max(2, args.checks))
+            rows.append(row)
+            print(
+                f"{backend:>7}  workers={workers:>3}  {row['checks_per_s']:>8}/s  p50={row['p50_us']:.1f}us  "
+                f"p99={row['p99_us']:.1f}us  max={row['max_us']:.0f}us  replays_accepted={row['replays_accepted']}"
+            )
+
+    if args.json:
+        Path(args.json).write_text(json.dumps({"results": rows}, indent=2), encoding="utf-8")
+        print(f"Wrote: {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""Benchmark the nonce journal: request-path cost and warm-restart time.
+
+Marks N nonces in an in-memory store with and without a journal (reporting
+per-check latency; journal writes happen on the writer thread), closes it,
+then times a restart: reading the journal back and restoring the unexpired
+entries, which is what startup waits for before serving.
+
+  python tools/bench_nonce_journal.py
+  python tools/bench_nonce_journal.py --entries 1000000,2000000 --json journal.json
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+# Allow running from repo root
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "backend"))
+
+from app.nonce_journal import NonceJournal  # noqa: E402
+from app.nonce_store import NonceStore  # noqa: E402
+
+
+def _mark(entries: int, journal: Optional[NonceJournal]) -> Dict[str, Any]:
+    store = NonceStore(ttl_seconds=3600, max_entries=0, journal=journal)
+    samples: list[float] = []
+    started = time.perf_counter()
+    for i in range(entries):
+        t0 = time.perf_counter()
+        store.check_and_mark(f"tenant{i % 8}", f"nonce-{i:012d}")
+        samples.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - started
+    store.close()
+    samples.sort()
+    return {
+        "checks_per_s": round(entries / elapsed) if elapsed > 0 else 0,
+        "p50_us": round(statistics.median(samples) * 1e6, 2),
+        "p99_us": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1e6, 2),
+        "commits": journal.commits if journal is not None else 0,
+    }
+
+
+def _run(entries: int) -> Dict[str, Any]:
+    path = os.path.join(tempfile.mkdtemp(prefix="tapsure-journal-"), "nonces.journal")
+    plain = _mark(entries, None)
+    # compact_min_records above N: measure the append-only file as a crash would leave it.
+    journaled = _mark(entries, NonceJournal(path, compact_min_records=entries * 4))
+
+    started = time.perf_counter()
+    journal = NonceJournal(path)
+    store = NonceStore(ttl_seconds=3600, max_entries=0, journal=journal)
+    restart = time.perf_counter() - started
+    restored = len(store)
+    store.close()
+    return {
+        "entries": entries,
+        "file_mb": round(os.path.getsize(path) / 1e6, 1),
+        "plain": plain,
+        "journaled": journaled,
+        "restored": restored,
+        "read_s": round(journal.load_seconds, 3),
+        "restart_s": round(restart, 3),
+        "restart_s_per_million": round(restart * 1e6 / entries, 3),
+    }
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Benchmark nonce journal appends and warm restart")
+    ap.add_argument("--entries", default="100000,1000000", help="Comma-separated journal sizes")
+    ap.add_argument("--json", default="", help="Optional path to write the report as JSON")
+    args = ap.parse_args()
+
+    rows: list[Dict[str, Any]] = []
+    for entries in [int(n) for n in args.entries.split(",") if n.strip()]:
+        row = _run(entries)
+        rows.append(row)
+        print(
+            f"entries={entries:>8}  file={row['file_mb']}MB  "
+            f"check p50 plain={row['plain']['p50_us']}us journaled={row['journaled']['p50_us']}us "
+            f"(p99 {row['plain']['p99_us']}/{row['journaled']['p99_us']}us, {row['journaled']['commits']} commits)  "
+            f"restart={row['restart_s']}s (read {row['read_s']}s, {row['restart_s_per_million']}s/M)  restored={row['restored']}"
+        )
+
+    if args.json:
+        Path(args.json).write_text(json.dumps({"results": rows}, indent=2), encoding="utf-8")
+        print(f"Wrote: {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""Benchmark the rotating Bloom pre-filter in front of a nonce backend.
+
+Three measurements:
+
+- memory: bytes per live nonce for the in-memory store (tracemalloc) versus
+  the filter sized for the same window;
+- accuracy: measured false-positive rate for unseen nonces versus the target,
+  with the filter filled to capacity;
+- throughput: fresh-nonce checks/s (plus a replay share) against the sqlite
+  backend directly and through the pre-filter (write-behind batches).
+
+  python tools/bench_nonce_prefilter.py
+  python tools/bench_nonce_prefilter.py --entries 1000000 --fp-rate 0.001 --json prefilter.json
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Dict
+
+# Allow running from repo root
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "backend"))
+
+from app.nonce_filter import RotatingBloomFilter  # noqa: E402
+from app.nonce_store import NonceStore, PrefilteredNonceStore, SqliteNonceStore  # noqa: E402
+
+TTL = 900.0
+
+
+def _memory(entries: int, fp_rate: float) -> Dict[str, Any]:
+    tracemalloc.start()
+    store = NonceStore(ttl_seconds=TTL, max_entries=entries + 1)
+    for i in range(entries):
+        store.check_and_mark("demo", f"nonce-{i:012d}", now=1000.0 + i * TTL / entries)
+    dict_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del store
+
+    bloom = RotatingBloomFilter(capacity=entries, fp_rate=fp_rate, ttl_seconds=TTL)
+    return {
+        "entries": entries,
+        "dict_bytes_per_nonce": round(dict_bytes / entries, 1),
+        "filter_bytes_per_nonce": round(bloom.nbytes / entries, 2),
+        "filter_bytes": bloom.nbytes,
+        "hashes": bloom.hashes,
+    }
+
+
+def _accuracy(entries: int, fp_rate: float) -> Dict[str, Any]:
+    bloom = RotatingBloomFilter(capacity=entries, fp_rate=fp_rate, ttl_seconds=TTL)
+    for i in range(entries):
+        bloom.add_if_absent(f"demo:seen-{i}".encode(), now=1000.0 + i * TTL / entries)
+    probes = min(entries, 200_000)
+    end = 1000.0 + TTL
+    false_hits = sum(bloom.might_contain(f"demo:new-{i}".encode(), now=end) for i in range(probes))
+    return {
+        "target_fp_rate": fp_rate,
+        "measured_fp_rate": round(false_hits / probes, 6),
+        "estimated_fp_rate": round(bloom.estimated_fp_rate(), 6),
+        "probes": probes,
+    }
+
+
+def _throughput(checks: int, replay_share: float, prefilter: bool, fp_rate: float) -> Dict[str, Any]:
+    path = os.path.join(tempfile.mkdtemp(prefix="tapsure-nonces-"), "nonces.sqlite3")
+    store: Any = SqliteNonceStore(path, ttl_seconds=TTL)
+    if prefilter:
+        # The run fits in one generation, which holds capacity / 2 marks.
+        bloom = RotatingBloomFilter(capacity=max(2 * checks, 1000), fp_rate=fp_rate, ttl_seconds=TTL)
+        store = PrefilteredNonceStore(store, bloom)
+    every = int(1 / replay_share) if replay_share > 0 else 0
+    nonces = [f"n{i - 1}" if every and i and i % every == 0 else f"n{i}" for i in range(checks)]
+    store.check_and_mark("warmup", "w")
+
+    accepted = 0
+    started = time.perf_counter()
+    for nonce in nonces:
+        accepted += store.check_and_mark("demo", nonce)
+    elapsed = time.perf_counter() - started
+    stats = store.stats()
+    store.close()
+    return {
+        "mode": "prefiltered" if prefilter else "direct",
+        "checks": checks,
+        "checks_per_s": round(checks / elapsed) if elapsed > 0 else 0,
+        "accepted": accepted,
+        "possible_hits": stats.get("prefilter", {}).get("possible_hits"),
+    }
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Benchmark the nonce Bloom pre-filter")
+    ap.add_argument("--entries", type=int, default=200_000, help="Live nonces for the memory/accuracy runs")
+    ap.add_argument("--fp-rate", type=float, default=0.001, help="Target false-positive rate")
+    ap.add_argument("--checks", type=int, default=50_000, help="Checks for the throughput runs")
+    ap.add_argument("--replay-share", type=float, default=0.01, help="Share of checks that are replays")
+    ap.add_argument("--json", default="", help="Optional path to write the report as JSON")
+    args = ap.parse_args()
+
+    mem = _memory(args.entries, args.fp_rate)
+    print(
+        f"memory    entries={mem['entries']}  dict={mem['dict_bytes_per_nonce']} B/nonce  "
+        f"filter={mem['filter_bytes_per_nonce']} B/nonce ({mem['filter_bytes']} B, k={mem['hashes']})"
+    )
+    acc = _accuracy(args.entries, args.fp_rate)
+    print(
+        f"accuracy  target={acc['target_fp_rate']}  measured={acc['measured_fp_rate']}  "
+        f"estimated={acc['estimated_fp_rate']}  probes={acc['probes']}"
+    )
+    runs = [_throughput(args.checks, args.replay_share, p, args.fp_rate) for p in (False, True)]
+    for row in runs:
+        print(f"{row['mode']:>11}  {row['checks_per_s']:>8}/s  accepted={row['accepted']}  possible_hits={row['possible_hits']}")
+
+    if args.json:
+        Path(args.json).write_text(json.dumps({"memory": mem, "accuracy": acc, "throughput": runs}, indent=2), encoding="utf-8")
+        print(f"Wrote: {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
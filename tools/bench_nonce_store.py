@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""Measure NonceStore check latency as the number of live nonces grows.
+
+Each size is a steady state: the store is pre-filled with ``--live`` nonces
+whose marks are spread evenly over one TTL, then checks continue at the same
+rate on a simulated clock, so every check also expires about one old nonce.
+The previous store (a full scan of every entry on each check) is kept here
+as a reference; it is only run up to ``--legacy-max`` entries because a
+single check at 1M entries takes tens of milliseconds.
+
+  python tools/bench_nonce_store.py
+  python tools/bench_nonce_store.py --live 10000,100000,1000000 --checks 50000 --json nonces.json
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+# Allow running from repo root
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "backend"))
+
+from app.nonce_store import NonceStore  # noqa: E402
+
+
+class LegacyNonceStore:
+    # The store as it was before time-bucketed expiry (for comparison only).
+    def __init__(self, ttl_seconds: int):
+        self.ttl_seconds = ttl_seconds
+        self._seen: Dict[Tuple[str, str], float] = {}
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+    def _purge(self, now: float) -> None:
+        expired = [k for k, exp in self._seen.items() if exp <= now]
+        for k in expired:
+            self._seen.pop(k, None)
+
+    def check_and_mark(self, tenant_id: str, nonce: str, now: Optional[float] = None) -> bool:
+        now = time.time() if now is None else now
+        self._purge(now)
+        key = (tenant_id, nonce)
+        if key in self._seen:
+            return False
+        self._seen[key] = now + float(self.ttl_seconds)
+        return True
+
+
+def _run(store: Any, live: int, checks: int, ttl: int) -> Dict[str, Any]:
+    step = ttl / live  # one check per step keeps ``live`` nonces alive
+    now = 1_000_000.0
+    for i in range(live):
+        store.check_and_mark("demo", f"fill_{i}", now=now)
+        now += step
+
+    samples: list[float] = []
+    started = time.perf_counter()
+    for i in range(checks):
+        t0 = time.perf_counter()
+        store.check_and_mark("demo", f"check_{i}", now=now)
+        samples.append(time.perf_counter() - t0)
+        now += step
+    elapsed = time.perf_counter() - started
+    samples.sort()
+    return {
+        "live": live,
+        "checks": checks,
+        "entries_after": len(store),
+        "checks_per_s": round(checks / elapsed) if elapsed > 0 else 0,
+        "p50_us": round(statistics.median(samples) * 1e6, 2),
+        "p99_us": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1e6, 2),
+        "max_us": round(samples[-1] * 1e6, 2),
+    }
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Benchmark nonce store check latency vs live entries")
+    ap.add_argument("--live", default="10000,100000,1000000", help="Comma-separated live nonce counts")
+    ap.add_argument("--checks", type=int, default=20000, help="Timed checks per size")
+    ap.add_argument("--ttl", type=int, default=900, help="Nonce TTL in seconds")
+    ap.add_argument("--legacy-max", type=int, default=10000, help="Largest size to run the full-scan store at")
+    ap.add_argument("--json", default="", help="Optional path to write the report as JSON")
+    args = ap.parse_args()
+
+    sizes = [int(p) for p in args.live.split(",") if p.strip()]
+    report: Dict[str, list] = {"bucketed": [], "legacy": []}
+    for live in sizes:
+        row = _run(NonceStore(ttl_seconds=args.ttl), live, max(1, args.checks), args.ttl)
+        report["bucketed"].append(row)
+        print(
+            f"bucketed  live={live:>8}  {row['checks_per_s']:>8}/s  p50={row['p50_us']:.2f}us  "
+            f"p99={row['p99_us']:.2f}us  max={row['max_us']:.1f}us  entries={row['entries_after']}"
+        )
+    for live in sizes:
+        if live > args.legacy_max:
+            continue
+        # The full scan makes every check O(live); fewer checks keep it short.
+        row = _run(LegacyNonceStore(ttl_seconds=args.ttl), live, max(1, min(args.checks, 2000)), args.ttl)
+        report["legacy"].append(row)
+        print(f"legacy    live={live:>8}  {row['checks_per_s']:>8}/s  p50={row['p50_us']:.2f}us  p99={row['p99_us']:.2f}us")
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2), encoding="utf-8")
+        print(f"Wrote: {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""Compare tesseract time and text accuracy with and without OCR preprocessing.
+
+Every receipt in the corpus is OCR'd as-is ("scan") and as a seeded phone
+photo of it ("photo": enlarged, rotated, on a cluttered table, unevenly lit,
+JPEG), once on the raw gray image and once after ``preprocess_for_ocr``
+(crop to the paper, deskew, resample to ``--dpi``, binarise).
+
+Accuracy is the fraction of expected words found in the OCR text. Expected
+text is a ``<name>.txt`` transcript next to the image if there is one, else
+the lines the receipt generator prints from the ``<name>.json`` sidecar
+(title, tier, user, tenant, merchant, amount).
+
+  python tools/bench_ocr_preprocess.py
+  python tools/bench_ocr_preprocess.py --dpi 300 --limit 10 --json ocr.json
+
+Without a tesseract binary only the preprocessing side is measured (time,
+pixels handed to OCR, detected paper and angle).
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import re
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+# Allow running from repo root
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "backend"))
+
+import cv2  # noqa: E402
+import numpy as np  # noqa: E402
+import pytesseract  # noqa: E402
+
+from app.config import TESSERACT_CMD  # noqa: E402
+from app.ocr_preprocess import preprocess_for_ocr  # noqa: E402
+
+if TESSERACT_CMD:
+    pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD
+
+_WORD_RE = re.compile(r"[a-z0-9$.]+")
+
+
+def expected_text(image: Path) -> str:
+    transcript = image.with_suffix(".txt")
+    if transcript.exists():
+        return transcript.read_text(encoding="utf-8")
+    sidecar = image.with_suffix(".json")
+    if not sidecar.exists():
+        return ""
+    meta = json.loads(sidecar.read_text(encoding="utf-8"))
+    lines = ["TAPSURE RECEIPT"]
+    if meta.get("tier"):
+        lines.append(f"Tier: {str(meta['tier']).upper()}")
+    if meta.get("user_id"):
+        lines.append(f"User ID: {meta['user_id']}")
+    if meta.get("tenant_id"):
+        lines.append(f"Tenant: {str(meta['tenant_id']).upper()}")
+    if meta.get("merchant"):
+        lines.append(f"Merchant: {meta['merchant']}")
+    if meta.get("amount_cents") is not None:
+        lines.append(f"Amount: ${int(meta['amount_cents']) / 100:.2f}")
+    return "\n".join(lines)
+
+
+def word_recall(expected: str, text: str) -> Optional[float]:
+    want = _WORD_RE.findall(expected.lower())
+    if not want:
+        return None
+    got = set(_WORD_RE.findall(text.lower()))
+    return sum(w in got for w in want) / len(want)
+
+
+def as_photo(gray: np.ndarray, rng: random.Random) -> tuple[np.ndarray, float]:
+    """A phone-photo rendering of a flat receipt image (seeded), and the angle it was turned by."""
+    scale = rng.uniform(2.0, 3.0)
+    paper = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
+    h, w = paper.shape
+    canvas_w, canvas_h = int(w * 1.6), int(h * 1.4)
+    np_rng = np.random.default_rng(rng.randrange(1 << 30))
+    table = cv2.GaussianBlur(np_rng.integers(30, 110, (canvas_h, canvas_w)).astype(np.uint8), (0, 0), 3)
+    angle = rng.uniform(-8.0, 8.0)
+    matrix = cv2.getRotationMatrix2D((w / 2.0, h / 2.0), angle, 1.0)
+    matrix[0, 2] += canvas_w / 2.0 + rng.uniform(-0.1, 0.1) * w - w / 2.0
+    matrix[1, 2] += canvas_h / 2.0 + rng.uniform(-0.05, 0.05) * h - h / 2.0
+    placed = cv2.warpAffine(paper, matrix, (canvas_w, canvas_h), flags=cv2.INTER_LINEAR)
+    mask = cv2.warpAffine(np.full_like(paper, 255), matrix, (canvas_w, canvas_h))
+    photo = np.where(mask > 0, placed, table).astype(np.float32)
+    # Light falling off across the frame.
+    light = np.linspace(1.0, rng.uniform(0.6, 0.8), canvas_w, dtype=np.float32)
+    photo = np.clip(photo * light[None, :], 0, 255).astype(np.uint8)
+    ok, buf = cv2.imencode(".jpg", photo, [cv2.IMWRITE_JPEG_QUALITY, 85])
+    return cv2.imdecode(buf, cv2.IMREAD_GRAYSCALE), angle
+
+
+def _ocr(gray: np.ndarray, config: str = "") -> tuple[str, float]:
+    started = time.perf_counter()
+    text = pytesseract.image_to_string(gray, config=config)
+    return text, time.perf_counter() - started
+
+
+def _tesseract_available() -> bool:
+    try:
+        pytesseract.get_tesseract_version()
+        return True
+    except Exception:
+        return False
+
+
+def bench_image(
+    gray: np.ndarray, turned: float, expected: str, dpi: int, paper_mm: float, ocr: bool
+) -> Dict[str, Any]:
+    prepared = preprocess_for_ocr(gray, target_dpi=dpi, paper_mm=paper_mm)
+    row: Dict[str, Any] = {
+        "pixels_raw": int(gray.size),
+        "pixels_pre": int(prepared.image.size),
+        "preprocess_ms": round(prepared.seconds * 1000.0, 1),
+        "paper_found": prepared.paper_found,
+        "angle": round(prepared.angle, 2),
+        # Deskewing by -turned undoes the photo's rotation.
+        "angle_error": round(abs(prepared.angle + turned), 2),
+        "scale": round(prepared.scale, 3),
+    }
+    if ocr:
+        raw_text, raw_s = _ocr(gray)
+        pre_text, pre_s = _ocr(prepared.image, f"--dpi {prepared.dpi}")
+        row.update(
+            tesseract_raw_ms=round(raw_s * 1000.0, 1),
+            tesseract_pre_ms=round(pre_s * 1000.0, 1),
+            accuracy_raw=word_recall(expected, raw_text),
+            accuracy_pre=word_recall(expected, pre_text),
+        )
+    return row
+
+
+def _mean(rows: List[Dict[str, Any]], key: str) -> Optional[float]:
+    values = [r[key] for r in rows if r.get(key) is not None]
+    return round(statistics.fmean(values), 3) if values else None
+
+
+def summarize(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    keys = [
+        "pixels_raw",
+        "pixels_pre",
+        "preprocess_ms",
+        "angle_error",
+        "tesseract_raw_ms",
+        "tesseract_pre_ms",
+        "accuracy_raw",
+        "accuracy_pre",
+    ]
+    out: Dict[str, Any] = {"images": len(rows), "paper_found": sum(r["paper_found"] for r in rows)}
+    out.update({k: _mean(rows, k) for k in keys})
+    return out
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Benchmark OCR preprocessing: tesseract time and text accuracy")
+    ap.add_argument("corpus", nargs="*", default=[str(ROOT / "test_receipts")], help="Image files or directories")
+    ap.add_argument("--dpi", type=int, default=300, help="Target DPI for preprocessing")
+    ap.add_argument("--paper-mm", type=float, default=80.0, help="Receipt paper width in mm")
+    ap.add_argument("--limit", type=int, default=0, help="Use at most N images (0 = all)")
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--json", default="", help="Optional path to write the report as JSON")
+    args = ap.parse_args()
+
+    files: List[Path] = []
+    for raw in args.corpus:
+        p = Path(raw)
+        files.extend(sorted(p.glob("*.png")) + sorted(p.glob("*.jpg")) if p.is_dir() else [p])
+    if args.limit:
+        files = files[: args.limit]
+    if not files:
+        print("No images found")
+        return 1
+
+    ocr = _tesseract_available()
+    if not ocr:
+        print("tesseract binary not found: measuring preprocessing only (set TESSERACT_CMD or install tesseract)")
+    rng = random.Random(args.seed)
+    results: Dict[str, List[Dict[str, Any]]] = {"scan": [], "photo": []}
+    for path in files:
+        gray = cv2.imread(str(path), cv2.IMREAD_GRAYSCALE)
+        if gray is None:
+            continue
+        expected = expected_text(path)
+        photo, turned = as_photo(gray, rng)
+        for variant, image, angle in (("scan", gray, 0.0), ("photo", photo, turned)):
+            row = bench_image(image, angle, expected, args.dpi, args.paper_mm, ocr)
+            row.update(file=path.name, variant=variant)
+            results[variant].append(row)
+
+    summary = {variant: summarize(rows) for variant, rows in results.items()}
+    for variant, s in summary.items():
+        line = (
+            f"{variant:<6} images={s['images']:>3}  paper_found={s['paper_found']:>3}  "
+            f"pixels raw={s['pixels_raw']:.0f} pre={s['pixels_pre']:.0f}  preprocess={s['preprocess_ms']}ms  angle_error={s['angle_error']}deg"
+        )
+        if ocr:
+            line += (
+                f"  tesseract raw={s['tesseract_raw_ms']}ms pre={s['tesseract_pre_ms']}ms"
+                f"  accuracy raw={s['accuracy_raw']} pre={s['accuracy_pre']}"
+            )
+        print(line)
+
+    if args.json:
+        report = {"dpi": args.dpi, "paper_mm": args.paper_mm, "tesseract": ocr, "summary": summary, "results": results}
+        Path(args.json).write_text(json.dumps(report, indent=2), encoding="utf-8")
+        print(f"Wrote: {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""Rank QR detector backends on an image corpus and suggest POS_QR_DETECTOR_BACKENDS.
+
+Runs fully offline over local fixtures:
+
+  python tools/bench_qr_backends.py
+  python tools/bench_qr_backends.py backend/fixtures test_qr_codes --repeat 3 --json out.json
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+# Allow running from repo root
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "backend"))
+
+from app.pos_qr import decode_qr  # noqa: E402
+from app.qr_detectors import available_backends  # noqa: E402
+
+
+IMAGE_SUFFIXES = {".png", ".jpg", ".jpeg", ".webp", ".bmp"}
+
+
+def _collect(paths: list[str]) -> list[Path]:
+    out: list[Path] = []
+    for raw in paths:
+        p = Path(raw)
+        if p.is_dir():
+            out.extend(sorted(f for f in p.rglob("*") if f.suffix.lower() in IMAGE_SUFFIXES))
+        elif p.is_file():
+            out.append(p)
+    return out
+
+
+def bench_backend(name: str, images: list[tuple[Path, bytes]], repeat: int) -> dict:
+    decoded = 0
+    latencies: list[float] = []
+    for _, data in images:
+        ok = False
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = decode_qr(data, backends=[name])
+            latencies.append((time.perf_counter() - started) * 1000.0)
+            ok = bool(result.texts)
+        decoded += int(ok)
+    latencies.sort()
+    return {
+        "backend": name,
+        "images": len(images),
+        "decoded": decoded,
+        "success_rate": decoded / len(images) if images else 0.0,
+        "median_ms": statistics.median(latencies) if latencies else 0.0,
+        "p95_ms": latencies[int(0.95 * (len(latencies) - 1))] if latencies else 0.0,
+    }
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Benchmark QR detector backends over local fixtures")
+    ap.add_argument("corpus", nargs="*", default=[str(ROOT / "backend" / "fixtures")], help="Image files or directories")
+    ap.add_argument("--backends", default="", help="Comma-separated backends (default: all available)")
+    ap.add_argument("--repeat", type=int, default=1, help="Decode each image this many times")
+    ap.add_argument("--json", default="", help="Optional path to write the report as JSON")
+    args = ap.parse_args()
+
+    files = _collect(args.corpus)
+    if not files:
+        print("NO_IMAGES_FOUND")
+        return 2
+    images = [(f, f.read_bytes()) for f in files]
+
+    names = [n.strip() for n in args.backends.split(",") if n.strip()] or available_backends()
+    rows = [bench_backend(n, images, max(1, args.repeat)) for n in names]
+
+    # Most accurate first; ties broken by latency.
+    rows.sort(key=lambda r: (-r["success_rate"], r["median_ms"]))
+    order = [r["backend"] for r in rows if r["decoded"]]
+
+    print(f"images={len(images)}")
+    for r in rows:
+        print(
+            f"{r['backend']:>8}  decoded={r['decoded']}/{r['images']}  "
+            f"median_ms={r['median_ms']:.1f}  p95_ms={r['p95_ms']:.1f}"
+        )
+    print(f"POS_QR_DETECTOR_BACKENDS={','.join(order)}")
+
+    if args.json:
+        Path(args.json).write_text(json.dumps({"results": rows, "order": order}, indent=2), encoding="utf-8")
+        print(f"Wrote: {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""Measure QR decode robustness and latency on degraded copies of local fixtures.
+
+Every fixture that decodes cleanly is re-encoded under seeded degradations
+(blur, rotation, perspective warp, JPEG quality, scale, glare) and decoded with
+each strategy. The report records success rate per degradation and latency
+percentiles per decode stage, so two versions can be compared:
+
+  python tools/bench_qr_decode.py --json before.json
+  python tools/bench_qr_decode.py --json after.json --baseline before.json
+
+Runs fully offline; the same ``--seed`` always produces the same images.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+from io import BytesIO
+from pathlib import Path
+from typing import Any, Callable, Dict
+
+# Allow running from repo root
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "backend"))
+
+import cv2  # noqa: E402
+import numpy as np  # noqa: E402
+from PIL import Image, ImageFilter  # noqa: E402
+
+from app.pos_qr import decode_qr  # noqa: E402
+
+
+IMAGE_SUFFIXES = {".png", ".jpg", ".jpeg", ".webp", ".bmp"}
+
+# decode_qr keyword arguments per strategy.
+STRATEGIES: Dict[str, Dict[str, Any]] = {
+    "default": {},
+    "full_frame": {"pyramid": False, "reduced": False},
+    "classic": {"backends": ["classic"]},
+    "aruco": {"backends": ["aruco"]},
+}
+
+
+def _collect(paths: list[str]) -> list[Path]:
+    out: list[Path] = []
+    for raw in paths:
+        p = Path(raw)
+        if p.is_dir():
+            out.extend(sorted(f for f in p.rglob("*") if f.suffix.lower() in IMAGE_SUFFIXES))
+        elif p.is_file():
+            out.append(p)
+    return out
+
+
+def _percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def _latency_summary(values: list[float]) -> dict:
+    return {
+        "n": len(values),
+        "p50_ms": round(_percentile(values, 0.50), 2),
+        "p90_ms": round(_percentile(values, 0.90), 2),
+        "p99_ms": round(_percentile(values, 0.99), 2),
+        "max_ms": round(max(values), 2) if values else 0.0,
+    }
+
+
+# --- degradations: (PIL RGB image, rng) -> (PIL RGB image, JPEG quality) ---
+
+def _none(img: Image.Image, rng: random.Random):
+    return img, 92
+
+
+def _blur(img: Image.Image, rng: random.Random):
+    return img.filter(ImageFilter.GaussianBlur(radius=rng.uniform(1.0, 2.5))), 92
+
+
+def _rotation(img: Image.Image, rng: random.Random):
+    angle = rng.uniform(5.0, 30.0) * rng.choice((-1, 1))
+    return img.rotate(angle, resample=Image.Resampling.BICUBIC, expand=True, fillcolor=(255, 255, 255)), 92
+
+
+def _perspective(img: Image.Image, rng: random.Random):
+    arr = np.asarray(img)
+    h, w = arr.shape[:2]
+    src = np.float32([[0, 0], [w, 0], [w, h], [0, h]])
+    jitter = [(rng.uniform(0.03, 0.12) * w, rng.uniform(0.03, 0.12) * h) for _ in range(4)]
+    signs = ((1, 1), (-1, 1), (-1, -1), (1, -1))  # move every corner inwards
+    dst = np.float32([[x + sx * dx, y + sy * dy] for (x, y), (sx, sy), (dx, dy) in zip(src, signs, jitter)])
+    matrix = cv2.getPerspectiveTransform(src, dst)
+    warped = cv2.warpPerspective(arr, matrix, (w, h), flags=cv2.INTER_LINEAR, borderValue=(255, 255, 255))
+    return Image.fromarray(warped), 92
+
+
+def _jpeg(img: Image.Image, rng: random.Random):
+    return img, rng.randint(10, 35)
+
+
+def _scale(img: Image.Image, rng: random.Random):
+    # Half the variants shrink (low-res scans), half blow up (phone photos).
+    factor = rng.uniform(0.45, 0.7) if rng.random() < 0.5 else rng.uniform(2.5, 4.5)
+    size = (max(1, int(img.width * factor)), max(1, int(img.height * factor)))
+    return img.resize(size, resample=Image.Resampling.BILINEAR), 92
+
+
+def _glare(img: Image.Image, rng: random.Random):
+    arr = np.asarray(img).astype(np.float32)
+    h, w = arr.shape[:2]
+    cx, cy = rng.uniform(0.2, 0.8) * w, rng.uniform(0.2, 0.8) * h
+    radius = rng.uniform(0.15, 0.35) * max(w, h)
+    yy, xx = np.mgrid[0:h, 0:w]
+    falloff = np.exp(-(((xx - cx) ** 2 + (yy - cy) ** 2) / (2 * radius**2)))
+    strength = rng.uniform(0.5, 0.85)
+    out = arr + (255.0 - arr) * (strength * falloff)[..., None]
+    return Image.fromarray(np.clip(out, 0, 255).astype(np.uint8)), 92
+
+
+DEGRADATIONS: Dict[str, Callable[[Image.Image, random.Random], tuple]] = {
+    "none": _none,
+    "blur": _blur,
+    "rotation": _rotation,
+    "perspective": _perspective,
+    "jpeg": _jpeg,
+    "scale": _scale,
+    "glare": _glare,
+}
+
+
+def _encode_jpeg(img: Image.Image, quality: int) -> bytes:
+    buf = BytesIO()
+    img.save(buf, format="JPEG", quality=quality)
+    return buf.getvalue()
+
+
+def build_cases(files: list[Path], names: list[str], variants: int, seed: int) -> list[dict]:
+    """Return ``{"image", "degradation", "variant", "data", "expected"}`` cases.
+
+    ``expected`` is what the default strategy decodes from the pristine file;
+    fixtures without a QR are skipped.
+    """
+    cases: list[dict] = []
+    for path in files:
+        raw = path.read_bytes()
+        expected = decode_qr(raw).texts
+        if not expected:
+            print(f"skip (no QR in original): {path}")
+            continue
+        img = Image.open(BytesIO(raw)).convert("RGB")
+        for name in names:
+            for variant in range(variants if name != "none" else 1):
+                # One RNG per (image, degradation, variant) keeps cases stable
+                # when fixtures or degradations are added.
+                rng = random.Random(f"{seed}:{path.name}:{name}:{variant}")
+                degraded, quality = DEGRADATIONS[name](img, rng)
+                cases.append(
+                    {
+                        "image": path.name,
+                        "degradation": name,
+                        "variant": variant,
+                        "data": _encode_jpeg(degraded, quality),
+                        "expected": expected[0],
+                    }
+                )
+    return cases
+
+
+def bench_strategy(name: str, kwargs: dict, cases: list[dict], repeat: int) -> dict:
+    by_degradation: Dict[str, dict] = {}
+    stage_ms: Dict[str, list[float]] = {}
+    winning: Dict[str, int] = {}
+    totals: list[float] = []
+    failures: list[dict] = []
+    for case in cases:
+        ok = False
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = decode_qr(case["data"], **kwargs)
+            totals.append((time.perf_counter() - started) * 1000.0)
+            ok = case["expected"] in result.texts
+            for stage, ms in result.timings_ms.items():
+                stage_ms.setdefault(stage, []).append(ms)
+        if ok and result.stage:
+            winning[result.stage] = winning.get(result.stage, 0) + 1
+        row = by_degradation.setdefault(case["degradation"], {"cases": 0, "decoded": 0})
+        row["cases"] += 1
+        row["decoded"] += int(ok)
+        if not ok:
+            failures.append({"image": case["image"], "degradation": case["degradation"], "variant": case["variant"]})
+
+    for row in by_degradation.values():
+        row["success_rate"] = round(row["decoded"] / row["cases"], 4)
+    decoded = sum(r["decoded"] for r in by_degradation.values())
+    return {
+        "strategy": name,
+        "kwargs": kwargs,
+        "cases": len(cases),
+        "decoded": decoded,
+        "success_rate": round(decoded / len(cases), 4) if cases else 0.0,
+        "latency": _latency_summary(totals),
+        "by_degradation": by_degradation,
+        "stages": {stage: _latency_summary(ms) for stage, ms in sorted(stage_ms.items())},
+        "winning_stages": dict(sorted(winning.items(), key=lambda kv: -kv[1])),
+        "failures": failures,
+    }
+
+
+def _print_comparison(rows: list[dict], baseline: dict, meta: dict) -> None:
+    prev_meta = baseline.get("meta", {})
+    mismatched = [k for k in ("seed", "variants", "images", "degradations") if prev_meta.get(k) != meta.get(k)]
+    if mismatched:
+        # Different case sets: deltas would not mean anything.
+        print(f"baseline not comparable (differs in {','.join(mismatched)})")
+        return
+    old = {r["strategy"]: r for r in baseline.get("results", [])}
+    for r in rows:
+        prev = old.get(r["strategy"])
+        if prev is None:
+            continue
+        d_rate = (r["success_rate"] - prev["success_rate"]) * 100.0
+        d_p50 = r["latency"]["p50_ms"] - prev["latency"]["p50_ms"]
+        d_p90 = r["latency"]["p90_ms"] - prev["latency"]["p90_ms"]
+        print(f"vs baseline {r['strategy']:>10}: success {d_rate:+.1f}pp  p50 {d_p50:+.1f}ms  p90 {d_p90:+.1f}ms")
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Benchmark QR decode on seeded degradations of local fixtures")
+    ap.add_argument("corpus", nargs="*", default=[str(ROOT / "backend" / "fixtures")], help="Image files or directories")
+    ap.add_argument("--strategies", default=",".join(STRATEGIES), help="Comma-separated strategies to run")
+    ap.add_argument("--degradations", default=",".join(DEGRADATIONS), help="Comma-separated degradations to apply")
+    ap.add_argument("--variants", type=int, default=3, help="Seeded variants per image and degradation")
+    ap.add_argument("--seed", type=int, default=1234)
+    ap.add_argument("--repeat", type=int, default=1, help="Decode each case this many times")
+    ap.add_argument("--json", default="", help="Optional path to write the report as JSON")
+    ap.add_argument("--baseline", default="", help="Earlier --json report to print deltas against")
+    args = ap.parse_args()
+
+    strategies = [s.strip() for s in args.strategies.split(",") if s.strip()]
+    degradations = [d.strip() for d in args.degradations.split(",") if d.strip()]
+    unknown = [s for s in strategies if s not in STRATEGIES] + [d for d in degradations if d not in DEGRADATIONS]
+    if unknown:
+        print(f"unknown: {','.join(unknown)}")
+        return 2
+
+    files = _collect(args.corpus)
+    if not files:
+        print("NO_IMAGES_FOUND")
+        return 2
+    cases = build_cases(files, degradations, max(1, args.variants), args.seed)
+    if not cases:
+        print("NO_DECODABLE_FIXTURES")
+        return 2
+
+    rows = [bench_strategy(s, STRATEGIES[s], cases, max(1, args.repeat)) for s in strategies]
+
+    print(f"cases={len(cases)} seed={args.seed}")
+    header = "".join(f"{d:>12}" for d in degradations)
+    print(f"{'strategy':>10}  {'success':>8}  {'p50_ms':>7}  {'p90_ms':>7}{header}")
+    for r in rows:
+        cells = "".join(f"{r['by_degradation'].get(d, {}).get('success_rate', 0.0):>12.2f}" for d in degradations)
+        print(
+            f"{r['strategy']:>10}  {r['success_rate']:>8.3f}  "
+            f"{r['latency']['p50_ms']:>7.1f}  {r['latency']['p90_ms']:>7.1f}{cells}"
+        )
+
+    meta = {
+        "seed": args.seed,
+        "variants": args.variants,
+        "repeat": args.repeat,
+        "images": sorted({c["image"] for c in cases}),
+        "degradations": degradations,
+        "python": platform.python_version(),
+        "opencv": cv2.__version__,
+    }
+    if args.baseline:
+        _print_comparison(rows, json.loads(Path(args.baseline).read_text(encoding="utf-8")), meta)
+
+    if args.json:
+        report = {"meta": meta, "results": rows}
+        Path(args.json).write_text(json.dumps(report, indent=2), encoding="utf-8")
+        print(f"Wrote: {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""Measure stateless token verification throughput (no QR decode, no nonce store).
+
+Compares the current ``check_token`` (MAC over the raw payload bytes, checked
+before JSON parsing) with the previous approach, kept here as a reference:
+parse the JSON, re-serialize it with sorted keys, then MAC.
+
+  python tools/bench_qr_verify.py
+  python tools/bench_qr_verify.py --tokens 20000 --tenants 5000 --json verify.json
+
+The ``registry`` column checks against prepared per-tenant HMAC state from
+``TenantKeyRegistry``; the key lookup line shows what parsing the
+``POS_TENANT_SECRETS`` JSON on every request cost.
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import hmac
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict
+
+# Allow running from repo root
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "backend"))
+
+from app.config import parse_tenant_secrets  # noqa: E402
+from app.pos_qr import TOKEN_PREFIX, _b64url_decode, build_token, check_token  # noqa: E402
+from app.tenant_keys import TenantKeyRegistry  # noqa: E402
+
+
+def legacy_check_token(token: str, tenant_secrets: Dict[str, str], max_age_seconds: int, max_future_skew_seconds: int):
+    # Verification as it was before the raw-bytes MAC (for comparison only).
+    parts = token.strip().split(".")
+    if len(parts) != 3 or parts[0] != TOKEN_PREFIX:
+        return False, "invalid_token_format", None
+    try:
+        payload = json.loads(_b64url_decode(parts[1]).decode("utf-8"))
+        sig = _b64url_decode(parts[2])
+    except ValueError:
+        return False, "invalid_token_format", None
+    if not isinstance(payload, dict):
+        return False, "invalid_payload", None
+    tenant_id = str(payload.get("tenant_id") or "")
+    nonce = str(payload.get("nonce") or "")
+    ts = payload.get("timestamp")
+    if not tenant_id or not nonce or not isinstance(ts, int):
+        return False, "missing_required_fields", payload
+    secret = tenant_secrets.get(tenant_id)
+    if not secret:
+        return False, "unknown_tenant", payload
+    payload_json = json.dumps(payload, separators=(",", ":"), sort_keys=True).encode("utf-8")
+    expected = hmac.new(secret.encode("utf-8"), payload_json, hashlib.sha256).digest()
+    if not hmac.compare_digest(expected, sig):
+        return False, "bad_signature", payload
+    now = int(time.time())
+    if ts > now + max_future_skew_seconds:
+        return False, "timestamp_in_future", payload
+    if now - ts > max_age_seconds:
+        return False, "expired", payload
+    return True, "ok", payload
+
+
+def _tokens(kind: str, n: int, secret: str) -> list[str]:
+    now = int(time.time())
+    out: list[str] = []
+    for i in range(n):
+        payload = {
+            "tenant_id": "demo",
+            "transaction_id": f"tx_{i}",
+            "timestamp": now,
+            "nonce": f"nonce_{i:08d}",
+            "merchant_id": "merchant_demo_001",
+            "plan_id": "plan_demo_12m",
+            "amount_cents": 1000 + i,
+            "currency": "USD",
+        }
+        if kind == "oversized":
+            payload["padding"] = "x" * 4096
+        out.append(build_token(payload, secret if kind != "bad_signature" else "not-the-secret"))
+    return out
+
+
+def _run_once(fn: Callable, tokens: list[str], secrets: Any) -> tuple:
+    reasons: Dict[str, int] = {}
+    started = time.perf_counter()
+    for t in tokens:
+        reason = fn(t, secrets, 3600, 60)[1]
+        reasons[reason] = reasons.get(reason, 0) + 1
+    return time.perf_counter() - started, reasons
+
+
+def bench(impls: Dict[str, tuple], tokens: list[str], repeat: int) -> Dict[str, dict]:
+    # Implementations take turns within each round so clock/thermal drift
+    # hits all of them alike; the best round counts.
+    best = {name: float("inf") for name in impls}
+    reasons: Dict[str, Dict[str, int]] = {}
+    for _ in range(repeat):
+        for name, (fn, secrets) in impls.items():
+            elapsed, reasons[name] = _run_once(fn, tokens, secrets)
+            best[name] = min(best[name], elapsed)
+    return {
+        name: {
+            "tokens_per_s": round(len(tokens) / best[name]) if best[name] > 0 else 0,
+            "us_per_token": round(best[name] / len(tokens) * 1e6, 2) if tokens else 0.0,
+            "reasons": reasons[name],
+        }
+        for name in impls
+    }
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Benchmark stateless POS QR token verification")
+    ap.add_argument("--tokens", type=int, default=10000, help="Tokens per workload")
+    ap.add_argument("--repeat", type=int, default=5, help="Best of this many runs")
+    ap.add_argument("--tenants", type=int, default=2000, help="Configured tenants (only 'demo' signs)")
+    ap.add_argument("--json", default="", help="Optional path to write the report as JSON")
+    args = ap.parse_args()
+
+    secrets = {f"tenant_{i:06d}": f"secret-{i:06d}-{'k' * 24}" for i in range(max(0, args.tenants - 1))}
+    secrets["demo"] = "dev-secret"
+    raw_env = json.dumps(secrets)
+    registry = TenantKeyRegistry.from_secrets(secrets)
+
+    # (implementation, key source it is handed)
+    impls: Dict[str, tuple] = {
+        "legacy": (legacy_check_token, secrets),
+        "raw_bytes": (check_token, secrets),
+        "registry": (check_token, registry),
+    }
+    report: Dict[str, Any] = {}
+    for kind in ("valid", "bad_signature", "oversized"):
+        tokens = _tokens(kind, max(1, args.tokens), secrets["demo"])
+        report[kind] = bench(impls, tokens, max(1, args.repeat))
+
+    for kind in ("valid", "bad_signature", "oversized"):
+        rows = report[kind]
+        base = rows["legacy"]["tokens_per_s"]
+        cells = "  ".join(
+            f"{name}={r['tokens_per_s']:>8}/s ({r['us_per_token']:.2f}us, x{r['tokens_per_s'] / base if base else 0.0:.2f})"
+            for name, r in rows.items()
+        )
+        print(f"{kind:>14}  {cells}  reasons={rows['registry']['reasons']}")
+
+    # What every request used to pay before the first token was even checked.
+    n = 200
+    started = time.perf_counter()
+    for _ in range(n):
+        parse_tenant_secrets(raw_env)
+    env_us = (time.perf_counter() - started) / n * 1e6
+    started = time.perf_counter()
+    for _ in range(n * 100):
+        registry.mac_for("demo")
+    lookup_us = (time.perf_counter() - started) / (n * 100) * 1e6
+    report["key_lookup"] = {"tenants": len(secrets), "env_parse_us": round(env_us, 2), "registry_us": round(lookup_us, 2)}
+    print(f"key lookup ({len(secrets)} tenants): env JSON parse {env_us:.1f}us/request  registry {lookup_us:.2f}us")
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2), encoding="utf-8")
+        print(f"Wrote: {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""Compare TSQR1 and TSQR2 tokens on the fixture payloads: QR version and decode time.
+
+Re-signs every payload found in backend/fixtures (the demo receipt and the
+profiles_9 manifest) in each format, renders it the way the demo generators
+do (a receipt canvas with the QR at ``--qr-px`` pixels) and times
+``decode_qr`` on it. Smaller prints are where dense codes fail first, so a
+second, smaller size is measured too.
+
+  python tools/bench_token_formats.py
+  python tools/bench_token_formats.py --qr-px 380,160 --repeat 5 --json formats.json
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import statistics
+import sys
+import time
+from io import BytesIO
+from pathlib import Path
+
+# Allow running from repo root
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "backend"))
+
+import qrcode  # noqa: E402
+from PIL import Image  # noqa: E402
+
+from app.pos_qr import build_token, decode_qr  # noqa: E402
+
+FIXTURES = ROOT / "backend" / "fixtures"
+
+# (label, build_token kwargs)
+FORMATS = (
+    ("TSQR1", {}),
+    ("TSQR2/16", {"prefix": "TSQR2", "mac_bytes": 16}),
+    ("TSQR2/8", {"prefix": "TSQR2", "mac_bytes": 8}),
+)
+
+
+def _payloads() -> list[tuple[str, dict, str]]:
+    out: list[tuple[str, dict, str]] = []
+    demo = FIXTURES / "demo_pos_qr_receipt.payload.json"
+    if demo.exists():
+        meta = json.loads(demo.read_text(encoding="utf-8"))
+        out.append(("demo_pos_qr_receipt", meta["payload"], meta["secret"]))
+    manifest = FIXTURES / "profiles_9" / "profiles_9.manifest.json"
+    if manifest.exists():
+        meta = json.loads(manifest.read_text(encoding="utf-8"))
+        for item in meta.get("items", []):
+            out.append((Path(item["png"]).stem, item["payload"], meta["secret"]))
+    return out
+
+
+def _render(token: str, qr_px: int) -> tuple[bytes, int]:
+    qr = qrcode.QRCode()
+    qr.add_data(token)
+    qr.make(fit=True)
+    qr_img = qr.make_image().convert("RGB").resize((qr_px, qr_px))
+    canvas = Image.new("RGB", (900, 550), color="white")
+    canvas.paste(qr_img, (500, max(0, (550 - qr_px) // 2)))
+    buf = BytesIO()
+    canvas.save(buf, format="PNG")
+    return buf.getvalue(), qr.version
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Measure QR version and decode time per token format")
+    ap.add_argument("--qr-px", default="380,160", help="Comma-separated printed QR sizes in pixels")
+    ap.add_argument("--repeat", type=int, default=3, help="Decode each image this many times (median)")
+    ap.add_argument("--json", default="", help="Optional path to write the report as JSON")
+    args = ap.parse_args()
+
+    payloads = _payloads()
+    if not payloads:
+        print("NO_FIXTURE_PAYLOADS")
+        return 2
+    sizes = [int(p) for p in args.qr_px.split(",") if p.strip()]
+    now = int(time.time())
+
+    rows: list[dict] = []
+    for label, kwargs in FORMATS:
+        versions: list[int] = []
+        lengths: list[int] = []
+        per_size: dict[int, dict] = {px: {"decoded": 0, "ms": []} for px in sizes}
+        for _, payload, secret in payloads:
+            token = build_token(dict(payload, timestamp=now), secret, **kwargs)
+            lengths.append(len(token))
+            for px in sizes:
+                data, version = _render(token, px)
+                timings = []
+                ok = False
+                for _ in range(max(1, args.repeat)):
+                    started = time.perf_counter()
+                    result = decode_qr(data)
+                    timings.append((time.perf_counter() - started) * 1000.0)
+                    ok = token in result.texts
+                per_size[px]["decoded"] += int(ok)
+                per_size[px]["ms"].append(statistics.median(timings))
+            versions.append(version)
+        rows.append(
+            {
+                "format": label,
+                "payloads": len(payloads),
+                "token_chars_median": statistics.median(lengths),
+                "qr_version_median": statistics.median(versions),
+                "qr_version_max": max(versions),
+                "sizes": {
+                    str(px): {
+                        "decoded": v["decoded"],
+                        "median_ms": round(statistics.median(v["ms"]), 2),
+                        "max_ms": round(max(v["ms"]), 2),
+                    }
+                    for px, v in per_size.items()
+                },
+            }
+        )
+
+    print(f"payloads={len(payloads)}")
+    for r in rows:
+        cells = "  ".join(
+            f"{px}px: {s['decoded']}/{r['payloads']} median={s['median_ms']:.1f}ms max={s['max_ms']:.1f}ms"
+            for px, s in r["sizes"].items()
+        )
+        print(
+            f"{r['format']:>9}  chars={r['token_chars_median']:>5.0f}  "
+            f"version={r['qr_version_median']:>4.1f} (max {r['qr_version_max']})  {cells}"
+        )
+
+    if args.json:
+        Path(args.json).write_text(json.dumps({"results": rows}, indent=2), encoding="utf-8")
+        print(f"Wrote: {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import argparse
 import json
 import time
 from pathlib import Path
@@ -43,8 +44,13 @@ def _receipt_like_qr(token: str, title: str, subtitle: str) -> Image.Image:
 
 
 def main() -> int:
+    ap = argparse.ArgumentParser(description="Write the 9 demo profile receipts with signed POS QR tokens")
+    ap.add_argument("--secret", default="dev-secret", help="Signing secret for tenant 'demo'")
+    ap.add_argument("--kid", default="", help="Key id to embed in every token")
+    args = ap.parse_args()
+
     tenant_id = "demo"
-    secret = "dev-secret"
+    secret = args.secret
     now = int(time.time())
 
     out_dir = ROOT / "backend" / "fixtures" / "profiles_9"
@@ -66,7 +72,7 @@ def main() -> int:
             "currency": "USD",
         }
 
-        token = build_token(payload, secret=secret)
+        token = build_token(payload, secret=secret, kid=args.kid or None)
         img = _receipt_like_qr(
             token,
             title="TapSure Demo Receipt (Profiles)",
@@ -85,7 +91,8 @@ def main() -> int:
     print(f"Wrote {len(manifest)} images to: {out_dir}")
     print(f"Wrote manifest: {manifest_path}")
     print("Set this env to verify:")
-    print('  POS_TENANT_SECRETS={"demo":"dev-secret"}')
+    keyring = {"keys": {args.kid: secret}} if args.kid else secret
+    print(f"  POS_TENANT_SECRETS={json.dumps({tenant_id: keyring}, separators=(',', ':'))}")
     return 0
 
 
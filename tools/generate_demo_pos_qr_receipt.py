@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import argparse
 import json
 import time
 from pathlib import Path
@@ -12,12 +13,29 @@ from PIL import Image, ImageDraw
 ROOT = Path(__file__).resolve().parents[1]
 sys.path.insert(0, str(ROOT / "backend"))
 
-from app.pos_qr import build_token
+from app.pos_qr import TOKEN_PREFIX, TOKEN_PREFIXES, build_token
+from app.tenant_keys import signing_key
 
 
 def main() -> int:
-    tenant_id = "demo"
-    secret = "dev-secret"
+    ap = argparse.ArgumentParser(description="Write a demo receipt PNG with a signed POS QR token")
+    ap.add_argument("--tenant", default="demo", help="Tenant id to sign for")
+    ap.add_argument("--secret", default="dev-secret", help="Signing secret (ignored with --keys-file)")
+    ap.add_argument("--keys-file", default="", help="Tenant keys JSON; sign with the tenant's active key or --kid")
+    ap.add_argument("--kid", default="", help="Key id to embed (and, with --keys-file, to sign with)")
+    ap.add_argument("--format", default=TOKEN_PREFIX, choices=TOKEN_PREFIXES, help="Token format")
+    ap.add_argument("--out-dir", default="backend/fixtures", help="Where to write the PNG and payload JSON")
+    args = ap.parse_args()
+
+    tenant_id = args.tenant
+    secret, kid = args.secret, args.kid
+    if args.keys_file:
+        entry = json.loads(Path(args.keys_file).read_text(encoding="utf-8")).get(tenant_id)
+        try:
+            kid, secret = signing_key(entry, kid or None)
+        except ValueError as e:
+            print(f"{e}: tenant={tenant_id} kid={kid or '(active)'}")
+            return 2
 
     payload = {
         "tenant_id": tenant_id,
@@ -30,7 +48,7 @@ def main() -> int:
         "currency": "USD",
     }
 
-    token = build_token(payload, secret=secret)
+    token = build_token(payload, secret=secret, prefix=args.format, kid=kid or None)
 
     qr_img = qrcode.make(token).convert("RGB")
     canvas = Image.new("RGB", (900, 550), color="white")
@@ -45,18 +63,23 @@ def main() -> int:
     qr_img = qr_img.resize((380, 380))
     canvas.paste(qr_img, (500, 140))
 
-    out_dir = Path("backend/fixtures")
+    out_dir = Path(args.out_dir)
     out_dir.mkdir(parents=True, exist_ok=True)
     out_path = out_dir / "demo_pos_qr_receipt.png"
     canvas.save(out_path)
 
     meta_path = out_dir / "demo_pos_qr_receipt.payload.json"
-    meta_path.write_text(json.dumps({"payload": payload, "token": token, "secret": secret}, indent=2), encoding="utf-8")
+    meta = {"payload": payload, "token": token, "secret": secret}
+    if kid:
+        meta["kid"] = kid
+    meta_path.write_text(json.dumps(meta, indent=2), encoding="utf-8")
 
     print(f"Wrote: {out_path}")
     print(f"Wrote: {meta_path}")
-    print("Set this env to verify it:")
-    print('  POS_TENANT_SECRETS={"demo":"dev-secret"}')
+    if not args.keys_file:
+        keyring = {"keys": {kid: secret}} if kid else secret
+        print("Set this env to verify it:")
+        print(f"  POS_TENANT_SECRETS={json.dumps({tenant_id: keyring}, separators=(',', ':'))}")
     return 0
 
 
@@ -12,8 +12,9 @@ import sys
 
 sys.path.insert(0, str(ROOT / "backend"))
 
-from app.config import get_pos_tenant_secrets  # noqa: E402
-from app.pos_qr import decode_qr_texts, get_nonce_store, verify_token  # noqa: E402
+from app.nonce_store import get_nonce_store  # noqa: E402
+from app.pos_qr import decode_qr, parse_region_hint, verify_token_candidates  # noqa: E402
+from app.tenant_keys import get_tenant_keys  # noqa: E402
 
 try:
     import cv2  # type: ignore
@@ -33,6 +34,11 @@ def main() -> int:
         default="",
         help="Optional crop as x,y,w,h (pixels) to isolate the QR region before decode",
     )
+    ap.add_argument(
+        "--region",
+        default=os.getenv("POS_QR_REGION", ""),
+        help="Placement hint tried before the whole frame, e.g. bottom:0.25 or x,y,w,h fractions",
+    )
     ap.add_argument(
         "--secrets",
         default=os.getenv("POS_TENANT_SECRETS", ""),
@@ -62,8 +68,12 @@ def main() -> int:
     else:
         print(f"image={img_path} bytes={len(data)}")
 
-    texts = decode_qr_texts(data)
-    print(f"decoded_count={len(texts)}")
+    region = parse_region_hint(args.region)
+    if args.region and region is None:
+        print(f"region_error=invalid_hint:{args.region}")
+    result = decode_qr(data, region=region)
+    texts = result.texts
+    print(f"decoded_count={len(texts)} stage={result.stage}")
     for i, t in enumerate(texts[:5]):
         print(f"[{i}] {t}")
 
@@ -82,7 +92,7 @@ def main() -> int:
                 if points is not None:
                     pts = points.tolist()
                     print(f"diag.points={json.dumps(pts)}")
-                    print("hint: try cropping tightly around the QR with --crop x,y,w,h")
+                    print("hint: try --region bottom:0.3 or crop tightly around the QR with --crop x,y,w,h")
             except Exception as e:
                 print(f"diag_error={type(e).__name__}:{e}")
         return 2
@@ -90,25 +100,27 @@ def main() -> int:
     if args.secrets.strip():
         os.environ["POS_TENANT_SECRETS"] = args.secrets
 
-    secrets = get_pos_tenant_secrets()
+    secrets = get_tenant_keys()
     if not secrets:
-        print("NO_SECRETS_CONFIGURED (set POS_TENANT_SECRETS)")
+        print("NO_SECRETS_CONFIGURED (set POS_TENANT_KEYS_FILE or POS_TENANT_SECRETS)")
         return 3
 
-    token = texts[0]
-    valid, reason, payload = verify_token(
-        token=token,
+    # Same candidates as the endpoints: every TSQR1 token, else the first text.
+    candidates = result.tokens or texts[:1]
+    outcome = verify_token_candidates(
+        candidates,
         tenant_secrets=secrets,
         nonce_store=get_nonce_store(),
         max_age_seconds=args.max_age,
         max_future_skew_seconds=args.max_future_skew,
     )
 
-    print(f"verify.valid={valid}")
-    print(f"verify.reason={reason}")
-    print("verify.payload=" + json.dumps(payload, indent=2, sort_keys=True, default=str))
+    print(f"verify.candidates={len(candidates)} tried={outcome.candidates_tried} index={outcome.candidate_index}")
+    print(f"verify.valid={outcome.valid}")
+    print(f"verify.reason={outcome.reason}")
+    print("verify.payload=" + json.dumps(outcome.payload, indent=2, sort_keys=True, default=str))
 
-    return 0 if valid else 4
+    return 0 if outcome.valid else 4
 
 
 if __name__ == "__main__":